@@ -5,3 +5,7 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     verbose_name = 'Фудграм'
+
+    def ready(self):
+        from . import (authentication, cache, images,  # noqa: F401
+                       ingredient_index, recipe_index, short_links, utils)
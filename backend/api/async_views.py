@@ -0,0 +1,134 @@
+"""Асинхронный путь чтения горячих запросов под ASGI.
+
+В Django 3.2 нет асинхронного ORM, поэтому обращения к базе и кэшу
+выполняются короткими синхронными функциями в общем пуле потоков: ожидание
+базы не занимает цикл событий, и один процесс обслуживает сотни
+соединений. Ответы совпадают с ответами DRF и разделяют с ними кэш
+ответов. Запросы с токеном и изменяющие запросы передаются синхронным
+представлениям DRF. Маршруты подключаются настройкой ``ASYNC_READ_VIEWS``.
+"""
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
+from rest_framework.renderers import JSONRenderer
+
+from . import views
+from .cache import RECIPES, cached_response, response_cache
+from .conditional import set_validator_headers, validator_headers
+from .ingredient_index import ingredient_index
+from .short_links import short_link_resolver
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor():
+    """Пул потоков для обращений к БД; его размер ограничивает число
+    одновременных соединений с базой из одного процесса."""
+    return ThreadPoolExecutor(settings.ASYNC_DB_THREADS,
+                              thread_name_prefix='async-db')
+
+
+def in_thread(func):
+    """Синхронная функция с обращениями к БД как корутина в пуле потоков.
+
+    Соединения потоков пула не закрываются сигналами запроса, поэтому
+    устаревшие соединения закрываются здесь.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(wrapper, thread_sensitive=False,
+                         executor=get_executor())
+
+
+def async_view(fallback):
+    """Асинхронное представление для анонимных GET-запросов, остальные
+    обрабатывает синхронное представление ``fallback``."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if (request.method != 'GET'
+                    or 'HTTP_AUTHORIZATION' in request.META):
+                return await sync_to_async(fallback)(
+                    request, *args, **kwargs)
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+def json_response(data):
+    return HttpResponse(JSONRenderer().render(data),
+                        content_type='application/json')
+
+
+async def cached_read(request, fallback, generations, *args, **kwargs):
+    """Ответ из кэша без DRF; при промахе ответ строит представление DRF
+    в пуле потоков и заодно сохраняет его в кэш (и учитывает промах)."""
+    def probe():
+        cached = response_cache.peek(
+            response_cache.get_key(request, generations))
+        if cached is not None:
+            response_cache.record(True)
+        return cached
+
+    cached = await in_thread(probe)()
+    if cached is not None:
+        return cached_response(request, cached, json_response)
+    return await in_thread(
+        lambda: fallback(request, *args, **kwargs).render())()
+
+
+@async_view(views.IngredientViewSet.as_view({'get': 'list'}))
+async def ingredient_list(request):
+    """Поиск ингредиентов по индексу в памяти."""
+    validators = await in_thread(ingredient_index.last_modified)()
+    search = in_thread(
+        lambda: ingredient_index.search(request.GET.get('name', '')))
+    if validators[0] is None:
+        return json_response(await search())
+    etag, last_modified = validator_headers(request, validators)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = json_response(await search())
+    set_validator_headers(response, etag, last_modified)
+    return response
+
+
+recipe_list_fallback = views.RecipeViewSet.as_view(
+    {'get': 'list', 'post': 'create'})
+recipe_detail_fallback = views.RecipeViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+    'delete': 'destroy',
+})
+
+
+@async_view(recipe_list_fallback)
+async def recipe_list(request):
+    return await cached_read(
+        request, recipe_list_fallback,
+        views.RecipeViewSet.get_cache_generations(request.GET))
+
+
+@async_view(recipe_detail_fallback)
+async def recipe_detail(request, pk):
+    return await cached_read(
+        request, recipe_detail_fallback, (RECIPES,), pk=pk)
+
+
+@async_view(views.recipe_redirect)
+async def recipe_redirect(request, short_id):
+    pk = await in_thread(short_link_resolver.resolve)(short_id)
+    if pk is None:
+        raise Http404
+    return redirect(f'/recipes/{pk}')
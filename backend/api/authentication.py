@@ -0,0 +1,217 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from recipe.models import Recipe
+
+User = get_user_model()
+
+STATS_FIELDS = ('local_hits', 'shared_hits', 'misses', 'invalidations')
+
+
+class TokenCache:
+    """Кэш разрешения токена в пользователя.
+
+    Первый уровень — LRU ограниченного размера с TTL в памяти процесса,
+    второй (если задан ``TOKEN_AUTH_SHARED_CACHE_ALIAS``) — общий кэш.
+    Хранятся сериализованные пользователь и токен, и каждый запрос
+    получает свою копию. Выход, смена пароля, деактивация, любое
+    изменение пользователя, его числа рецептов и копий аватара сбрасывают
+    его записи: в этом процессе сразу,
+    в остальных — через номер поколения пользователя в общем кэше, а без
+    общего кэша — по истечении TTL, поэтому по умолчанию он короткий.
+    """
+
+    prefix = 'token_auth'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._pending = Counter()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def shared(self):
+        alias = settings.TOKEN_AUTH_SHARED_CACHE_ALIAS
+        return caches[alias] if alias else None
+
+    @property
+    def stats_cache(self):
+        return caches[settings.REQUEST_STATS_CACHE_ALIAS]
+
+    def entry_key(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'{self.prefix}:token:{digest}'
+
+    def generation_key(self, user_id):
+        return f'{self.prefix}:generation:{user_id}'
+
+    def generation(self, user_id):
+        shared = self.shared
+        return 0 if shared is None else shared.get(
+            self.generation_key(user_id), 0)
+
+    def get(self, key):
+        """Пара (пользователь, токен) или ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            expires, user_id, generation, payload = entry
+            if expires > now and generation == self.generation(user_id):
+                self.record('local_hits')
+                return pickle.loads(payload)
+            self.discard(key)
+        shared = self.shared
+        if shared is not None:
+            cached = shared.get(self.entry_key(key))
+            if cached is not None:
+                user_id, payload = cached
+                self.store(key, user_id, self.generation(user_id), payload)
+                self.record('shared_hits')
+                return pickle.loads(payload)
+        self.record('misses')
+        return None
+
+    def set(self, key, user, token):
+        payload = pickle.dumps((user, token))
+        self.store(key, user.pk, self.generation(user.pk), payload)
+        shared = self.shared
+        if shared is not None:
+            shared.set(self.entry_key(key), (user.pk, payload),
+                       settings.TOKEN_AUTH_SHARED_CACHE_TTL)
+
+    def store(self, key, user_id, generation, payload):
+        expires = time.monotonic() + settings.TOKEN_AUTH_CACHE_TTL
+        with self._lock:
+            self._entries[key] = (expires, user_id, generation, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_AUTH_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate_user(self, user_id, keys=None):
+        """Сбрасывает записи пользователя; ``keys`` — его токены,
+        по умолчанию читаются из БД."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if entry[1] == user_id]:
+                del self._entries[key]
+        shared = self.shared
+        if shared is not None:
+            if keys is None:
+                keys = Token.objects.filter(
+                    user_id=user_id).values_list('key', flat=True)
+            shared.delete_many([self.entry_key(key) for key in keys])
+            try:
+                shared.incr(self.generation_key(user_id))
+            except ValueError:
+                shared.set(self.generation_key(user_id), 1, None)
+        self.record('invalidations')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def record(self, field):
+        with self._lock:
+            self._pending[field] += 1
+            due = (time.monotonic() - self._flushed_at
+                   >= settings.REQUEST_STATS_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        cache = self.stats_cache
+        for field, value in pending.items():
+            key = f'{self.prefix}:stats:{field}'
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.set(key, value, None)
+
+    def stats(self):
+        """Попадания по уровням, промахи и доля попаданий по всем
+        процессам, сбросившим счетчики в кэш."""
+        self.flush()
+        values = self.stats_cache.get_many(
+            [f'{self.prefix}:stats:{field}' for field in STATS_FIELDS])
+        stats = {field: values.get(f'{self.prefix}:stats:{field}', 0)
+                 for field in STATS_FIELDS}
+        hits = stats['local_hits'] + stats['shared_hits']
+        total = hits + stats['misses']
+        stats['hit_ratio'] = hits / total if total else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._lock:
+            self._pending.clear()
+        self.stats_cache.delete_many(
+            [f'{self.prefix}:stats:{field}' for field in STATS_FIELDS])
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` без запроса к БД при повторном токене."""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, user, token)
+        return user, token
+
+
+def invalidate_user(user_id, keys=None):
+    """Сброс сразу и повторно после фиксации транзакции: иначе
+    параллельный запрос успел бы закэшировать еще не измененную строку."""
+    token_cache.invalidate_user(user_id, keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(
+            lambda: token_cache.invalidate_user(user_id, keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_user(instance.user_id, [instance.key])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_author(sender, instance, created=True, **kwargs):
+    """Число рецептов автора меняется запросом ``update()``."""
+    if created:
+        invalidate_user(instance.author_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_changed_user(sender, instance, created=False,
+                            update_fields=None, **kwargs):
+    """Смена пароля, деактивация и изменение профиля."""
+    if created or (update_fields is not None
+                   and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_user(instance.pk)
@@ -0,0 +1,191 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe, urlencode
+from rest_framework.response import Response
+
+from recipe.models import Ingredient, Recipe, RecipeIngredient
+
+User = get_user_model()
+
+RECIPES = 'recipes'
+INGREDIENTS = 'ingredients'
+POPULARITY = 'popularity'
+
+
+class ResponseCache:
+    """Кэш ответов анонимным пользователям с ключами по поколениям.
+
+    В ключ ответа входят номера поколений данных, от которых он зависит.
+    Изменение данных увеличивает номер поколения, и старые ответы больше
+    не читаются, а вытесняются бэкендом кэша по таймауту. Начальный
+    номер поколения берется из текущего времени, чтобы вытесненный из
+    кэша номер не начинался заново с уже использованных значений.
+    """
+
+    prefix = 'response_cache'
+
+    def __init__(self, alias=None, timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias or getattr(
+            settings, 'RESPONSE_CACHE_ALIAS', 'default')]
+
+    def get_timeout(self):
+        return self.timeout or getattr(
+            settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+    def generation_key(self, name):
+        return f'{self.prefix}:generation:{name}'
+
+    def get_key(self, request, generations):
+        keys = [self.generation_key(name) for name in generations]
+        values = self.cache.get_many(keys)
+        missing = {key: int(time.time()) for key in keys
+                   if key not in values}
+        if missing:
+            self.cache.set_many(missing, None)
+            values.update(missing)
+        query = urlencode(sorted(request.GET.lists()), doseq=True)
+        digest = hashlib.md5(
+            f'{request.path}?{query}'.encode()).hexdigest()
+        version = '.'.join(str(values[key]) for key in keys)
+        return f'{self.prefix}:{version}:{digest}'
+
+    def bump(self, *generations):
+        for name in generations:
+            self.increment(self.generation_key(name), int(time.time()) + 1)
+
+    def increment(self, key, initial=1):
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, initial, None)
+
+    def get(self, key):
+        data = self.peek(key)
+        self.record(data is not None)
+        return data
+
+    def peek(self, key):
+        """Чтение без учета в статистике попаданий."""
+        return self.cache.get(key)
+
+    def record(self, hit):
+        self.increment(f'{self.prefix}:stats:{"hits" if hit else "misses"}')
+
+    def set(self, key, data):
+        self.cache.set(key, data, self.get_timeout())
+
+    def stats(self):
+        values = self.cache.get_many([
+            f'{self.prefix}:stats:hits', f'{self.prefix}:stats:misses'])
+        hits = values.get(f'{self.prefix}:stats:hits', 0)
+        misses = values.get(f'{self.prefix}:stats:misses', 0)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses,
+                'hit_ratio': hits / total if total else 0.0}
+
+    def reset_stats(self):
+        self.cache.delete_many([
+            f'{self.prefix}:stats:hits', f'{self.prefix}:stats:misses'])
+
+
+response_cache = ResponseCache()
+
+
+def is_process_local(cache):
+    """Бэкенд кэша, данные которого видны только текущему процессу:
+    счетчики из него не прочитать из команды управления."""
+    return isinstance(cache, (LocMemCache, DummyCache))
+
+
+def cached_response(request, cached, response_class=Response):
+    """Ответ из кэша с учетом заголовков условного запроса."""
+    data, headers = cached
+    response = None
+    if 'ETag' in headers:
+        response = get_conditional_response(
+            request, etag=headers['ETag'],
+            last_modified=parse_http_date_safe(headers.get('Last-Modified')))
+    if response is None:
+        response = response_class(data)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+class AnonymousResponseCacheMixin:
+    """Кэширование list и retrieve для неавторизованных GET-запросов.
+
+    Вместе с данными сохраняются заголовки ETag и Last-Modified, поэтому
+    условный запрос к закэшированному ответу обходится без БД.
+    """
+
+    cache_generations = ()
+    cached_headers = ('ETag', 'Last-Modified')
+
+    @classmethod
+    def get_cache_generations(cls, query_params):
+        return cls.cache_generations
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+        key = response_cache.get_key(
+            request, self.get_cache_generations(request.query_params))
+        cached = response_cache.get(key)
+        if cached is not None:
+            return cached_response(request, cached)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response_cache.set(key, (response.data, {
+                header: response[header] for header in self.cached_headers
+                if response.has_header(header)
+            }))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+def bump_on_commit(*names):
+    """Поколения увеличиваются после фиксации транзакции: иначе
+    параллельный запрос успел бы закэшировать под новым номером еще не
+    зафиксированные или неполные данные."""
+    transaction.on_commit(lambda: response_cache.bump(*names))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def bump_recipes_generation(**kwargs):
+    bump_on_commit(RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_generation(**kwargs):
+    bump_on_commit(RECIPES, INGREDIENTS)
+
+
+@receiver((post_save, post_delete), sender=User)
+def bump_authors_generation(update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_on_commit(RECIPES)
@@ -0,0 +1,66 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы (ETag и Last-Modified) для list и retrieve.
+
+    Валидаторы вычисляются дешевым запросом до сериализации; при
+    совпадении с заголовками клиента возвращается 304 Not Modified.
+    Представление переопределяет ``get_list_validators`` и
+    ``get_object_validators``, возвращающие время последнего изменения
+    и дополнительную строку для ETag, либо ``None``.
+    """
+
+    def get_list_validators(self, request):
+        return None
+
+    def get_object_validators(self, request, *args, **kwargs):
+        return None
+
+    def get_conditional(self, validators, handler, request, *args,
+                        **kwargs):
+        if validators is None or validators[0] is None:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = validator_headers(request, validators)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        set_validator_headers(response, etag, last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_conditional(
+            self.get_list_validators(request),
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_conditional(
+            self.get_object_validators(request, *args, **kwargs),
+            super().retrieve, request, *args, **kwargs)
+
+
+def validator_headers(request, validators):
+    """ETag и время изменения (timestamp) для валидаторов представления."""
+    last_modified, extra = validators
+    etag = quote_etag(hashlib.md5(
+        f'{last_modified.isoformat()}:{extra}:'
+        f'{request.get_full_path()}'.encode()).hexdigest())
+    return etag, int(last_modified.timestamp())
+
+
+def set_validator_headers(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+
+def queryset_validators(queryset, field='updated_at'):
+    """Время последнего изменения и число строк выборки одним запросом."""
+    values = queryset.order_by().aggregate(
+        last_modified=Max(field), count=Count('pk'))
+    return values['last_modified'], values['count']
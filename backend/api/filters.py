@@ -1,6 +1,18 @@
 from django.db.models import OuterRef, Exists
 from django_filters import rest_framework
-from recipe.models import ShoppingCart, Favorite, Recipe
+from rest_framework.filters import BaseFilterBackend
+from recipe.models import ShoppingCart, Favorite, Recipe, RecipePopularity
+
+POPULARITY_ORDERINGS = {
+    'popular': RecipePopularity.Period.ALL,
+    'popular_week': RecipePopularity.Period.WEEK,
+    'popular_day': RecipePopularity.Period.DAY,
+}
+
+
+def popularity_period(query_params):
+    """Период рейтинга из параметра ``ordering`` или ``None``."""
+    return POPULARITY_ORDERINGS.get(query_params.get('ordering'))
 
 
 class RecipeFilter(rest_framework.FilterSet):
@@ -57,3 +69,36 @@ class RecipeFilter(rest_framework.FilterSet):
                     )
                 )
         return favorite
+
+
+class RecipeSearchFilter(BaseFilterBackend):
+    """Полнотекстовый поиск по названию и описанию с ранжированием.
+
+    В режиме курсора ключом становится релевантность, чтобы страницы
+    шли в том же порядке, что и при limit/offset."""
+
+    search_param = 'search'
+    keyset_fields = ('-search_rank', 'id')
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        queryset = queryset.search(query)
+        if 'search_rank' in queryset.query.annotations:
+            view.keyset_fields = self.keyset_fields
+        return queryset
+
+
+class PopularityOrderingFilter(BaseFilterBackend):
+    """Сортировка по предрассчитанному рейтингу: ``ordering=popular``
+    за все время, ``popular_week`` и ``popular_day`` — за неделю и сутки."""
+
+    keyset_fields = ('-popularity', 'name', 'id')
+
+    def filter_queryset(self, request, queryset, view):
+        period = popularity_period(request.query_params)
+        if period is None:
+            return queryset
+        view.keyset_fields = self.keyset_fields
+        return queryset.order_by_popularity(period)
@@ -0,0 +1,206 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from recipe.models import Recipe
+from .authentication import invalidate_user
+from .cache import RECIPES, response_cache
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+_executor = None
+
+
+def get_setting(name, default):
+    return getattr(settings, f'IMAGE_{name}', default)
+
+
+def check_image_size(decoded_file):
+    """Проверка размеров изображения по заголовку, без декодирования."""
+    max_pixels = get_setting('MAX_PIXELS', 40_000_000)
+    try:
+        with Image.open(io.BytesIO(decoded_file)) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        width = height = max_pixels
+    except OSError:
+        raise serializers.ValidationError('Загрузите корректное изображение.')
+    if width * height > max_pixels:
+        raise serializers.ValidationError(
+            f'Изображение больше {max_pixels} пикселей.')
+
+
+class LimitedBase64ImageField(Base64ImageField):
+    """Base64ImageField с ограничением размера до полного декодирования.
+
+    Длина base64-строки проверяется до ее раскодирования, а число
+    пикселей — по заголовку файла до проверки изображения Pillow.
+    """
+
+    def to_internal_value(self, base64_data):
+        if isinstance(base64_data, str):
+            max_size = get_setting('MAX_UPLOAD_SIZE', 10 * 1024 * 1024)
+            payload = base64_data.rpartition(';base64,')[2]
+            if len(payload) * 3 // 4 > max_size:
+                raise serializers.ValidationError(
+                    f'Файл больше {max_size // (1024 * 1024)} МБ.')
+        return super().to_internal_value(base64_data)
+
+    def get_file_extension(self, filename, decoded_file):
+        check_image_size(decoded_file)
+        return super().get_file_extension(filename, decoded_file)
+
+
+class ImageVariantsField(serializers.Field):
+    """Абсолютные ссылки на уменьшенные копии изображения."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        return {
+            name: {
+                image_format: (
+                    request.build_absolute_uri(default_storage.url(path))
+                    if request else default_storage.url(path))
+                for image_format, path in formats.items()
+            }
+            for name, formats in variants.items() if name != 'source'
+        }
+
+
+def variant_path(source, name, image_format):
+    directory, filename = os.path.split(source)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants',
+                        f'{stem}_{name}.{EXTENSIONS[image_format]}')
+
+
+def render_variant(image, size, image_format):
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    if image_format == 'jpeg' and variant.mode != 'RGB':
+        background = Image.new('RGB', variant.size, 'white')
+        rgba = variant.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        variant = background
+    buffer = io.BytesIO()
+    variant.save(buffer, FORMATS[image_format],
+                 quality=get_setting('QUALITY', 80))
+    return buffer.getvalue()
+
+
+def build_variants(source):
+    """Создает уменьшенные копии в хранилище и возвращает их пути."""
+    with default_storage.open(source) as file:
+        image = Image.open(file)
+        width, height = image.size
+        if width * height > get_setting('MAX_PIXELS', 40_000_000):
+            raise ValueError(f'Изображение {source} слишком большое.')
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+    variants = {'source': source}
+    for name, size in get_setting('VARIANTS', {}).items():
+        variants[name] = {}
+        for image_format in get_setting('FORMATS', tuple(FORMATS)):
+            path = variant_path(source, name, image_format)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            variants[name][image_format] = default_storage.save(
+                path, ContentFile(render_variant(image, size, image_format)))
+    return variants
+
+
+def delete_variants(variants):
+    for name, formats in variants.items():
+        if name != 'source':
+            for path in formats.values():
+                default_storage.delete(path)
+
+
+def process_image(model, pk, image_field, variants_field):
+    """Создает копии текущего изображения объекта и сохраняет их пути."""
+    try:
+        instance = model.objects.filter(pk=pk).values(
+            image_field, variants_field).first()
+        if instance is None:
+            return
+        source, old_variants = instance[image_field], instance[variants_field]
+        if old_variants.get('source') == source:
+            return
+        variants = build_variants(source) if source else {}
+        updated = model.objects.filter(
+            pk=pk, **{image_field: source}
+        ).update(**{variants_field: variants})
+        if not updated:
+            delete_variants(variants)
+            return
+        delete_variants({
+            name: {
+                image_format: path for image_format, path in formats.items()
+                if path not in variants.get(name, {}).values()
+            }
+            for name, formats in old_variants.items() if name != 'source'
+        })
+        if model is Recipe:
+            recipes = Recipe.objects.filter(pk=pk)
+        else:
+            recipes = Recipe.objects.filter(author=pk)
+            invalidate_user(pk)
+        recipes.update(updated_at=now())
+        response_cache.bump(RECIPES)
+    except Exception:
+        logger.exception('Не удалось обработать изображение %s #%s',
+                         model.__name__, pk)
+    finally:
+        if not get_setting('PIPELINE_SYNC', False):
+            connection.close()
+
+
+def schedule_image(model, pk, image_field, variants_field):
+    """Ставит обработку изображения в очередь после фиксации транзакции."""
+    global _executor
+    if get_setting('PIPELINE_SYNC', False):
+        transaction.on_commit(lambda: process_image(
+            model, pk, image_field, variants_field))
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=get_setting('PIPELINE_WORKERS', 2),
+            thread_name_prefix='image-pipeline')
+    transaction.on_commit(lambda: _executor.submit(
+        process_image, model, pk, image_field, variants_field))
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_recipe_image(sender, instance, **kwargs):
+    if instance.image.name != instance.image_variants.get('source'):
+        schedule_image(Recipe, instance.pk, 'image', 'image_variants')
+
+
+@receiver(post_save, sender=User)
+def schedule_avatar(sender, instance, **kwargs):
+    if (instance.avatar.name or None) != (
+            instance.avatar_variants.get('source') or None):
+        schedule_image(User, instance.pk, 'avatar', 'avatar_variants')
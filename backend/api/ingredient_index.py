@@ -0,0 +1,108 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipe.models import Ingredient
+
+VERSION_CACHE_KEY = 'ingredient_index_version'
+
+
+class IngredientIndex:
+    """Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Строится лениво при первом запросе из отсортированного по названию
+    каталога и отвечает сначала совпадениями по началу названия, затем
+    по вхождению подстроки. Сбрасывается сигналами сохранения и удаления
+    ингредиента; версия в кэше позволяет сбросить индекс и в других
+    процессах при общем бэкенде кэша. Без него изменения из других
+    процессов (например, ``load_ingredients``) находит сверка времени
+    последнего изменения и числа ингредиентов с БД — не чаще раза
+    в ``INGREDIENT_INDEX_CHECK_INTERVAL`` секунд.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def _build(self):
+        entries, last_modified = [], None
+        for pk, name, unit, updated_at in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit', 'updated_at'):
+            entries.append({'id': pk, 'name': name, 'measurement_unit': unit})
+            if last_modified is None or updated_at > last_modified:
+                last_modified = updated_at
+        entries.sort(key=lambda entry: (entry['name'].casefold(),
+                                        entry['id']))
+        return ([entry['name'].casefold() for entry in entries], entries,
+                last_modified)
+
+    def _get(self):
+        version = cache.get(VERSION_CACHE_KEY, 0)
+        snapshot = self._snapshot
+        if snapshot is not None and self._version == version and (
+                time.monotonic() - self._checked_at
+                < settings.INGREDIENT_INDEX_CHECK_INTERVAL
+                or self._is_fresh(snapshot)):
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or self._version != version or (
+                    self._snapshot is snapshot):
+                self._snapshot = self._build()
+                self._version = version
+                self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def _is_fresh(self, snapshot):
+        """Сверка снимка с БД одним запросом агрегатов."""
+        _, entries, last_modified = snapshot
+        fingerprint = Ingredient.objects.aggregate(
+            last_modified=Max('updated_at'), count=Count('id'))
+        self._checked_at = time.monotonic()
+        return (fingerprint['last_modified'] == last_modified
+                and fingerprint['count'] == len(entries))
+
+    def last_modified(self):
+        """Время последнего изменения каталога и число ингредиентов."""
+        _, entries, last_modified = self._get()
+        return last_modified, len(entries)
+
+    def search(self, query=''):
+        """Список ингредиентов: сначала по началу названия,
+        затем по вхождению."""
+        keys, entries, _ = self._get()
+        query = query.casefold()
+        if not query:
+            return list(entries)
+        start = bisect_left(keys, query)
+        end = bisect_left(keys, query + '\U0010ffff', lo=start)
+        return entries[start:end] + [
+            entry for key, entry in zip(keys, entries)
+            if query in key and not key.startswith(query)
+        ]
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+ingredient_index = IngredientIndex()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    """Сброс после фиксации транзакции: иначе перестроение индекса
+    в параллельном запросе сохранило бы старый каталог под новой версией."""
+    transaction.on_commit(ingredient_index.invalidate)
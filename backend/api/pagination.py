@@ -1,6 +1,158 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import attrgetter, or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class PageToOffsetPagination(LimitOffsetPagination):
+    """Пагинация limit/offset с опциональным режимом курсора.
+
+    Если в запросе передан параметр ``cursor`` (в том числе пустой для
+    первой страницы), выборка идёт по ключу ``keyset_fields`` представления
+    без OFFSET и подсчёта общего числа объектов. Поле ключа с префиксом
+    ``-`` сортируется по убыванию.
+    """
+
     page_size = 6
     page_size_query_param = 'page'
+    cursor_query_param = 'cursor'
+    keyset_fields = ('name', 'id')
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.fields = getattr(view, 'keyset_fields', self.keyset_fields)
+        position, reverse = self.decode_cursor(
+            request.query_params[self.cursor_query_param])
+        if position is not None:
+            position = self.clean_position(queryset, position)
+
+        ordering = [self.flip(field) if reverse else field
+                    for field in self.fields]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.keyset_filter(position, reverse))
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.get_position(results[-1])
+            if (has_more and reverse) or (position and not reverse):
+                self.previous_position = self.get_position(results[0])
+        return results
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def keyset_filter(self, position, reverse):
+        """Условие «строго после позиции» для составного ключа."""
+        names = [field.lstrip('-') for field in self.fields]
+        return reduce(or_, (
+            Q(**dict(zip(names[:index], position[:index])),
+              **{f'{names[index]}__{self.lookup(field, reverse)}':
+                 position[index]})
+            for index, field in enumerate(self.fields)
+        ))
+
+    @staticmethod
+    def lookup(field, reverse):
+        return 'lt' if reverse != field.startswith('-') else 'gt'
+
+    def get_position(self, instance):
+        return [attrgetter(field.lstrip('-'))(instance)
+                for field in self.fields]
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            position, reverse = data['p'], bool(data['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or (
+                len(position) != len(self.fields)):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def clean_position(self, queryset, position):
+        """Приводит значения курсора к типам полей ключа."""
+        try:
+            position = [
+                self.key_field(queryset, field).to_python(value)
+                for field, value in zip(self.fields, position)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in position:
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    @staticmethod
+    def key_field(queryset, field):
+        name = field.lstrip('-')
+        annotation = queryset.query.annotations.get(name)
+        if annotation is not None:
+            return annotation.output_field
+        return queryset.model._meta.get_field(name)
+
+    def encode_cursor(self, position, reverse):
+        data = json.dumps({'p': position, 'r': int(reverse)})
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.offset_query_param)
+        return replace_query_param(
+            url, self.cursor_query_param,
+            base64.urlsafe_b64encode(data.encode()).decode())
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.next_position and self.encode_cursor(
+                self.next_position, False),
+            'previous': self.previous_position and self.encode_cursor(
+                self.previous_position, True),
+            'results': data,
+        })
+
+
+class FeedPagination(PageToOffsetPagination):
+    """Курсорная пагинация ленты вперед: позиция — id последнего рецепта
+    страницы, страницу читает функция ``read_page(before, limit)``."""
+
+    keyset_fields = ('-id',)
+
+    def paginate_feed(self, read_page, request):
+        self.keyset = True
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.fields = self.keyset_fields
+        position, _ = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param, ''))
+        if position is not None and not isinstance(position[0], int):
+            raise NotFound(self.invalid_cursor_message)
+        ids = read_page(position and position[0], self.limit + 1)
+        self.next_position = (
+            ids[self.limit - 1:self.limit] if len(ids) > self.limit
+            else None)
+        self.previous_position = None
+        return list(dict.fromkeys(ids[:self.limit]))
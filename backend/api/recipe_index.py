@@ -0,0 +1,418 @@
+"""Индекс рецептов по ингредиентам: похожие рецепты и подбор по продуктам.
+
+Разреженная матрица «рецепт × ингредиент» хранится в памяти процесса
+в трех видах: строки (ингредиенты рецепта, ``array('i')``), столбцы
+(списки рецептов с ингредиентом) и битовые множества — по целому числу
+на ингредиент, где бит с номером слота рецепта означает, что ингредиент
+входит в рецепт. Для похожих рецептов число общих ингредиентов со всеми
+остальными считается сложением столбцов в ``Counter`` — это цикл на C,
+а не self-join в SQL; готовые ответы хранятся до первого изменения
+матрицы. Подбор по продуктам складывает битовые множества поразрядно,
+сразу для всех рецептов.
+
+Снимок матрицы сохраняется в файл ``RECIPE_INDEX_PATH``, и новый
+процесс загружает его вместо полного чтения таблицы. Затем индекс
+догоняет БД по ``Recipe.updated_at`` и отметкам ``RecipeDeletion``
+об удаленных рецептах; рецепты, измененные в этом процессе, обновляются
+при следующем обращении.
+"""
+import heapq
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from recipe.models import Recipe, RecipeDeletion, RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class RecipeIndex:
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+        self._recipes = None
+        self._postings = None
+        self._slots = None
+        self._slot_recipes = None
+        self._bits = None
+        self._sizes = None
+        self._watermark = None
+        self._synced_at = 0.0
+        self._dirty = set()
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._recipes or ())
+
+    def recipe_ids(self):
+        with self._lock:
+            return list(self._recipes or ())
+
+    def ingredient_ids(self):
+        with self._lock:
+            return [ingredient_id
+                    for ingredient_id, bits in (self._bits or {}).items()
+                    if bits]
+
+    @property
+    def loaded(self):
+        return self._recipes is not None
+
+    def get_path(self):
+        return self.path or settings.RECIPE_INDEX_PATH
+
+    def load_rows(self, rows, watermark=None):
+        """Заполняет индекс парами (id рецепта, id ингредиента)."""
+        recipes = defaultdict(list)
+        for recipe_id, ingredient_id in rows:
+            recipes[recipe_id].append(ingredient_id)
+        self.load_recipes({
+            recipe_id: array('i', sorted(ingredients))
+            for recipe_id, ingredients in recipes.items()
+        }, watermark)
+
+    def load_recipes(self, recipes, watermark=None):
+        """Заполняет индекс строками матрицы: ``{id рецепта:
+        array('i') с отсортированными id ингредиентов}``."""
+        postings = defaultdict(list)
+        for recipe_id, ingredients in recipes.items():
+            for ingredient_id in ingredients:
+                postings[ingredient_id].append(recipe_id)
+        with self._lock:
+            self._recipes = recipes
+            self._postings = dict(postings)
+            self._assign_slots(sorted(recipes))
+            self._watermark = watermark
+            self._synced_at = time.monotonic()
+            self._results.clear()
+
+    def _assign_slots(self, slot_recipes):
+        """Нумерует рецепты по порядку ``slot_recipes`` и заново строит
+        битовые множества."""
+        slots = {recipe_id: slot
+                 for slot, recipe_id in enumerate(slot_recipes)}
+        sizes = defaultdict(list)
+        for recipe_id, ingredients in self._recipes.items():
+            sizes[len(ingredients)].append(slots[recipe_id])
+        self._slots = slots
+        self._slot_recipes = slot_recipes
+        self._bits = {
+            ingredient_id: bitset([slots[recipe_id]
+                                   for recipe_id in recipe_ids])
+            for ingredient_id, recipe_ids in self._postings.items()
+        }
+        self._sizes = {size: bitset(size_slots)
+                       for size, size_slots in sizes.items()}
+
+    def build(self):
+        """Полное построение по таблице состава рецептов."""
+        started = now()
+        self.load_rows(
+            RecipeIngredient.objects.order_by().values_list(
+                'recipe_id', 'ingredient_id').iterator(chunk_size=10000),
+            watermark=started)
+
+    def save(self):
+        path = self.get_path()
+        with self._lock:
+            snapshot = pickle.dumps({
+                'version': SNAPSHOT_VERSION, 'watermark': self._watermark,
+                'recipes': self._recipes,
+            }, protocol=pickle.HIGHEST_PROTOCOL)
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory,
+                                         delete=False) as file:
+            file.write(snapshot)
+        os.replace(file.name, path)
+
+    def load(self):
+        """Загружает снимок; ``False``, если его нет или он устарел."""
+        try:
+            with open(self.get_path(), 'rb') as file:
+                snapshot = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            return False
+        self.load_recipes(snapshot['recipes'], snapshot['watermark'])
+        return True
+
+    def ensure(self):
+        """Загрузка или построение при первом обращении, затем догон
+        изменений не чаще раза в ``RECIPE_INDEX_SYNC_INTERVAL``."""
+        if not self.loaded:
+            with self._loading:
+                if not self.loaded:
+                    self.initialize()
+        elif (time.monotonic() - self._synced_at
+              >= settings.RECIPE_INDEX_SYNC_INTERVAL):
+            self.sync()
+        if self._dirty:
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            self.refresh(dirty)
+
+    def initialize(self):
+        if not self.load():
+            self.build()
+            try:
+                self.save()
+            except OSError as error:
+                logger.warning('Снимок индекса рецептов не сохранен: %s',
+                               error)
+        self.sync()
+
+    def sync(self):
+        """Перечитывает рецепты, измененные после снимка, и убирает
+        удаленные с тех пор — в том числе другими процессами. Окно
+        ``RECIPE_INDEX_SYNC_LAG`` покрывает транзакции, которые
+        зафиксировались позже, чем изменили ``updated_at``. Снимок старше
+        срока хранения отметок об удалении сверяется со всеми id."""
+        started = now()
+        recipes = Recipe.objects.all()
+        deleted = []
+        if self._watermark is not None:
+            since = self._watermark - timedelta(
+                seconds=settings.RECIPE_INDEX_SYNC_LAG)
+            recipes = recipes.filter(updated_at__gte=since)
+            if since >= started - timedelta(
+                    seconds=settings.RECIPE_INDEX_DELETIONS_TTL):
+                deleted = list(RecipeDeletion.objects.filter(
+                    deleted_at__gte=since).values_list(
+                    'recipe_id', flat=True))
+            else:
+                existing = set(Recipe.objects.values_list('pk', flat=True))
+                with self._lock:
+                    deleted = [recipe_id for recipe_id in self._recipes
+                               if recipe_id not in existing]
+        self.refresh(deleted + list(recipes.values_list('pk', flat=True)))
+        with self._lock:
+            self._watermark = started
+            self._synced_at = time.monotonic()
+
+    def refresh(self, recipe_ids):
+        """Заменяет строки матрицы для рецептов заново прочитанными."""
+        rows = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids).order_by().values_list(
+                'recipe_id', 'ingredient_id'):
+            rows[recipe_id].append(ingredient_id)
+        with self._lock:
+            for recipe_id in recipe_ids:
+                if recipe_id in rows:
+                    self._set(recipe_id, rows[recipe_id])
+                else:
+                    self._remove(recipe_id)
+
+    def _set(self, recipe_id, ingredients):
+        ingredients = array('i', sorted(ingredients))
+        previous = self._recipes.get(recipe_id)
+        if previous == ingredients:
+            return
+        self._results.clear()
+        if previous is None:
+            # Новый рецепт получает следующий слот; освободившиеся
+            # убираются сжатием в _remove.
+            slot = self._slots[recipe_id] = len(self._slot_recipes)
+            self._slot_recipes.append(recipe_id)
+        else:
+            # Измененный рецепт остается в своем слоте.
+            slot = self._slots[recipe_id]
+            self._unlink(recipe_id, previous, slot)
+        self._recipes[recipe_id] = ingredients
+        bit = 1 << slot
+        for ingredient_id in ingredients:
+            self._postings.setdefault(ingredient_id, []).append(recipe_id)
+            self._bits[ingredient_id] = self._bits.get(ingredient_id, 0) | bit
+        self._sizes[len(ingredients)] = self._sizes.get(
+            len(ingredients), 0) | bit
+
+    def _remove(self, recipe_id):
+        ingredients = self._recipes.pop(recipe_id, None)
+        if ingredients is None:
+            return
+        self._results.clear()
+        slot = self._slots.pop(recipe_id)
+        self._slot_recipes[slot] = None
+        self._unlink(recipe_id, ingredients, slot)
+        # Когда свободных слотов больше, чем занятых, рецепты
+        # перенумеровываются в прежнем порядке, и битовые множества
+        # снова занимают не больше двух битов на рецепт.
+        if len(self._slot_recipes) > 2 * len(self._recipes):
+            self._assign_slots([other for other in self._slot_recipes
+                                if other is not None])
+
+    def _unlink(self, recipe_id, ingredients, slot):
+        bit = 1 << slot
+        for ingredient_id in ingredients:
+            self._postings[ingredient_id].remove(recipe_id)
+            self._bits[ingredient_id] ^= bit
+        self._sizes[len(ingredients)] ^= bit
+
+    def clear(self):
+        """Сбрасывает индекс; следующее обращение загрузит его заново."""
+        with self._lock:
+            self._recipes = self._postings = self._watermark = None
+            self._slots = self._slot_recipes = None
+            self._bits = self._sizes = None
+            self._dirty.clear()
+            self._results.clear()
+
+    def mark_changed(self, recipe_id):
+        if self.loaded:
+            with self._lock:
+                self._dirty.add(recipe_id)
+
+    def remove(self, recipe_id):
+        if self.loaded:
+            with self._lock:
+                self._dirty.discard(recipe_id)
+                self._remove(recipe_id)
+
+    def similar(self, recipe_id, limit):
+        """До ``limit`` пар (id рецепта, коэффициент Жаккара) по убыванию
+        сходства, при равенстве — по возрастанию id."""
+        self.ensure()
+        return self.rank(recipe_id, limit)
+
+    def rank(self, recipe_id, limit):
+        """Ранжирование по уже загруженной матрице, без обращения к БД."""
+        with self._lock:
+            cached = self._results.get((recipe_id, limit))
+            if cached is not None:
+                self._results.move_to_end((recipe_id, limit))
+                return cached
+            ingredients = self._recipes.get(recipe_id)
+            if not ingredients:
+                return []
+            overlaps = Counter()
+            for ingredient_id in ingredients:
+                overlaps.update(self._postings[ingredient_id])
+            del overlaps[recipe_id]
+            size = len(ingredients)
+            recipes = self._recipes
+            best = []
+            # Сходство не больше overlap / size, поэтому кандидаты
+            # перебираются по убыванию числа общих ингредиентов, пока
+            # эта граница не станет ниже худшего из лучших.
+            by_overlap = defaultdict(list)
+            for other, overlap in overlaps.items():
+                by_overlap[overlap].append(other)
+            for overlap in sorted(by_overlap, reverse=True):
+                if len(best) == limit and overlap / size < best[0][0]:
+                    break
+                for other in by_overlap[overlap]:
+                    item = (overlap / (size + len(recipes[other]) - overlap),
+                            -other)
+                    if len(best) < limit:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+            result = [(-other, score)
+                      for score, other in sorted(best, reverse=True)]
+            self._results[recipe_id, limit] = result
+            if len(self._results) > settings.RECIPE_INDEX_RESULTS_SIZE:
+                self._results.popitem(last=False)
+        return result
+
+    def pantry(self, ingredient_ids, limit, max_missing=None):
+        """До ``limit`` рецептов, которые можно приготовить из продуктов
+        ``ingredient_ids``: тройки (id рецепта, число имеющихся
+        ингредиентов, отсортированные id недостающих).
+
+        Сначала рецепты с большим числом имеющихся ингредиентов, затем
+        с меньшим числом недостающих, при равенстве — в порядке
+        добавления в индекс.
+        """
+        self.ensure()
+        return self.match(ingredient_ids, limit, max_missing)
+
+    def match(self, ingredient_ids, limit, max_missing=None):
+        """Подбор по уже загруженной матрице, без обращения к БД."""
+        pantry = set(ingredient_ids)
+        with self._lock:
+            # Поразрядный счетчик: planes[i] — i-й бит числа имеющихся
+            # ингредиентов у каждого рецепта.
+            planes = []
+            for ingredient_id in pantry:
+                carry = self._bits.get(ingredient_id, 0)
+                for level, plane in enumerate(planes):
+                    if not carry:
+                        break
+                    planes[level], carry = plane ^ carry, plane & carry
+                if carry:
+                    planes.append(carry)
+            everything = (1 << len(self._slot_recipes)) - 1
+            remaining = 0
+            for plane in planes:
+                remaining |= plane
+            found = []
+            for matched in range(min(len(pantry), 2 ** len(planes) - 1),
+                                 0, -1):
+                if not remaining or len(found) == limit:
+                    break
+                exact = remaining
+                for level, plane in enumerate(planes):
+                    exact &= plane if matched >> level & 1 else (
+                        everything ^ plane)
+                remaining ^= exact
+                for size in sorted(self._sizes):
+                    if size < matched or (
+                            max_missing is not None
+                            and size - matched > max_missing):
+                        continue
+                    group = exact & self._sizes[size]
+                    while group and len(found) < limit:
+                        lowest = group & -group
+                        group ^= lowest
+                        found.append((self._slot_recipes[
+                            lowest.bit_length() - 1], matched))
+                    if len(found) == limit:
+                        break
+            return [
+                (recipe_id, matched, [
+                    ingredient_id
+                    for ingredient_id in self._recipes[recipe_id]
+                    if ingredient_id not in pantry
+                ])
+                for recipe_id, matched in found
+            ]
+
+
+def bitset(positions):
+    """Целое число с установленными битами ``positions``."""
+    if not positions:
+        return 0
+    data = bytearray(max(positions) // 8 + 1)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, 'little')
+
+
+recipe_index = RecipeIndex()
+
+
+@receiver(post_save, sender=Recipe)
+def mark_recipe_changed(sender, instance, **kwargs):
+    recipe_index.mark_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_deleted_recipe(sender, instance, **kwargs):
+    recipe_index.remove(instance.pk)
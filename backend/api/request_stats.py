@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+COUNTERS = ('requests', 'time_us', 'sampled', 'queries', 'sql_time_us',
+            'duplicates', 'n_plus_one')
+
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+
+
+def fingerprint(sql):
+    """SQL без значений: одинаковые запросы с разными параметрами
+    и длиной списков IN дают один отпечаток."""
+    sql = IN_LIST.sub('(%s, ...)', sql)
+    sql = STRING.sub('%s', sql)
+    return NUMBER.sub('N', sql)
+
+
+class QueryRecorder:
+    """Число, время и отпечатки SQL-запросов во всех базах данных."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(
+                connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.fingerprints.values())
+
+    def most_repeated(self):
+        """Самый повторяющийся запрос и число его выполнений."""
+        if not self.fingerprints:
+            return None, 0
+        return self.fingerprints.most_common(1)[0]
+
+
+class RequestStats:
+    """Статистика запросов по маршрутам.
+
+    Счетчики копятся в памяти процесса и периодически сбрасываются в кэш
+    прибавлением (``incr``), поэтому сводка по всем процессам доступна
+    команде ``request_stats`` и представлению для персонала.
+    """
+
+    prefix = 'request_stats'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = defaultdict(Counter)
+        self._samples = {}
+        self._flushed_at = time.monotonic()
+
+    @property
+    def cache(self):
+        return caches[settings.REQUEST_STATS_CACHE_ALIAS]
+
+    def key(self, route, field):
+        digest = hashlib.md5(route.encode()).hexdigest()
+        return f'{self.prefix}:{digest}:{field}'
+
+    def add(self, route, elapsed, recorder=None):
+        elapsed_ms = elapsed * 1000
+        bucket = next((limit for limit in LATENCY_BUCKETS
+                       if elapsed_ms <= limit), 'inf')
+        with self._lock:
+            stats = self._pending[route]
+            stats['requests'] += 1
+            stats['time_us'] += int(elapsed * 1e6)
+            stats[f'le_{bucket}'] += 1
+            if recorder is not None:
+                stats['sampled'] += 1
+                stats['queries'] += recorder.count
+                stats['sql_time_us'] += int(recorder.time * 1e6)
+                stats['duplicates'] += recorder.duplicates
+                sql, repeats = recorder.most_repeated()
+                if repeats >= settings.REQUEST_STATS_N_PLUS_ONE_THRESHOLD:
+                    stats['n_plus_one'] += 1
+                    self._samples[route] = {'sql': sql, 'repeats': repeats}
+            due = (time.monotonic() - self._flushed_at
+                   >= settings.REQUEST_STATS_FLUSH_INTERVAL)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(Counter)
+            samples, self._samples = self._samples, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return
+        cache = self.cache
+        for route, stats in pending.items():
+            for field, value in stats.items():
+                key = self.key(route, field)
+                try:
+                    cache.incr(key, value)
+                except ValueError:
+                    cache.set(key, value, None)
+        cache.set_many({self.key(route, 'n_plus_one_sample'): sample
+                        for route, sample in samples.items()}, None)
+        routes_key = f'{self.prefix}:routes'
+        routes = cache.get(routes_key, set())
+        if not pending.keys() <= routes:
+            cache.set(routes_key, routes | pending.keys(), None)
+
+    def routes(self):
+        return sorted(self.cache.get(f'{self.prefix}:routes', set()))
+
+    def fields(self):
+        return (*COUNTERS, *(f'le_{limit}' for limit in LATENCY_BUCKETS),
+                'le_inf', 'n_plus_one_sample')
+
+    def summary(self):
+        """Сводка по маршрутам: среднее, перцентили по гистограмме,
+        SQL по выборке запросов и пример повторяющегося запроса."""
+        self.flush()
+        routes = self.routes()
+        values = self.cache.get_many([
+            self.key(route, field)
+            for route in routes for field in self.fields()
+        ])
+        summary = {}
+        for route in routes:
+            stats = {field: values.get(self.key(route, field), 0)
+                     for field in self.fields()}
+            requests, sampled = stats['requests'], stats['sampled']
+            if not requests:
+                continue
+            summary[route] = {
+                'requests': requests,
+                'avg_ms': stats['time_us'] / requests / 1000,
+                **self.percentiles(stats, requests),
+                'sampled': sampled,
+                'avg_queries': (stats['queries'] / sampled
+                                if sampled else None),
+                'avg_sql_ms': (stats['sql_time_us'] / sampled / 1000
+                               if sampled else None),
+                'duplicate_queries': stats['duplicates'],
+                'n_plus_one_requests': stats['n_plus_one'],
+                'n_plus_one_sample': stats['n_plus_one_sample'] or None,
+            }
+        return summary
+
+    @staticmethod
+    def percentiles(stats, requests):
+        """Верхние границы корзин гистограммы для p50, p95 и p99."""
+        result = {}
+        for name, share in (('p50_ms', 0.5), ('p95_ms', 0.95),
+                            ('p99_ms', 0.99)):
+            seen = 0
+            for limit in (*LATENCY_BUCKETS, 'inf'):
+                seen += stats[f'le_{limit}']
+                if seen >= requests * share:
+                    result[name] = limit if limit != 'inf' else None
+                    break
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._pending.clear()
+            self._samples.clear()
+        routes = self.routes()
+        self.cache.delete_many([
+            self.key(route, field)
+            for route in routes for field in self.fields()
+        ] + [f'{self.prefix}:routes'])
+
+
+request_stats = RequestStats()
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return f'{request.method} <unresolved>'
+    return f'{request.method} {match.view_name or match.route}'
+
+
+class RequestStatsMiddleware:
+    """Время обработки запроса, а для доли ``REQUEST_STATS_SAMPLE_RATE``
+    запросов — число, время и повторы SQL-запросов.
+
+    Результат добавляется в заголовок ``Server-Timing`` и в статистику
+    по маршрутам. Учитываются запросы к БД из потока обработки запроса:
+    запросы при чтении потокового ответа и в пуле потоков асинхронных
+    представлений не попадают в выборку. Под ASGI промежуточный слой
+    работает в цикле событий и учитывает только время обработки.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = asyncio.iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        sampled = random.random() < settings.REQUEST_STATS_SAMPLE_RATE
+        recorder = QueryRecorder() if sampled else None
+        started = time.perf_counter()
+        if recorder is None:
+            response = self.get_response(request)
+        else:
+            with recorder:
+                response = self.get_response(request)
+        return self.record(request, response, started, recorder)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        return self.record(request, response, started)
+
+    @staticmethod
+    def record(request, response, started, recorder=None):
+        elapsed = time.perf_counter() - started
+        request_stats.add(route_name(request), elapsed, recorder)
+        if settings.REQUEST_STATS_SERVER_TIMING:
+            timings = [f'app;dur={elapsed * 1000:.1f}']
+            if recorder is not None:
+                timings.append(
+                    f'db;dur={recorder.time * 1000:.1f};'
+                    f'desc="{recorder.count} queries, '
+                    f'{recorder.duplicates} duplicates"')
+            response['Server-Timing'] = ', '.join(timings)
+        return response
@@ -1,37 +1,40 @@
 from rest_framework import serializers
 from collections import Counter
 from recipe.models import (Ingredient, Recipe, RecipeIngredient,
-                           Favorite, ShoppingCart)
+                           ShoppingCartIngredient)
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from djoser.serializers import UserSerializer
-from drf_extra_fields.fields import Base64ImageField
+
+from .images import ImageVariantsField, LimitedBase64ImageField
+from .viewer_state import get_viewer_state
 
 User = get_user_model()
 
 
 class UsersSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
-    avatar = Base64ImageField(required=False, allow_null=True)
+    avatar = LimitedBase64ImageField(required=False, allow_null=True)
+    avatar_variants = ImageVariantsField()
 
     class Meta:
         model = User
         fields = (
             'email', 'id', 'username', 'first_name',
-            'last_name', 'is_subscribed', 'avatar'
+            'last_name', 'is_subscribed', 'avatar', 'avatar_variants'
         )
 
     def get_is_subscribed(self, author):
-        user = self.context['request'].user
-        if user.is_authenticated:
-            return user.followers.filter(author=author).exists()
-        return False
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        return get_viewer_state(self.context).is_subscribed(author)
 
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для модели ингредиентов."""
 
     class Meta:
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
         model = Ingredient
 
 
@@ -57,9 +60,27 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
 
 
 class SubscriptionRecipeSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
+
+
+class SimilarRecipeSerializer(SubscriptionRecipeSerializer):
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(SubscriptionRecipeSerializer.Meta):
+        fields = SubscriptionRecipeSerializer.Meta.fields + ('similarity',)
+
+
+class PantryRecipeSerializer(SubscriptionRecipeSerializer):
+    matched = serializers.IntegerField(read_only=True)
+    missing_ingredients = serializers.ListField(read_only=True)
+
+    class Meta(SubscriptionRecipeSerializer.Meta):
+        fields = SubscriptionRecipeSerializer.Meta.fields + (
+            'matched', 'missing_ingredients')
 
 
 class RecipeSerializer(serializers.ModelSerializer):
@@ -70,14 +91,16 @@ class RecipeSerializer(serializers.ModelSerializer):
                                              many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField(allow_null=True)
+    image = LimitedBase64ImageField(allow_null=True)
+    image_variants = ImageVariantsField()
     cooking_time = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_variants',
+            'text', 'cooking_time'
         )
 
     def validate_ingredients(self, ingredients):
@@ -116,6 +139,7 @@ class RecipeSerializer(serializers.ModelSerializer):
             for ingredient in ingredients_data
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         """Создание рецепта."""
         ingredients_data = validated_data.pop('recipe_ingredients')
@@ -123,40 +147,100 @@ class RecipeSerializer(serializers.ModelSerializer):
         self.save_ingredients(recipe, ingredients_data)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients_data):
+        """Применяет к составу рецепта только изменившиеся строки.
+
+        Возвращает прежние и новые количества ``{id ингредиента: amount}``.
+        """
+        current = {
+            item.ingredient_id: item
+            for item in recipe.recipe_ingredients.all()
+        }
+        old_amounts = {pk: item.amount for pk, item in current.items()}
+        new_amounts = {
+            item['id'].pk: item['amount'] for item in ingredients_data}
+        changed = []
+        for pk, item in current.items():
+            if pk in new_amounts and item.amount != new_amounts[pk]:
+                item.amount = new_amounts[pk]
+                changed.append(item)
+        removed = old_amounts.keys() - new_amounts.keys()
+        if removed:
+            recipe.recipe_ingredients.filter(
+                ingredient_id__in=removed).delete()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=pk, amount=amount)
+            for pk, amount in new_amounts.items() if pk not in current
+        )
+        RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        return old_amounts, new_amounts
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Обновление рецепта."""
         ingredients_data = validated_data.pop('recipe_ingredients', None)
         validated_ingredients = self.validate_ingredients(ingredients_data)
-        instance.recipe_ingredients.all().delete()
-        self.save_ingredients(instance, validated_ingredients)
+        old_amounts, new_amounts = self.update_ingredients(
+            instance, validated_ingredients)
+        if old_amounts != new_amounts:
+            ShoppingCartIngredient.objects.change_recipe(
+                instance, old_amounts, new_amounts)
         return super().update(instance, validated_data)
 
+    def to_representation(self, recipe):
+        if hasattr(recipe, 'author_is_subscribed'):
+            recipe.author.is_subscribed = recipe.author_is_subscribed
+        return super().to_representation(recipe)
+
     def get_is_favorited(self, recipe):
-        user = self.context['request'].user
-        return user.is_authenticated and Favorite.objects.filter(
-            user=user, recipe=recipe).exists()
+        if hasattr(recipe, 'is_favorited'):
+            return recipe.is_favorited
+        return get_viewer_state(self.context).is_favorited(recipe)
 
     def get_is_in_shopping_cart(self, recipe):
-        user = self.context['request'].user
-        return user.is_authenticated and ShoppingCart.objects.filter(
-            user=user, recipe=recipe).exists()
+        if hasattr(recipe, 'is_in_shopping_cart'):
+            return recipe.is_in_shopping_cart
+        return get_viewer_state(self.context).is_in_shopping_cart(recipe)
 
 
 class UserWithRecipesSerializer(UsersSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source='recipes.count', read_only=True)
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
         fields = (
             'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed', 'recipes', 'recipes_count', 'avatar'
+            'is_subscribed', 'recipes', 'recipes_count', 'avatar',
+            'avatar_variants'
         )
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit', 10**10)
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit is not None:
+                recipes = recipes[:recipes_limit]
         return SubscriptionRecipeSerializer(
-            obj.recipes.all()[:int(recipes_limit)], many=True,
-            context=self.context).data
+            recipes, many=True, context=self.context).data
+
+
+class RecipeBatchSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления или удаления."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=100)
+
+
+class PantrySerializer(serializers.Serializer):
+    """Имеющиеся продукты для подбора рецептов."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False, max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=20)
+    max_missing = serializers.IntegerField(min_value=0, required=False)
@@ -0,0 +1,121 @@
+import string
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipe.models import Recipe
+
+LETTERS = string.ascii_letters
+ALPHABET = string.digits + LETTERS
+BODY_LENGTH = 5
+# Коды вида «буква + 5 символов base62» — 6 символов для id меньше
+# MODULUS. Первая буква отличает коды от старых ссылок с числовым id.
+MODULUS = len(LETTERS) * len(ALPHABET) ** BODY_LENGTH
+MULTIPLIER = 2_654_435_761
+OFFSET = 1_234_567_891
+INVERSE = pow(MULTIPLIER, -1, MODULUS)
+VERSION_CACHE_KEY = 'short_links_version'
+
+
+def encode(pk):
+    """Непоследовательный короткий код id: младшая часть id переставляется
+    умножением по модулю, поэтому соседние рецепты получают непохожие
+    коды, а декодирование не требует БД."""
+    high, low = divmod(pk, MODULUS)
+    number = high * MODULUS + (low * MULTIPLIER + OFFSET) % MODULUS
+    number, first = divmod(number, len(LETTERS))
+    body = ''
+    while number:
+        number, digit = divmod(number, len(ALPHABET))
+        body = ALPHABET[digit] + body
+    return LETTERS[first] + body.rjust(BODY_LENGTH, ALPHABET[0])
+
+
+def decode(code):
+    """id по коду или по старой ссылке с числовым id; ``None`` для
+    строк, не являющихся кодом."""
+    if code.isascii() and code.isdigit():
+        return int(code)
+    if (len(code) <= BODY_LENGTH or code[0] not in LETTERS
+            or any(char not in ALPHABET for char in code)):
+        return None
+    number = 0
+    for char in code[1:]:
+        number = number * len(ALPHABET) + ALPHABET.index(char)
+    number = number * len(LETTERS) + LETTERS.index(code[0])
+    high, low = divmod(number, MODULUS)
+    pk = high * MODULUS + (low - OFFSET) * INVERSE % MODULUS
+    return pk if encode(pk) == code else None
+
+
+class ShortLinkResolver:
+    """Проверка существования рецепта по короткой ссылке через LRU
+    в памяти процесса.
+
+    Известные рецепты хранятся до удаления, неизвестные id — не дольше
+    ``SHORT_LINK_NEGATIVE_TTL`` секунд. Удаление рецепта сбрасывает его
+    запись в этом процессе и версию в кэше, по которой остальные процессы
+    очищают свои LRU.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+
+    def resolve(self, code):
+        """id существующего рецепта или ``None``."""
+        pk = decode(code)
+        if pk is None:
+            return None
+        version = cache.get(VERSION_CACHE_KEY, 0)
+        with self._lock:
+            if self._version != version:
+                self._entries.clear()
+                self._version = version
+            expires = self._entries.get(pk)
+            if expires is not None:
+                self._entries.move_to_end(pk)
+        if expires is None or expires < time.monotonic():
+            exists = Recipe.objects.filter(pk=pk).exists()
+            expires = float('inf') if exists else (
+                time.monotonic() + settings.SHORT_LINK_NEGATIVE_TTL)
+            with self._lock:
+                self._entries[pk] = expires
+                while len(self._entries) > settings.SHORT_LINK_CACHE_SIZE:
+                    self._entries.popitem(last=False)
+        return pk if expires == float('inf') else None
+
+    def forget(self, pk):
+        with self._lock:
+            self._entries.pop(pk, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self, pk):
+        self.forget(pk)
+        try:
+            cache.incr(VERSION_CACHE_KEY)
+        except ValueError:
+            cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+short_link_resolver = ShortLinkResolver()
+
+
+@receiver(post_save, sender=Recipe)
+def forget_unknown_short_link(sender, instance, created, **kwargs):
+    if created:
+        short_link_resolver.forget(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_short_link(sender, instance, **kwargs):
+    short_link_resolver.invalidate(instance.pk)
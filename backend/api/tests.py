@@ -1,3 +1,1865 @@
-# from django.test import TestCase
+import asyncio
+import base64
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.db.models import F
+from django.http import Http404, HttpResponse
+from django.test import (RequestFactory, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from PIL import Image
+from pypdf import PdfReader
+from rest_framework.test import APIClient
+
+from api import async_views, short_links
+from api.authentication import TokenCache, token_cache
+from api.cache import response_cache
+from api.ingredient_index import ingredient_index
+from api.request_stats import (QueryRecorder, RequestStatsMiddleware,
+                               fingerprint, request_stats)
+from api.recipe_index import RecipeIndex, recipe_index
+from api.serializers import RecipeSerializer
+from api.utils import PDFShoppingCartRenderer, check_shopping_cart_font
+from api.viewer_state import ViewerState, viewer_state
+
+from recipe.management.commands.import_recipes import (
+    Command as ImportRecipesCommand)
+from recipe.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                           RecipeDeletion, RecipeIngredient, RecipePopularity,
+                           ShoppingCart, ShoppingCartIngredient, Subscription,
+                           refresh_popularity)
+
+User = get_user_model()
+
+
+def shared_cache_settings(test, **kwargs):
+    """Файловый кэш ``shared``, общий для процессов, как Redis или
+    Memcached в продакшене."""
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory)
+    return override_settings(CACHES={**settings.CACHES, 'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': directory,
+    }}, **kwargs)
+
+
+class RecipeQueryCountTests(TestCase):
+    """Число запросов к БД не зависит от размера страницы."""
+
+    RECIPES_COUNT = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Viewer', last_name='Viewer', password='pass')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(5)
+        ]
+        for i in range(cls.RECIPES_COUNT):
+            recipe = Recipe.objects.create(
+                name=f'рецепт {i:02}', text='текст', cooking_time=10,
+                author=cls.author, image='recipes/images/test.png')
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=i + 1)
+                for ingredient in ingredients
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=cls.author)
+        cls.recipe = Recipe.objects.first()
+
+    def setUp(self):
+        cache.clear()
+        self.anon_client = APIClient()
+        self.auth_client = APIClient()
+        self.auth_client.force_authenticate(self.user)
+
+    def test_recipe_list_anonymous(self):
+        # Для анонимных добавляется запрос валидаторов ETag.
+        for limit in (1, 6, self.RECIPES_COUNT):
+            with self.subTest(limit=limit), self.assertNumQueries(4):
+                response = self.anon_client.get(
+                    '/api/recipes/', {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipe_list_authenticated(self):
+        for limit in (1, 6, self.RECIPES_COUNT):
+            with self.subTest(limit=limit), self.assertNumQueries(3):
+                response = self.auth_client.get(
+                    '/api/recipes/', {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipe_list_filters(self):
+        with self.assertNumQueries(3):
+            response = self.auth_client.get(
+                '/api/recipes/', {'is_favorited': 1, 'limit': 6})
+        self.assertTrue(all(
+            recipe['is_favorited'] for recipe in response.data['results']))
+
+    def test_recipe_detail(self):
+        for client, queries in ((self.anon_client, 3),
+                                (self.auth_client, 2)):
+            with self.assertNumQueries(queries):
+                response = client.get(f'/api/recipes/{self.recipe.pk}/')
+            self.assertEqual(len(response.data['ingredients']), 5)
+
+    def test_recipe_flags(self):
+        response = self.auth_client.get(
+            '/api/recipes/', {'limit': self.RECIPES_COUNT})
+        for recipe in response.data['results']:
+            instance = Recipe.objects.get(pk=recipe['id'])
+            self.assertEqual(
+                recipe['is_favorited'],
+                instance.favorites.filter(user=self.user).exists())
+            self.assertEqual(
+                recipe['is_in_shopping_cart'],
+                instance.shopping_carts.filter(user=self.user).exists())
+            self.assertTrue(recipe['author']['is_subscribed'])
+        response = self.anon_client.get('/api/recipes/')
+        for recipe in response.data['results']:
+            self.assertFalse(recipe['is_favorited'])
+            self.assertFalse(recipe['is_in_shopping_cart'])
+            self.assertFalse(recipe['author']['is_subscribed'])
+
+    def test_ingredient_list(self):
+        ingredient_index.invalidate()
+        with self.assertNumQueries(1):
+            self.anon_client.get('/api/ingredients/', {'name': 'ингр'})
+
+
+class IngredientIndexTests(TestCase):
+    """Поиск ингредиентов по индексу в памяти."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('сахар', 'Сахарная пудра', 'ванильный сахар', 'соль'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        ingredient_index.invalidate()
+
+    def search(self, name):
+        return [item['name'] for item in self.client.get(
+            '/api/ingredients/', {'name': name}).data]
+
+    def test_prefix_then_substring(self):
+        self.assertEqual(
+            self.search('сах'),
+            ['сахар', 'Сахарная пудра', 'ванильный сахар'])
+
+    def test_no_queries_after_build(self):
+        self.search('')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.search('')), 4)
+            self.assertEqual(self.search('СОЛ'), ['соль'])
+
+    def test_invalidated_on_save_and_delete(self):
+        self.search('')
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = Ingredient.objects.create(
+                name='сахарин', measurement_unit='г')
+        self.assertIn('сахарин', self.search('сахари'))
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient.delete()
+        self.assertEqual(self.search('сахари'), [])
+
+    def test_detail_fields_match_list(self):
+        ingredient = Ingredient.objects.get(name='соль')
+        self.assertEqual(
+            self.client.get(f'/api/ingredients/{ingredient.pk}/').data,
+            self.client.get('/api/ingredients/', {'name': 'соль'}).data[0])
+
+    def test_changes_from_other_processes(self):
+        self.search('')
+        # bulk_create не отправляет сигналов, как и запись из другого
+        # процесса без общего бэкенда кэша.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='сахарин', measurement_unit='г')])
+        self.assertEqual(ingredient_index.search('сахари'), [])
+        with override_settings(INGREDIENT_INDEX_CHECK_INTERVAL=0):
+            self.assertEqual(
+                [item['name'] for item in ingredient_index.search('сахари')],
+                ['сахарин'])
+            with self.assertNumQueries(1):
+                ingredient_index.search('')
+
+
+class KeysetPaginationTests(TestCase):
+    """Постраничный вывод по курсору."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Viewer', last_name='Viewer', password='pass')
+        for i in range(5):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Author', last_name='Author', password='pass')
+            Subscription.objects.create(user=cls.user, author=author)
+            for name in ('борщ', 'омлет'):
+                Recipe.objects.create(
+                    name=name, text='текст', cooking_time=10,
+                    author=author, image='recipes/images/test.png')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, link='next'):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data[link]
+        return ids
+
+    def test_recipes_forward(self):
+        expected = list(Recipe.objects.order_by(
+            'name', 'id').values_list('id', flat=True))
+        self.assertEqual(
+            self.walk('/api/recipes/?cursor=&limit=3'), expected)
+
+    def test_recipes_previous_pages(self):
+        expected = list(Recipe.objects.order_by(
+            'name', 'id').values_list('id', flat=True))
+        response = self.client.get('/api/recipes/?cursor=&limit=4')
+        response = self.client.get(response.data['next'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']], expected[8:])
+        self.assertIsNone(response.data['next'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            expected[4:8])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            expected[:4])
+        self.assertIsNone(response.data['previous'])
+
+    def test_subscriptions(self):
+        expected = list(User.objects.filter(
+            authors__user=self.user).order_by(
+            'username').values_list('id', flat=True))
+        self.assertEqual(
+            self.walk('/api/users/subscriptions/?cursor=&limit=2'),
+            expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/?cursor=broken')
+        self.assertEqual(response.status_code, 404)
+        for position in (['x', 'abc'], ['x', None], ['x', [1]]):
+            cursor = base64.urlsafe_b64encode(json.dumps(
+                {'p': position, 'r': 0}).encode()).decode()
+            with self.subTest(position=position):
+                self.assertEqual(self.client.get(
+                    '/api/recipes/', {'cursor': cursor}).status_code, 404)
+        cursor = base64.urlsafe_b64encode(json.dumps(
+            {'p': ['x', 'y', 'z'], 'r': 0}).encode()).decode()
+        self.assertEqual(self.client.get('/api/recipes/', {
+            'cursor': cursor, 'ordering': 'popular'}).status_code, 404)
+
+    def test_offset_mode_unchanged(self):
+        response = self.client.get('/api/recipes/?page=1&limit=6')
+        self.assertEqual(response.data['count'], 10)
+        self.assertEqual(len(response.data['results']), 6)
+
+
+class ShoppingCartDownloadTests(TestCase):
+    """Выгрузка списка покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Viewer', last_name='Viewer', password='pass')
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        for name, amounts in (('каша', (10, 200)), ('чай', (5, 50))):
+            recipe = Recipe.objects.create(
+                name=name, text='текст', cooking_time=10,
+                author=cls.user, image='recipes/images/test.png')
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=sugar, amount=amounts[0])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=milk, amount=amounts[1])
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        ShoppingCartIngredient.objects.rebuild()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/',
+                {'file_format': file_format})
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'Shopping_cart.{file_format}',
+                      response['Content-Disposition'])
+        return content
+
+    def test_txt(self):
+        content = self.download('txt').decode()
+        self.assertIn('1. Молоко — 250мл\n2. Сахар — 15г\n', content)
+        self.assertTrue(content.endswith('Рецепты:\nкаша\nчай\n'))
+
+    def test_csv(self):
+        content = self.download('csv').decode()
+        self.assertIn('молоко,мл,250\r\nсахар,г,15\r\n', content)
+
+    @staticmethod
+    def pdf_lines(content):
+        return [
+            line for page in PdfReader(BytesIO(content)).pages
+            for line in page.extract_text().splitlines()
+        ]
+
+    def test_pdf(self):
+        lines = self.pdf_lines(self.download('pdf'))
+        self.assertEqual(lines[0], 'Список покупок')
+        self.assertIn('2. Сахар — 15г', lines)
+        self.assertEqual(lines[-2:], ['каша', 'чай'])
+
+    def test_pdf_wraps_and_paginates(self):
+        name = 'очень длинное название рецепта ' * 8
+        content = b''.join(PDFShoppingCartRenderer().render(
+            [], [name.strip()] * 30))
+        self.assertEqual(len(PdfReader(BytesIO(content)).pages), 3)
+        lines = self.pdf_lines(content)
+        self.assertLess(max(map(len, lines)), len(name) // 2)
+        self.assertEqual(
+            ' '.join(lines[lines.index('Рецепты:') + 1:]).split(),
+            name.split() * 30)
+
+    def test_font_check(self):
+        self.assertEqual(check_shopping_cart_font(None), [])
+        with override_settings(SHOPPING_CART_PDF_FONT='/missing/font.ttf'):
+            self.assertEqual(
+                [error.id for error in check_shopping_cart_font(None)],
+                ['api.E001'])
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'file_format': 'doc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ShoppingCartIngredientTests(TestCase):
+    """Инкрементальные суммы ингредиентов в корзине."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Viewer', last_name='Viewer', password='pass')
+        cls.sugar = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл')
+        cls.recipes = []
+        for name, amounts in (('каша', (10, 200)), ('чай', (5, 50))):
+            recipe = Recipe.objects.create(
+                name=name, text='текст', cooking_time=10,
+                author=cls.user, image='recipes/images/test.png')
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.sugar, amount=amounts[0])
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=cls.milk, amount=amounts[1])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for recipe in self.recipes:
+            self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+
+    def totals(self):
+        return dict(self.user.shopping_cart_ingredients.values_list(
+            'ingredient__name', 'amount'))
+
+    def assertConsistent(self):
+        self.assertEqual(
+            sorted(self.user.shopping_cart_ingredients.values_list(
+                'user_id', 'ingredient_id', 'amount')),
+            sorted(ShoppingCartIngredient.objects.expected_totals()))
+
+    def test_add_and_remove(self):
+        self.assertEqual(self.totals(), {'сахар': 15, 'молоко': 250})
+        self.client.delete(
+            f'/api/recipes/{self.recipes[0].pk}/shopping_cart/')
+        self.assertEqual(self.totals(), {'сахар': 5, 'молоко': 50})
+        self.client.delete(
+            f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        self.assertEqual(self.totals(), {})
+
+    def test_recipe_ingredients_change(self):
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        response = self.client.patch(
+            f'/api/recipes/{self.recipes[0].pk}/',
+            {'ingredients': [{'id': self.sugar.pk, 'amount': 20},
+                             {'id': salt.pk, 'amount': 1}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.totals(), {'сахар': 25, 'молоко': 50, 'соль': 1})
+        self.assertConsistent()
+
+    def test_recipe_update_keeps_unchanged_rows(self):
+        recipe = self.recipes[0]
+        rows = dict(recipe.recipe_ingredients.values_list(
+            'ingredient_id', 'id'))
+        response = self.client.patch(
+            f'/api/recipes/{recipe.pk}/',
+            {'name': 'овсяная каша',
+             'ingredients': [{'id': self.sugar.pk, 'amount': 10},
+                             {'id': self.milk.pk, 'amount': 300}]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(dict(recipe.recipe_ingredients.values_list(
+            'ingredient_id', 'id')), rows)
+        self.assertEqual(self.totals(), {'сахар': 15, 'молоко': 350})
+        self.assertConsistent()
+
+    def test_batch(self):
+        first, second = (recipe.pk for recipe in self.recipes)
+        url = '/api/recipes/shopping_cart/'
+        response = self.client.delete(
+            url, {'recipes': [first, 999, first]}, format='json')
+        self.assertEqual(response.json()['results'], [
+            {'id': first, 'status': 'removed'},
+            {'id': 999, 'status': 'not_found'},
+        ])
+        self.assertEqual(self.totals(), {'сахар': 5, 'молоко': 50})
+        response = self.client.post(
+            url, {'recipes': [second, first]}, format='json')
+        self.assertEqual(response.json()['results'], [
+            {'id': second, 'status': 'exists'},
+            {'id': first, 'status': 'added'},
+        ])
+        self.assertEqual(self.totals(), {'сахар': 15, 'молоко': 250})
+        self.assertConsistent()
+        self.assertEqual(
+            self.client.post(url, {'recipes': []}, format='json').status_code,
+            400)
+
+    def test_recipe_delete(self):
+        self.recipes[1].delete()
+        self.assertEqual(self.totals(), {'сахар': 10, 'молоко': 200})
+        self.assertConsistent()
+
+    def test_rebuild(self):
+        ShoppingCartIngredient.objects.filter(
+            ingredient=self.milk).update(amount=1)
+        call_command('check_shopping_carts', '--rebuild', stdout=StringIO())
+        self.assertConsistent()
+
+    def test_download_reads_aggregate(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/')
+            content = b''.join(response.streaming_content).decode()
+        self.assertIn('1. Молоко — 250мл\n2. Сахар — 15г\n', content)
+
+
+class SubscriptionsQueryCountTests(TestCase):
+    """Страница подписок загружается постоянным числом запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='viewer', email='viewer@example.com',
+            first_name='Viewer', last_name='Viewer', password='pass')
+        for i in range(6):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Author', last_name='Author', password='pass')
+            Subscription.objects.create(user=cls.user, author=author)
+            for j in range(i):
+                Recipe.objects.create(
+                    name=f'рецепт {j}', text='текст', cooking_time=10,
+                    author=author, image='recipes/images/test.png')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count(self):
+        for limit in (1, 3, 6):
+            for recipes_limit in ('', 2, 10):
+                with self.subTest(limit=limit, recipes_limit=recipes_limit):
+                    with self.assertNumQueries(3):
+                        self.client.get('/api/users/subscriptions/', {
+                            'limit': limit, 'recipes_limit': recipes_limit})
+
+    def test_recipes_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 2})
+        for author in response.data['results']:
+            expected = list(Recipe.objects.filter(
+                author_id=author['id']).values_list('name', flat=True))
+            self.assertEqual(author['recipes_count'], len(expected))
+            self.assertEqual(
+                [recipe['name'] for recipe in author['recipes']],
+                expected[:2])
+            self.assertTrue(author['is_subscribed'])
+
+
+class CountersTests(TestCase):
+    """Денормализованные счетчики избранного, корзин и рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                first_name='User', last_name='User', password='pass')
+            for i in range(2)
+        ]
+        cls.author = cls.users[0]
+
+    def create_recipe(self):
+        return Recipe.objects.create(
+            name='рецепт', text='текст', cooking_time=10,
+            author=self.author, image='recipes/images/test.png')
+
+    def assertCounters(self, recipe, favorites, shopping_carts):
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, favorites)
+        self.assertEqual(recipe.shopping_cart_count, shopping_carts)
+
+    def test_recipe_counters(self):
+        recipe = self.create_recipe()
+        client = APIClient()
+        for user in self.users:
+            client.force_authenticate(user)
+            client.post(f'/api/recipes/{recipe.pk}/favorite/')
+            client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertCounters(recipe, 2, 2)
+        client.delete(f'/api/recipes/{recipe.pk}/favorite/')
+        self.assertCounters(recipe, 1, 2)
+        client.delete(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertCounters(recipe, 1, 1)
+
+    def test_batch_counters(self):
+        recipes = [self.create_recipe() for _ in range(3)]
+        ids = [recipe.pk for recipe in recipes]
+        client = APIClient()
+        client.force_authenticate(self.users[1])
+        client.post(f'/api/recipes/{ids[0]}/favorite/')
+        # Три запроса независимо от числа id и две точки сохранения.
+        with self.assertNumQueries(7):
+            client.post('/api/recipes/favorite/', {'recipes': ids},
+                        format='json')
+        self.assertCounters(recipes[0], 1, 0)
+        self.assertCounters(recipes[2], 1, 0)
+        with self.assertNumQueries(7):
+            client.delete('/api/recipes/favorite/', {'recipes': ids[:2]},
+                          format='json')
+        self.assertCounters(recipes[0], 0, 0)
+        self.assertCounters(recipes[2], 1, 0)
+        self.assertEqual(
+            list(self.users[1].favorites.values_list('recipe', flat=True)),
+            [ids[2]])
+
+    def test_recipes_count(self):
+        recipes = [self.create_recipe() for _ in range(3)]
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 3)
+        recipes[0].delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+
+    def test_cascade_delete(self):
+        recipe = self.create_recipe()
+        Favorite.objects.create(user=self.users[1], recipe=recipe)
+        ShoppingCart.objects.create(user=self.users[1], recipe=recipe)
+        self.assertCounters(recipe, 1, 1)
+        self.users[1].delete()
+        self.assertCounters(recipe, 0, 0)
+
+    def test_full_save_keeps_counters(self):
+        recipe = self.create_recipe()
+        stale_recipe = Recipe.objects.get(pk=recipe.pk)
+        stale_author = User.objects.get(pk=self.author.pk)
+        Favorite.objects.create(user=self.users[1], recipe=recipe)
+        self.create_recipe()
+        stale_recipe.name = 'новое название'
+        stale_recipe.save()
+        stale_author.first_name = 'Автор'
+        stale_author.save()
+        self.assertCounters(recipe, 1, 0)
+        self.assertEqual(recipe.name, 'новое название')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+        self.assertEqual(self.author.first_name, 'Автор')
+
+    def test_full_save_keeps_image_variants(self):
+        recipe = self.create_recipe()
+        variants = {'source': recipe.image.name, 'small': 'small.webp'}
+        Recipe.objects.filter(pk=recipe.pk).update(image_variants=variants)
+        recipe.name = 'новое название'
+        recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, variants)
+
+    def test_recount(self):
+        recipe = self.create_recipe()
+        Favorite.objects.create(user=self.users[1], recipe=recipe)
+        Recipe.objects.update(favorites_count=10)
+        User.objects.update(recipes_count=0)
+        call_command('recount', stdout=StringIO())
+        self.assertCounters(recipe, 1, 0)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+
+class ResponseCacheTests(TestCase):
+    """Кэш ответов неавторизованным пользователям."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            name='каша', text='текст', cooking_time=10,
+            author=cls.author, image='recipes/images/test.png',
+            image_variants={'source': 'recipes/images/test.png'})
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_anonymous_reads_cached(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+                    '/api/ingredients/?name=сах'):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.client.get(url)
+                self.assertEqual(first.data, second.data)
+        self.assertEqual(response_cache.stats()['hits'], 3)
+
+    def test_stats_command(self):
+        with self.assertRaisesMessage(CommandError, 'RESPONSE_CACHE_ALIAS'):
+            call_command('response_cache_stats', stdout=StringIO())
+        with shared_cache_settings(self, RESPONSE_CACHE_ALIAS='shared'):
+            self.client.get('/api/recipes/')
+            self.client.get('/api/recipes/')
+            stdout = StringIO()
+            call_command('response_cache_stats', stdout=stdout)
+        self.assertIn('Попаданий: 1, промахов: 1', stdout.getvalue())
+
+    def test_authenticated_not_cached(self):
+        self.client.force_authenticate(self.author)
+        self.client.get('/api/recipes/')
+        with self.assertNumQueries(3):
+            self.client.get('/api/recipes/')
+
+    def test_writes_bump_generation(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Новое'
+            self.author.save()
+        self.assertEqual(
+            self.client.get(url).data['author']['first_name'], 'Новое')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ingredient.name = 'соль'
+            self.ingredient.save()
+        self.assertEqual(
+            self.client.get(url).data['ingredients'][0]['name'], 'соль')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'суп'
+            self.recipe.save()
+            # До фиксации транзакции поколение не меняется.
+            self.assertEqual(self.client.get(url).data['name'], 'каша')
+        self.assertEqual(self.client.get(url).data['name'], 'суп')
+
+
+class ConditionalGetTests(TestCase):
+    """ETag и Last-Modified для рецептов и ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+        cls.recipe = Recipe.objects.create(
+            name='каша', text='текст', cooking_time=10,
+            author=cls.author, image='recipes/images/test.png',
+            image_variants={'source': 'recipes/images/test.png'})
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=10)
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        self.client = APIClient()
+
+    def assertNotModified(self, url, queries, clear_cache=False):
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        if clear_cache:
+            cache.clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        return response['ETag']
+
+    def test_not_modified(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+                    '/api/ingredients/'):
+            with self.subTest(url=url):
+                self.assertNotModified(url, 0)
+                self.assertNotModified(
+                    url, 1 if 'recipes' in url else 0, clear_cache=True)
+
+    def test_if_modified_since(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        response = self.client.get(url)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_update_etag(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        etag = self.client.get(url)['ETag']
+        client = APIClient()
+        client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            salt = Ingredient.objects.create(
+                name='соль', measurement_unit='г')
+            client.patch(
+                url, {'ingredients': [{'id': salt.pk, 'amount': 1}]},
+                format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            salt.name = 'морская соль'
+            salt.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data['ingredients'][0]['name'], 'морская соль')
+
+    def test_authenticated_recipes_not_conditional(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertNotIn('ETag', response)
+
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PIPELINE_SYNC=True,
+                   IMAGE_VARIANTS={'thumbnail': (16, 16), 'card': (32, 32)})
+class ImagePipelineTests(TestCase):
+    """Обработка изображений после запроса."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.ingredient = Ingredient.objects.create(
+            name='сахар', measurement_unit='г')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @staticmethod
+    def encode_image(size=(64, 48), mode='RGBA'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, 'PNG')
+        return ('data:image/png;base64,'
+                + base64.b64encode(buffer.getvalue()).decode())
+
+    def create_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'name': 'каша', 'text': 'текст', 'cooking_time': 10,
+            'image': image,
+            'ingredients': [{'id': self.ingredient.pk, 'amount': 10}],
+        }, format='json')
+
+    def test_variants_created(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_recipe(self.encode_image())
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(pk=response.data['id'])
+        self.assertEqual(recipe.image_variants['source'], recipe.image.name)
+        with default_storage.open(
+                recipe.image_variants['card']['webp']) as file:
+            self.assertEqual(Image.open(file).size, (32, 24))
+        with default_storage.open(
+                recipe.image_variants['thumbnail']['jpeg']) as file:
+            self.assertEqual(Image.open(file).format, 'JPEG')
+        data = self.client.get(f'/api/recipes/{recipe.pk}/').data
+        self.assertTrue(
+            data['image_variants']['thumbnail']['webp'].endswith('.webp'))
+
+    def test_avatar_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put('/api/users/me/avatar/',
+                            {'avatar': self.encode_image(mode='RGB')},
+                            format='json')
+        self.user.refresh_from_db()
+        paths = self.user.avatar_variants['thumbnail'].values()
+        self.assertTrue(all(default_storage.exists(path) for path in paths))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/api/users/me/avatar/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_variants, {})
+        self.assertFalse(any(default_storage.exists(path) for path in paths))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels(self):
+        response = self.create_recipe(self.encode_image(size=(100, 100)))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    @override_settings(IMAGE_MAX_UPLOAD_SIZE=10)
+    def test_too_large_upload(self):
+        response = self.create_recipe(self.encode_image())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+
+class ImportRecipesTests(TestCase):
+    """Массовый импорт рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        Ingredient.objects.create(name='сахар', measurement_unit='г')
+        Ingredient.objects.create(name='молоко', measurement_unit='мл')
+
+    def import_file(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_recipes', file.name, *args,
+                         stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    @staticmethod
+    def record(i, **kwargs):
+        return {
+            'name': f'рецепт {i}', 'text': 'текст', 'cooking_time': 5,
+            'author': 'author', 'image': 'recipes/images/test.png',
+            'ingredients': [{'name': 'Сахар', 'amount': i + 1},
+                            {'name': 'молоко', 'measurement_unit': 'мл',
+                             'amount': 100}],
+            **kwargs
+        }
+
+    def test_ndjson(self):
+        lines = [json.dumps(self.record(i)) for i in range(5)]
+        lines.insert(2, json.dumps(self.record(9, author='nobody')))
+        lines.append(json.dumps(self.record(
+            10, ingredients=[{'name': 'соль', 'amount': 1}])))
+        stdout, stderr = self.import_file(
+            '\n'.join(lines), '.ndjson', '--batch-size', '2')
+        self.assertIn('Импортировано: 5, ошибок: 2', stdout)
+        self.assertIn('Запись 3', stderr)
+        self.assertEqual(Recipe.objects.count(), 5)
+        self.assertEqual(RecipeIngredient.objects.count(), 10)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 5)
+
+    def test_json_array(self):
+        records = [self.record(i, author='author@example.com')
+                   for i in range(3)]
+        stdout, _ = self.import_file(
+            json.dumps(records, ensure_ascii=False), '.json')
+        self.assertIn('Импортировано: 3, ошибок: 0', stdout)
+        self.assertEqual(
+            Recipe.objects.get(name='рецепт 2').recipe_ingredients.get(
+                ingredient__name='сахар').amount, 3)
+
+    def test_malformed_record_fails_fast(self):
+        records = ',\n'.join(json.dumps(self.record(i)) for i in range(50))
+        with self.assertRaisesMessage(CommandError, "Expecting ','"):
+            self.import_file(
+                f'[{json.dumps(self.record(0))}, {{"name": 1 "text": 2}},'
+                f' {records}]', '.json')
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_save_hooks(self):
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            first_name='Reader', last_name='Reader', password='pass')
+        Subscription.objects.create(user=reader, author=self.author)
+        recipe = Recipe.objects.create(
+            name='рецепт', text='текст', cooking_time=5, author=self.author,
+            image='recipes/images/test.png')
+        FeedEntry.objects.all().delete()
+        command = ImportRecipesCommand()
+        command.bulk_authors = set()
+        with self.captureOnCommitCallbacks() as callbacks:
+            command.after_bulk_save([recipe])
+        # Повторный сброс кэша токенов автора и обработка фото.
+        self.assertEqual(len(callbacks), 2)
+        command.rebuild_feeds()
+        self.assertEqual(
+            list(FeedEntry.objects.values_list('user', 'recipe')),
+            [(reader.pk, recipe.pk)])
+
+
+class LoadIngredientsTests(TestCase):
+    """Повторная загрузка каталога не создаёт дубликатов."""
+
+    def load(self, *args):
+        stdout = StringIO()
+        call_command('load_ingredients', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def test_reload_is_idempotent(self):
+        path = settings.BASE_DIR.parent / 'data' / 'ingredients.json'
+        total = len(json.loads(path.read_text(encoding='utf-8')))
+        self.assertIn(f'Добавлено записей: {total}, уже были: 0',
+                      self.load(str(path), '--batch-size', '500'))
+        self.assertIn(f'Добавлено записей: 0, уже были: {total}',
+                      self.load(str(path)))
+        self.assertEqual(Ingredient.objects.count(), total)
+
+    def test_csv(self):
+        Ingredient.objects.create(name='сахар', measurement_unit='г')
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.csv', encoding='utf-8') as file:
+            file.write('сахар,г\nсахар,кг\nсоль,г\nсоль,г\n')
+            file.flush()
+            self.assertIn('Добавлено записей: 2, уже были: 1',
+                          self.load(file.name))
+        self.assertEqual(Ingredient.objects.count(), 3)
+
+
+class RecipeSearchTests(TestCase):
+    """Поиск по названию и описанию ранжирует совпадения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.recipes = {
+            key: Recipe.objects.create(
+                name=name, text=text, cooking_time=10, author=author,
+                image='recipes/images/test.png')
+            for key, name, text in (
+                ('text', 'Суп дня', 'Похож на борщ, но без свёклы'),
+                ('name', 'Борщ украинский', 'Свёкла, капуста'),
+                ('other', 'Оладьи', 'Мука, кефир'),
+            )
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = APIClient().get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_ranking_and_prefix(self):
+        expected = [self.recipes['name'].id, self.recipes['text'].id]
+        self.assertEqual(self.search('борщ'), expected)
+        self.assertEqual(self.search('Бор'), expected)
+        self.assertEqual(self.search('борщ капуста'),
+                         [self.recipes['name'].id])
+        self.assertEqual(self.search('"'), self.search(''))
+
+    def test_index_follows_changes(self):
+        recipe = self.recipes['other']
+        recipe.name = 'Оладьи с борщом'
+        recipe.save()
+        self.assertIn(recipe.id, self.search('борщ'))
+        self.recipes['name'].delete()
+        self.assertNotIn(self.recipes['name'].id, self.search('борщ'))
+
+    def test_cursor_keeps_relevance(self):
+        author = self.recipes['name'].author
+        for name, text in (('Яблочный борщ', 'Яблоки'),
+                           ('Арбузный суп', 'Вроде борща')):
+            Recipe.objects.create(
+                name=name, text=text, cooking_time=10, author=author,
+                image='recipes/images/test.png')
+        expected = self.search('борщ')
+        names = [Recipe.objects.get(pk=pk).name for pk in expected]
+        self.assertNotEqual(names, sorted(names))
+        response = APIClient().get(
+            '/api/recipes/', {'search': 'борщ', 'cursor': '', 'limit': 1})
+        ids = [recipe['id'] for recipe in response.data['results']]
+        while response.data['next']:
+            response = APIClient().get(response.data['next'])
+            ids += [recipe['id'] for recipe in response.data['results']]
+        self.assertEqual(ids, expected)
+
+
+@override_settings(REQUEST_STATS_SAMPLE_RATE=1.0)
+class RequestStatsTests(TestCase):
+    """Время, SQL и повторяющиеся запросы по маршрутам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(
+            username='staff', email='staff@example.com', first_name='S',
+            last_name='S', password='pass', is_staff=True)
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'рецепт {i}', text='текст', cooking_time=5,
+                author=author, image='recipes/images/test.png')
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        request_stats.reset()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT 1 FROM t WHERE a IN (%s, %s) AND b = 'x' "
+                        'LIMIT 21'),
+            fingerprint('SELECT 1 FROM t WHERE a IN (%s) AND b = %s '
+                        'LIMIT 6'))
+
+    def test_duplicates(self):
+        with QueryRecorder() as recorder:
+            for recipe in self.recipes:
+                Recipe.objects.filter(pk=recipe.pk).exists()
+            User.objects.exists()
+        self.assertEqual(recorder.count, 6)
+        self.assertEqual(recorder.duplicates, 4)
+        self.assertEqual(recorder.most_repeated()[1], 5)
+
+    def test_server_timing_and_summary(self):
+        response = self.client.get('/api/recipes/')
+        self.assertRegex(response['Server-Timing'],
+                         r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries')
+        self.client.get('/api/recipes/')
+        stats = request_stats.summary()['GET recipes-list']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['sampled'], 2)
+        self.assertGreater(stats['avg_queries'], 0)
+
+    def test_command(self):
+        with self.assertRaisesMessage(CommandError, '/api/request-stats/'):
+            call_command('request_stats', stdout=StringIO())
+        with shared_cache_settings(self, REQUEST_STATS_CACHE_ALIAS='shared'):
+            self.client.get('/api/recipes/')
+            self.client.get('/api/recipes/')
+            stdout = StringIO()
+            call_command('request_stats', stdout=stdout)
+        self.assertIn('GET recipes-list: 2 запр.', stdout.getvalue())
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        middleware = RequestStatsMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(
+            RequestFactory().get('/api/recipes/'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+$')
+        self.assertFalse(asyncio.iscoroutinefunction(
+            RequestStatsMiddleware(lambda request: HttpResponse())))
+
+    def test_staff_endpoint(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/request-stats/').status_code, 401)
+        client.force_authenticate(self.staff)
+        response = client.get('/api/request-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('GET request_stats', response.data)
+
+
+class AsyncReadPathTests(TransactionTestCase):
+    """Асинхронные представления отвечают так же, как синхронный DRF.
+
+    Запросы к БД выполняются в пуле потоков на отдельных соединениях,
+    поэтому данные тестов фиксируются в базе.
+    """
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        self.recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                name=f'рецепт {i}', text='текст', cooking_time=5,
+                author=author, image='')
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=sugar, amount=i + 1)
+            self.recipes.append(recipe)
+
+    def call(self, view, path, *args, **headers):
+        request = RequestFactory().get(path, **headers)
+        return async_to_sync(view)(request, *args)
+
+    def assertSameAsSync(self, view, path, *args):
+        expected = APIClient().get(path).json()
+        self.assertEqual(json.loads(self.call(view, path, *args).content),
+                         expected)
+        cache.clear()
+        self.assertEqual(json.loads(self.call(view, path, *args).content),
+                         expected)
+
+    def test_recipes(self):
+        self.assertSameAsSync(async_views.recipe_list,
+                              '/api/recipes/?limit=2&offset=1')
+        self.assertSameAsSync(async_views.recipe_detail,
+                              f'/api/recipes/{self.recipes[0].pk}/',
+                              self.recipes[0].pk)
+
+    def test_ingredients(self):
+        self.assertSameAsSync(async_views.ingredient_list,
+                              '/api/ingredients/?name=с')
+        response = self.call(async_views.ingredient_list, '/api/ingredients/')
+        self.assertEqual(self.call(
+            async_views.ingredient_list, '/api/ingredients/',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_token_requests_use_sync_stack(self):
+        response = self.call(async_views.recipe_list, '/api/recipes/',
+                             HTTP_AUTHORIZATION='Token invalid')
+        self.assertEqual(response.status_code, 401)
+
+    def test_redirect(self):
+        pk = self.recipes[0].pk
+        response = self.call(async_views.recipe_redirect, f'/api/s/{pk}/',
+                             str(pk))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Location'], f'/recipes/{pk}')
+        with self.assertRaises(Http404):
+            self.call(async_views.recipe_redirect, '/api/s/999/', '999')
+
+
+class BenchmarkToolsTests(TestCase):
+    """Генератор синтетических данных и прогон postman-коллекции."""
+
+    def setUp(self):
+        cache.clear()
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(20))
+
+    def test_seed_data(self):
+        stdout = StringIO()
+        call_command('seed_data', '--users', '5', '--recipes', '30',
+                     '--favorites', '4', '--cart', '3', stdout=stdout)
+        self.assertIn('Пользователей: 5, рецептов: 30', stdout.getvalue())
+        self.assertTrue(all(
+            3 <= recipe.recipe_ingredients.count() <= 15
+            for recipe in Recipe.objects.all()))
+        self.assertEqual(Favorite.objects.count(), 20)
+        self.assertFalse(Subscription.objects.filter(
+            user=F('author')).exists())
+        self.assertEqual(
+            sum(Recipe.objects.values_list('favorites_count', flat=True)),
+            20)
+        self.assertEqual(
+            sorted(ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount')),
+            sorted(ShoppingCartIngredient.objects.expected_totals()))
+        call_command('seed_data', '--users', '2', '--recipes', '1',
+                     stdout=StringIO())
+        self.assertTrue(User.objects.filter(username='seed-6').exists())
+
+    def test_bench_api_replays_collection(self):
+        call_command('seed_data', '--users', '3', '--recipes', '10',
+                     stdout=StringIO())
+        users, recipes = User.objects.count(), Recipe.objects.count()
+        stdout = StringIO()
+        call_command('bench_api', '--iterations', '1', '--warmup', '0',
+                     '--json', stdout=stdout)
+        result = json.loads(stdout.getvalue())
+        endpoints = result['endpoints']
+        self.assertEqual(sum(stats['errors']
+                             for stats in endpoints.values()), 0)
+        self.assertEqual(endpoints['POST recipes-list']['statuses']['201'],
+                         5)
+        self.assertEqual(endpoints['GET recipes-detail']['statuses'],
+                         {'200': 2})
+        self.assertIn('p99_ms', endpoints['GET recipes-list'])
+        self.assertEqual(User.objects.count(), users)
+        self.assertEqual(Recipe.objects.count(), recipes)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """Кэш токенов и его сброс при выходе, смене пароля и деактивации."""
+
+    def setUp(self):
+        token_cache.clear()
+        token_cache.reset_stats()
+        self.user = User.objects.create_user(
+            username='user', email='user@example.com', first_name='U',
+            last_name='U', password='old-Pa$$word')
+        response = APIClient().post(
+            '/api/auth/token/login/',
+            {'email': 'user@example.com', 'password': 'old-Pa$$word'})
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.data["auth_token"]}')
+
+    def me(self):
+        return self.client.get('/api/users/me/')
+
+    def test_repeated_token_skips_db(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.me().status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.me().data['email'], 'user@example.com')
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertFalse(any('authtoken_token' in query['sql']
+                             for query in second))
+        stats = token_cache.stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+    def test_logout_invalidates(self):
+        self.me()
+        self.assertEqual(
+            self.client.post('/api/auth/token/logout/').status_code, 204)
+        self.assertEqual(self.me().status_code, 401)
+
+    def test_password_change_and_deactivation_invalidate(self):
+        self.me()
+        self.assertEqual(self.client.post('/api/users/set_password/', {
+            'current_password': 'old-Pa$$word',
+            'new_password': 'new-Pa$$word'}).status_code, 204)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.me().status_code, 200)
+        self.assertTrue(any('authtoken_token' in query['sql']
+                            for query in queries))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.me().status_code, 401)
+
+    def test_password_and_email_change_keep_fresh_fields(self):
+        self.me()
+        User.objects.filter(pk=self.user.pk).update(first_name='Новое')
+        self.assertEqual(self.client.post('/api/users/set_password/', {
+            'current_password': 'old-Pa$$word',
+            'new_password': 'new-Pa$$word'}).status_code, 204)
+        self.assertEqual(self.client.post('/api/users/set_email/', {
+            'current_password': 'new-Pa$$word',
+            'new_email': 'new@example.com'}).status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.first_name, self.user.email),
+                         ('Новое', 'new@example.com'))
+        self.assertTrue(self.user.check_password('new-Pa$$word'))
+
+    def test_counter_changes_and_profile_updates(self):
+        self.me()
+        Recipe.objects.create(
+            name='рецепт', text='текст', cooking_time=5, author=self.user,
+            image='recipes/images/test.png',
+            image_variants={'source': 'recipes/images/test.png'})
+        self.assertEqual(token_cache.stats()['invalidations'], 1)
+        self.me()
+        User.objects.filter(pk=self.user.pk).update(
+            recipes_count=5, avatar='users/images/missing.png')
+        self.assertEqual(
+            self.client.delete('/api/users/me/avatar/').status_code, 204)
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.avatar.name, self.user.recipes_count),
+                         ('', 5))
+
+    def test_shared_tier(self):
+        with self.assertRaisesMessage(CommandError,
+                                      'REQUEST_STATS_CACHE_ALIAS'):
+            call_command('token_auth_stats', stdout=StringIO())
+        with shared_cache_settings(self,
+                                   TOKEN_AUTH_SHARED_CACHE_ALIAS='shared',
+                                   REQUEST_STATS_CACHE_ALIAS='shared'):
+            self.me()
+            token_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.me()
+            self.assertFalse(any('authtoken_token' in query['sql']
+                                 for query in queries))
+            self.assertEqual(token_cache.stats()['shared_hits'], 1)
+            User.objects.filter(pk=self.user.pk).update(first_name='Новое')
+            TokenCache().invalidate_user(self.user.pk)  # другой процесс
+            self.assertEqual(self.me().data['first_name'], 'Новое')
+            stdout = StringIO()
+            call_command('token_auth_stats', stdout=stdout)
+        self.assertIn('в общем кэше: 1', stdout.getvalue())
+
+
+class ShortLinkTests(TestCase):
+    """Короткие коды и переходы по ним без обращения к БД."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.recipe = Recipe.objects.create(
+            name='рецепт', text='текст', cooking_time=5,
+            author=cls.author, image='recipes/images/test.png')
+
+    def setUp(self):
+        cache.clear()
+        short_links.short_link_resolver.clear()
+
+    def test_codes(self):
+        codes = [short_links.encode(pk) for pk in range(1, 1000)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertTrue(all(len(code) == 6 and code[0].isalpha()
+                            for code in codes))
+        for pk in (1, 999, short_links.MODULUS - 1, short_links.MODULUS,
+                   10 ** 15):
+            self.assertEqual(short_links.decode(short_links.encode(pk)), pk)
+        self.assertEqual(short_links.decode('42'), 42)
+        for code in ('abc', 'a-bcdef', '0abcdef', '', '²', '٤٢'):
+            self.assertIsNone(short_links.decode(code))
+
+    def test_redirect(self):
+        link = APIClient().get(
+            f'/api/recipes/{self.recipe.pk}/get-link/').data['short-link']
+        code = short_links.encode(self.recipe.pk)
+        self.assertTrue(link.endswith(f'/api/s/{code}/'))
+        self.assertRedirects(self.client.get(f'/api/s/{code}/'),
+                             f'/recipes/{self.recipe.pk}',
+                             fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get(f'/api/s/{code}/').status_code, 302)
+            self.assertEqual(self.client.get(
+                f'/api/s/{self.recipe.pk}/')['Location'],
+                f'/recipes/{self.recipe.pk}')
+
+    def test_unknown_and_deleted(self):
+        unknown = short_links.encode(self.recipe.pk + 1)
+        self.assertEqual(self.client.get(f'/api/s/{unknown}/').status_code,
+                         404)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.client.get(f'/api/s/{unknown}/').status_code, 404)
+            self.assertEqual(self.client.get('/api/s/zz/').status_code, 404)
+            self.assertEqual(self.client.get('/api/s/²/').status_code, 404)
+        code = short_links.encode(self.recipe.pk)
+        self.client.get(f'/api/s/{code}/')
+        self.recipe.delete()
+        self.assertEqual(self.client.get(f'/api/s/{code}/').status_code, 404)
+
+
+class RecipeIndexTests(TestCase):
+    """Похожие рецепты по коэффициенту Жаккара общих ингредиентов
+    и подбор рецептов по имеющимся продуктам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            first_name='Author', last_name='Author', password='pass')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(6)
+        ]
+        cls.recipes = [
+            cls.create_recipe(f'рецепт {i}', indexes)
+            for i, indexes in enumerate(
+                [(0, 1, 2, 3), (0, 1, 2), (0, 1, 4), (3,), (5,)])
+        ]
+
+    @classmethod
+    def create_recipe(cls, name, indexes):
+        recipe = Recipe.objects.create(
+            name=name, text='текст', cooking_time=5, author=cls.author,
+            image='recipes/images/test.png')
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=cls.ingredients[i],
+                             amount=1)
+            for i in indexes)
+        return recipe
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = f'{directory}/recipe_index.pickle'
+        settings_override = override_settings(
+            RECIPE_INDEX_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        recipe_index.clear()
+        self.addCleanup(recipe_index.clear)
+
+    def ids(self, recipe):
+        return [pk for pk, _ in recipe_index.similar(recipe.pk, 10)]
+
+    def test_ranking(self):
+        first, second, third, fourth, _ = self.recipes
+        self.assertEqual(recipe_index.similar(first.pk, 10), [
+            (second.pk, 0.75), (third.pk, 0.4), (fourth.pk, 0.25)])
+        self.assertEqual(recipe_index.similar(first.pk, 1),
+                         [(second.pk, 0.75)])
+        self.assertEqual(recipe_index.similar(self.recipes[4].pk, 10),
+                         [])
+
+    def test_incremental_update(self):
+        first, second, third, fourth, fifth = self.recipes
+        self.assertEqual(self.ids(fifth), [])
+        RecipeIngredient.objects.create(
+            recipe=fifth, ingredient=self.ingredients[0], amount=1)
+        fifth.save()
+        self.assertEqual(self.ids(fifth), [second.pk, third.pk, first.pk])
+        created = self.create_recipe('новый', (0, 1, 2, 3))
+        self.assertEqual(self.ids(first)[0], created.pk)
+        created.delete()
+        second.delete()
+        self.assertEqual(self.ids(first), [third.pk, fourth.pk, fifth.pk])
+
+    def test_snapshot(self):
+        recipe_index.similar(self.recipes[0].pk, 10)
+        index = RecipeIndex(self.path)
+        self.assertTrue(index.load())
+        with self.assertNumQueries(0):
+            self.assertEqual(index.rank(self.recipes[0].pk, 10),
+                             recipe_index.similar(self.recipes[0].pk, 10))
+        # Снимок устарел: изменения догоняются по updated_at.
+        RecipeIngredient.objects.filter(recipe=self.recipes[1]).delete()
+        self.recipes[1].save()
+        index.sync()
+        self.assertNotIn(self.recipes[1].pk,
+                         [pk for pk, _ in index.rank(self.recipes[0].pk, 10)])
+
+    def test_sync_removes_deleted(self):
+        recipe_index.similar(self.recipes[0].pk, 10)
+        index = RecipeIndex(self.path)
+        self.assertTrue(index.load())
+        deleted = self.recipes[1].pk
+        # Удаление в другом процессе: сигнал до этого индекса не доходит.
+        self.recipes[1].delete()
+        self.assertIn(deleted, index.recipe_ids())
+        # Отметки об удалении, измененные рецепты и их состав.
+        with self.assertNumQueries(3):
+            index.sync()
+        self.assertNotIn(deleted, index.recipe_ids())
+        self.assertEqual(index.rank(self.recipes[0].pk, 10),
+                         recipe_index.similar(self.recipes[0].pk, 10))
+
+    def test_old_snapshot_compares_ids(self):
+        recipe_index.similar(self.recipes[0].pk, 10)
+        index = RecipeIndex(self.path)
+        self.assertTrue(index.load())
+        deleted = self.recipes[1].pk
+        self.recipes[1].delete()
+        index._watermark -= timedelta(
+            seconds=settings.RECIPE_INDEX_DELETIONS_TTL + 1)
+        RecipeDeletion.objects.update(deleted_at=now() - timedelta(
+            seconds=settings.RECIPE_INDEX_DELETIONS_TTL + 1))
+        call_command('build_recipe_index', stdout=StringIO())
+        self.assertFalse(RecipeDeletion.objects.exists())
+        index.sync()
+        self.assertNotIn(deleted, index.recipe_ids())
+
+    def test_slots_bounded(self):
+        first, second, third = self.recipes[:3]
+        ingredient = [item.pk for item in self.ingredients]
+        recipe_index.similar(first.pk, 10)
+        for indexes in ((0,), (0, 1), (0, 1, 2, 3)) * 3:
+            RecipeIngredient.objects.filter(recipe=second).delete()
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=second,
+                                 ingredient=self.ingredients[i], amount=1)
+                for i in indexes)
+            second.save()
+            self.assertIn(second.pk, self.ids(first))
+        self.assertEqual(len(recipe_index._slot_recipes), 5)
+        for _ in range(6):
+            self.create_recipe('временный', (0, 1)).delete()
+        self.assertLessEqual(len(recipe_index._slot_recipes), 10)
+        third.delete()
+        self.assertEqual(recipe_index.pantry(ingredient[:3], 10), [
+            (first.pk, 3, [ingredient[3]]), (second.pk, 3, [ingredient[3]])])
+
+    def test_endpoint(self):
+        first, second, third, fourth, _ = self.recipes
+        response = APIClient().get(f'/api/recipes/{first.pk}/similar/',
+                                   {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(item['id'], item['similarity'])
+                          for item in response.data],
+                         [(second.pk, 0.75), (third.pk, 0.4)])
+        self.assertEqual(set(response.data[0]), {
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'similarity'})
+        second.delete()
+        self.assertEqual(
+            [item['id'] for item in APIClient().get(
+                f'/api/recipes/{first.pk}/similar/').data],
+            [third.pk, fourth.pk])
+
+    def test_endpoint_errors(self):
+        client = APIClient()
+        missing = self.recipes[-1].pk + 100
+        self.assertEqual(
+            client.get(f'/api/recipes/{missing}/similar/').status_code, 404)
+        for pk in ('abc', '²'):
+            self.assertEqual(
+                client.get(f'/api/recipes/{pk}/similar/').status_code, 404)
+        self.assertEqual(client.get(
+            f'/api/recipes/{self.recipes[0].pk}/similar/',
+            {'limit': 'x'}).status_code, 400)
+
+    def test_pantry(self):
+        first, second, third, fourth, _ = self.recipes
+        ingredient = [item.pk for item in self.ingredients]
+        self.assertEqual(recipe_index.pantry(ingredient[:3], 10), [
+            (second.pk, 3, []), (first.pk, 3, [ingredient[3]]),
+            (third.pk, 2, [ingredient[4]])])
+        self.assertEqual(recipe_index.pantry(ingredient[:3], 10, 0),
+                         [(second.pk, 3, [])])
+        self.assertEqual(recipe_index.pantry([ingredient[3], 999], 1),
+                         [(fourth.pk, 1, [])])
+        second.delete()
+        RecipeIngredient.objects.filter(
+            recipe=third, ingredient_id=ingredient[4]).delete()
+        third.save()
+        self.assertEqual(recipe_index.pantry(ingredient[:3], 10), [
+            (first.pk, 3, [ingredient[3]]), (third.pk, 2, [])])
+
+    def test_pantry_endpoint(self):
+        first, second = self.recipes[:2]
+        response = APIClient().post('/api/recipes/pantry/', {
+            'ingredients': [item.pk for item in self.ingredients[:3]],
+            'limit': 2,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['id'], item['matched']) for item in response.data],
+            [(second.pk, 3), (first.pk, 3)])
+        self.assertEqual(response.data[0]['missing_ingredients'], [])
+        self.assertEqual(response.data[1]['missing_ingredients'], [{
+            'id': self.ingredients[3].pk, 'name': 'ингредиент 3',
+            'measurement_unit': 'г'}])
+        for data in ({}, {'ingredients': []}, {'ingredients': ['x']},
+                     {'ingredients': [1], 'limit': 0}):
+            self.assertEqual(APIClient().post(
+                '/api/recipes/pantry/', data, format='json').status_code,
+                400)
+
+
+class PopularityTests(TestCase):
+    """Рейтинги популярности за периоды и сортировка по ним."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                first_name='User', last_name='User', password='pass')
+            for i in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'рецепт {i}', text='текст', cooking_time=5,
+                author=cls.users[0], image='recipes/images/test.png')
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        client = APIClient()
+        # Сегодня: рецепт 3 — дважды, рецепт 1 — один раз; три дня назад
+        # рецепт 2 — трижды.
+        for user in self.users[:2]:
+            client.force_authenticate(user)
+            client.post(f'/api/recipes/{self.recipes[3].pk}/favorite/')
+        client.post(f'/api/recipes/{self.recipes[1].pk}/shopping_cart/')
+        for user in self.users:
+            Favorite.objects.create(user=user, recipe=self.recipes[2])
+        Favorite.objects.filter(recipe=self.recipes[2]).update(
+            created_at=now() - timedelta(days=3))
+
+    def ids(self, ordering, **params):
+        response = APIClient().get('/api/recipes/', {
+            'ordering': ordering, 'limit': 10, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def scores(self, period):
+        return dict(RecipePopularity.objects.filter(
+            period=period).values_list('recipe_id', 'score'))
+
+    def test_refresh(self):
+        first, second, third, fourth, _ = self.recipes
+        self.assertTrue(Favorite.objects.filter(
+            created_at__gte=now() - timedelta(minutes=1)).exists())
+        self.assertEqual(refresh_popularity(10), {
+            RecipePopularity.Period.DAY: 2,
+            RecipePopularity.Period.WEEK: 3,
+            RecipePopularity.Period.ALL: 3,
+        })
+        self.assertEqual(self.scores('day'), {fourth.pk: 2, second.pk: 1})
+        self.assertEqual(self.scores('week'),
+                         {third.pk: 3, fourth.pk: 2, second.pk: 1})
+        self.assertEqual(self.scores('all'), self.scores('week'))
+        self.assertEqual(set(refresh_popularity(10).values()), {0})
+        self.assertEqual(refresh_popularity(1)['week'], 2)
+        self.assertEqual(self.scores('week'), {third.pk: 3})
+        Favorite.objects.filter(recipe=fourth).delete()
+        refresh_popularity(10)
+        self.assertEqual(self.scores('day'), {second.pk: 1})
+
+    def test_ordering(self):
+        first, second, third, fourth, fifth = self.recipes
+        default = self.ids('')
+        self.assertEqual(self.ids('popular_week'), default)
+        out = StringIO()
+        call_command('refresh_popularity', stdout=out)
+        self.assertIn('Изменено строк', out.getvalue())
+        self.assertEqual(self.ids('popular_day'),
+                         [fourth.pk, second.pk, first.pk, third.pk, fifth.pk])
+        self.assertEqual(self.ids('popular_week'),
+                         [third.pk, fourth.pk, second.pk, first.pk, fifth.pk])
+        self.assertEqual(self.ids('unknown'), default)
+        with CaptureQueriesContext(connection) as queries:
+            self.ids('popular')
+        self.assertFalse(any('recipe_favorite' in query['sql']
+                             for query in queries))
+
+    def test_cursor_pagination(self):
+        refresh_popularity(10)
+        first, second, third, fourth, fifth = self.recipes
+        expected = [third.pk, fourth.pk, second.pk, first.pk, fifth.pk]
+        client, ids = APIClient(), []
+        url = '/api/recipes/?ordering=popular_week&cursor=&limit=2'
+        while url:
+            response = client.get(url)
+            ids.extend(item['id'] for item in response.data['results'])
+            last = response
+            url = response.data['next']
+        self.assertEqual(ids, expected)
+        response = client.get(client.get(
+            last.data['previous']).data['previous'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']], expected[:2])
+
+
+class FeedTests(TestCase):
+    """Лента рецептов из подписок с рассылкой при публикации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.other, cls.author, cls.star = [
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com',
+                first_name=name, last_name=name, password='pass')
+            for name in ('reader', 'other', 'author', 'star')
+        ]
+        cls.old = cls.create_recipe(cls.author, 'старый')
+        for user in (cls.reader, cls.other):
+            Subscription.objects.create(user=user, author=cls.author)
+        Subscription.objects.create(user=cls.reader, author=cls.star)
+
+    @classmethod
+    def create_recipe(cls, author, name):
+        return Recipe.objects.create(
+            name=name, text='текст', cooking_time=5, author=author,
+            image='recipes/images/test.png',
+            image_variants={'source': 'recipes/images/test.png'})
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def publish(self, author, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.create_recipe(author, name)
+
+    def feed(self, user=None):
+        ids, url = [], '/api/recipes/feed/?limit=2'
+        client = self.client
+        if user is not None:
+            client = APIClient()
+            client.force_authenticate(user)
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    @override_settings(FEED_FANOUT_BATCH_SIZE=1)
+    def test_fan_out(self):
+        recipes = [self.publish(self.author, f'рецепт {i}')
+                   for i in range(4)]
+        self.publish(self.other, 'чужой')
+        expected = [recipe.pk for recipe in reversed(recipes)]
+        self.assertEqual(self.feed(), expected + [self.old.pk])
+        self.assertEqual(self.feed(self.other), expected + [self.old.pk])
+        self.assertEqual(self.feed(self.author), [])
+        self.assertEqual(FeedEntry.objects.filter(
+            recipe=recipes[0]).count(), 2)
+        response = self.client.get('/api/recipes/feed/?limit=2')
+        self.assertIn('is_favorited', response.data['results'][0])
+        self.assertIsNone(response.data['previous'])
+        with self.assertNumQueries(3):
+            self.client.get(response.data['next'])
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_pull_fallback(self):
+        recipe = self.publish(self.star, 'звездный')
+        self.star.refresh_from_db()
+        self.assertTrue(self.star.pull_feed)
+        self.assertFalse(FeedEntry.objects.filter(recipe=recipe).exists())
+        other = self.publish(self.author, 'новый')
+        self.assertEqual(self.feed(), [other.pk, recipe.pk, self.old.pk])
+        self.assertEqual(self.feed(self.other), [other.pk, self.old.pk])
+
+    def test_subscriptions(self):
+        self.assertEqual(self.feed(self.other), [self.old.pk])
+        self.client.force_authenticate(self.other)
+        response = self.client.delete(
+            f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.feed(self.other), [])
+        self.client.post(f'/api/users/{self.author.pk}/subscribe/')
+        self.assertEqual(self.feed(self.other), [self.old.pk])
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(self.feed(self.other), [self.old.pk])
+        self.assertEqual(self.feed(), [self.old.pk])
+
+    def test_migration_backfill(self):
+        backfill_feeds = import_module(
+            'recipe.migrations.0013_backfill_feed').backfill_feeds
+        FeedEntry.objects.all().delete()
+        backfill_feeds(apps, None)
+        backfill_feeds(apps, None)
+        self.assertEqual(self.feed(self.other), [self.old.pk])
+        self.assertEqual(self.feed(), [self.old.pk])
+
+    def test_anonymous_and_invalid_cursor(self):
+        self.assertEqual(
+            APIClient().get('/api/recipes/feed/').status_code, 401)
+        self.assertEqual(self.client.get(
+            '/api/recipes/feed/?cursor=broken').status_code, 404)
+
+
+class ViewerStateTests(TestCase):
+    """Флаги пользователя загружаются один раз за запрос."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, *cls.authors = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@example.com',
+                first_name='User', last_name='User', password='pass')
+            for i in range(6)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                name=f'рецепт {i}', text='текст', cooking_time=5,
+                author=author, image='recipes/images/test.png',
+                image_variants={'source': 'recipes/images/test.png'})
+            for i, author in enumerate(cls.authors)
+        ]
+        for author in cls.authors[::2]:
+            Subscription.objects.create(user=cls.viewer, author=author)
+        Favorite.objects.create(user=cls.viewer, recipe=cls.recipes[1])
+        ShoppingCart.objects.create(user=cls.viewer, recipe=cls.recipes[2])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def test_user_list(self):
+        subscribed = {author.pk for author in self.authors[::2]}
+        for limit in (1, 6):
+            with self.subTest(limit=limit), self.assertNumQueries(3):
+                response = self.client.get('/api/users/', {'limit': limit})
+            for user in response.data['results']:
+                self.assertEqual(user['is_subscribed'],
+                                 user['id'] in subscribed)
+
+    def test_me_and_anonymous(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/me/')
+        self.assertFalse(response.data['is_subscribed'])
+        with self.assertNumQueries(1):
+            response = APIClient().get(f'/api/users/{self.authors[0].pk}/')
+        self.assertFalse(response.data['is_subscribed'])
+
+    def test_serializers_share_state(self):
+        request = RequestFactory().get('/')
+        request.user = self.viewer
+        recipes = Recipe.objects.select_related('author').prefetch_related(
+            'recipe_ingredients')
+        with self.assertNumQueries(5):
+            data = RecipeSerializer(
+                recipes, many=True, context={'request': request}).data
+            RecipeSerializer(
+                recipes[0], context={'request': request}).data
+        self.assertEqual(
+            [(recipe['is_favorited'], recipe['is_in_shopping_cart'],
+              recipe['author']['is_subscribed']) for recipe in data],
+            [(recipe.pk == self.recipes[1].pk,
+              recipe.pk == self.recipes[2].pk,
+              recipe.author in self.authors[::2]) for recipe in recipes])
+        self.assertIs(viewer_state(request), viewer_state(request))
+        with self.assertNumQueries(0):
+            self.assertFalse(ViewerState().favorite_ids)
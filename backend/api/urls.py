@@ -1,10 +1,12 @@
 from rest_framework import routers
 
+from django.conf import settings
 from django.urls import include, path
 
 
+from . import async_views
 from .views import (RecipeViewSet, IngredientViewSet,
-                    recipe_redirect, UserViewSet)
+                    recipe_redirect, request_stats_view, UserViewSet)
 
 
 router = routers.DefaultRouter()
@@ -17,4 +19,17 @@ urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
     path('s/<str:short_id>/', recipe_redirect,
          name='recipe_redirect'),
+    path('request-stats/', request_stats_view, name='request_stats'),
 ]
+
+# Асинхронный путь чтения для запуска под ASGI, остальные маршруты и
+# запросы с токеном обслуживает синхронный стек DRF.
+async_urlpatterns = [
+    path('recipes/', async_views.recipe_list),
+    path('recipes/<int:pk>/', async_views.recipe_detail),
+    path('ingredients/', async_views.ingredient_list),
+    path('s/<str:short_id>/', async_views.recipe_redirect),
+]
+
+if settings.ASYNC_READ_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
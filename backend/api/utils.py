@@ -1,23 +1,137 @@
+import csv
+import io
+import os
+
+from django.conf import settings
+from django.core.checks import Error, register
 from django.utils.timezone import now
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+
+class TextShoppingCartRenderer:
+    """Текстовый отчет для списка покупок."""
+
+    extension = 'txt'
+    content_type = 'text/plain; charset=utf-8'
+
+    def render(self, ingredients, recipes):
+        yield f'Список покупок\nДата: {now().strftime("%d.%m.%Y")}\n\n'
+        yield 'Ингредиенты:\n'
+        for i, ingredient in enumerate(ingredients, 1):
+            yield (f'{i}. {ingredient["name"].capitalize()} — '
+                   f'{ingredient["amount"]}{ingredient["measurement_unit"]}\n')
+        yield '\nРецепты:\n'
+        for recipe in recipes:
+            yield f'{recipe}\n'
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+class CSVShoppingCartRenderer:
+    """Список покупок в формате CSV."""
+
+    extension = 'csv'
+    content_type = 'text/csv; charset=utf-8'
+
+    def render(self, ingredients, recipes):
+        writer = csv.writer(Echo())
+        yield '\ufeff'
+        yield writer.writerow(('Ингредиент', 'Единица измерения',
+                               'Количество'))
+        for ingredient in ingredients:
+            yield writer.writerow((ingredient['name'],
+                                   ingredient['measurement_unit'],
+                                   ingredient['amount']))
+        yield writer.writerow(())
+        yield writer.writerow(('Рецепты',))
+        for recipe in recipes:
+            yield writer.writerow((recipe,))
+
+
+class PDFShoppingCartRenderer:
+    """Список покупок в PDF.
+
+    Текст набирается шрифтом ``SHOPPING_CART_PDF_FONT`` с кириллицей,
+    reportlab встраивает в файл подмножество использованных глифов.
+    Длинные строки переносятся по ширине страницы. В отличие от TXT и CSV
+    документ собирается в памяти и отдается одним куском: таблица ссылок
+    и шрифт PDF записываются только после всех страниц.
+    """
+
+    extension = 'pdf'
+    content_type = 'application/pdf'
+    font_name = 'ShoppingCart'
+    font_size = 11
+    leading = 15
+    margin = 50
+
+    def render(self, ingredients, recipes):
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_CART_PDF_FONT))
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(
+            buffer, pagesize=A4, initialFontName=self.font_name,
+            initialFontSize=self.font_size)
+        width, height = A4
+        top = height - self.margin
+        y = top
+        for line in self.iterate_lines(ingredients, recipes):
+            for part in simpleSplit(line, self.font_name, self.font_size,
+                                    width - 2 * self.margin) or ['']:
+                if y < self.margin:
+                    pdf.showPage()
+                    pdf.setFont(self.font_name, self.font_size)
+                    y = top
+                pdf.drawString(self.margin, y, part)
+                y -= self.leading
+        pdf.save()
+        yield buffer.getvalue()
+
+    def iterate_lines(self, ingredients, recipes):
+        yield 'Список покупок'
+        yield f'Дата: {now().strftime("%d.%m.%Y")}'
+        yield ''
+        yield 'Ингредиенты:'
+        for i, ingredient in enumerate(ingredients, 1):
+            yield (f'{i}. {ingredient["name"].capitalize()} — '
+                   f'{ingredient["amount"]}{ingredient["measurement_unit"]}')
+        yield ''
+        yield 'Рецепты:'
+        yield from recipes
+
+
+@register()
+def check_shopping_cart_font(app_configs, **kwargs):
+    """Без шрифта загрузка PDF падала бы только при первом запросе."""
+    path = settings.SHOPPING_CART_PDF_FONT
+    if os.path.isfile(path):
+        return []
+    return [Error(
+        f'Не найден шрифт для PDF списка покупок: {path}',
+        hint=('Установите fonts-dejavu-core или укажите в '
+              'SHOPPING_CART_PDF_FONT TrueType-шрифт с кириллицей.'),
+        id='api.E001',
+    )]
+
+
+SHOPPING_CART_RENDERERS = {
+    renderer.extension: renderer
+    for renderer in (TextShoppingCartRenderer, CSVShoppingCartRenderer,
+                     PDFShoppingCartRenderer)
+}
 
 
-def render_shopping_cart(ingredients):
-    """Рендерит текстовый отчет для списка покупок."""
-    today = now().strftime("%d.%m.%Y")
-    header = f'Список покупок\nДата: {today}\n'
-    product_list = [(
-        f'{i}. {ingredient["name"].capitalize()} — {ingredient["amount"]}'
-        f'{ingredient["measurement_unit"]}')
-        for i, ingredient in enumerate(ingredients, 1)
-    ]
-    recipe_set = {ingredient['recipe_name'] for ingredient in ingredients}
-
-    recipe_list = ['Рецепты:'] + list(recipe_set)
-
-    return '\n'.join([
-        header,
-        "Ингредиенты:",
-        *product_list,
-        "",
-        *recipe_list
-    ])
+def render_shopping_cart(ingredients, recipes, file_format='txt'):
+    """Потоковый отчет списка покупок за один проход по строкам."""
+    return SHOPPING_CART_RENDERERS[file_format]().render(
+        ingredients, recipes)
@@ -0,0 +1,69 @@
+from functools import cached_property
+
+from recipe.models import Favorite, ShoppingCart, Subscription
+
+
+class ViewerState:
+    """Избранное, корзина и подписки текущего пользователя.
+
+    Каждое множество id загружается одним запросом при первом обращении,
+    после чего все сериализаторы запроса проверяют флаги без обращений
+    к БД. У анонимного пользователя множества пустые.
+    """
+
+    def __init__(self, user=None):
+        self.user = user
+
+    def load(self, model, field):
+        if self.user is None or not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(model.objects.filter(
+            user=self.user).values_list(field, flat=True))
+
+    @cached_property
+    def favorite_ids(self):
+        return self.load(Favorite, 'recipe_id')
+
+    @cached_property
+    def shopping_cart_ids(self):
+        return self.load(ShoppingCart, 'recipe_id')
+
+    @cached_property
+    def subscribed_author_ids(self):
+        return self.load(Subscription, 'author_id')
+
+    def is_favorited(self, recipe):
+        return recipe.pk in self.favorite_ids
+
+    def is_in_shopping_cart(self, recipe):
+        return recipe.pk in self.shopping_cart_ids
+
+    def is_subscribed(self, author):
+        return author.pk in self.subscribed_author_ids
+
+
+def viewer_state(request):
+    """Состояние пользователя, общее для всех сериализаторов запроса."""
+    state = getattr(request, '_viewer_state', None)
+    if state is None or state.user is not request.user:
+        state = request._viewer_state = ViewerState(request.user)
+    return state
+
+
+def get_viewer_state(context):
+    """Состояние из контекста сериализатора; без запроса в контексте —
+    пустое, как у анонимного пользователя."""
+    state = context.get('viewer_state')
+    if state is not None:
+        return state
+    request = context.get('request')
+    return ViewerState() if request is None else viewer_state(request)
+
+
+class ViewerStateMixin:
+    """Передает состояние пользователя в контекст сериализаторов."""
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['viewer_state'] = viewer_state(self.request)
+        return context
@@ -1,62 +1,121 @@
-import base64
-
-from rest_framework import viewsets, status, filters, serializers
-from rest_framework.decorators import action
-from rest_framework.permissions import (IsAuthenticated,
+from rest_framework import viewsets, status, serializers
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.permissions import (SAFE_METHODS, AllowAny,
+                                        IsAdminUser, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
-from django.core.files.base import ContentFile
-from django.contrib.auth import get_user_model
-from django.http import FileResponse
-from django.db.models import F, Sum
+from django.contrib.auth import get_user_model, update_session_auth_hash
+from django.http import Http404, StreamingHttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, F, Prefetch, Value,
+                              prefetch_related_objects)
 from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from django.urls import reverse
+from djoser import utils as djoser_utils
+from djoser.compat import get_user_email
+from djoser.conf import settings as djoser_settings
 from djoser.views import UserViewSet as DjoserUserViewSet
-from recipe.models import (Ingredient, Recipe, Favorite,
-                           ShoppingCart, RecipeIngredient)
+from recipe.models import (FeedEntry, Ingredient, Recipe, Favorite,
+                           ShoppingCart, ShoppingCartIngredient)
+from . import short_links
 from .serializers import (
     UsersSerializer, UserWithRecipesSerializer,
-    RecipeSerializer, IngredientSerializer, SubscriptionRecipeSerializer
+    RecipeSerializer, IngredientSerializer, SubscriptionRecipeSerializer,
+    RecipeBatchSerializer, SimilarRecipeSerializer, PantrySerializer,
+    PantryRecipeSerializer
 )
+from .cache import (INGREDIENTS, POPULARITY, RECIPES,
+                    AnonymousResponseCacheMixin)
+from .conditional import ConditionalGetMixin, queryset_validators
+from .images import LimitedBase64ImageField
 from .permissions import IsAuthorOrReadOnly
-from .filters import RecipeFilter
-from .pagination import PageToOffsetPagination
-from .utils import render_shopping_cart
+from .filters import (PopularityOrderingFilter, RecipeFilter,
+                      RecipeSearchFilter, popularity_period)
+from .ingredient_index import ingredient_index
+from .pagination import FeedPagination, PageToOffsetPagination
+from .request_stats import request_stats
+from .recipe_index import recipe_index
+from .utils import SHOPPING_CART_RENDERERS, render_shopping_cart
+from .viewer_state import ViewerStateMixin
 
 User = get_user_model()
 
+SIMILAR_LIMIT = 6
+SIMILAR_LIMIT_MAX = 50
+
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AnonymousResponseCacheMixin, ConditionalGetMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
-    search_fields = ('^name',)
+    cache_generations = (INGREDIENTS,)
 
-    def get_queryset(self):
-        queryset = Ingredient.objects.all().order_by('name')
-        name = self.request.query_params.get('name', None)
-        if name:
-            queryset = queryset.filter(name__icontains=name)
-        return queryset
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            lambda request: self.get_conditional(
+                ingredient_index.last_modified(), self.search, request),
+            request
+        )
+
+    @staticmethod
+    def search(request):
+        """Поиск по индексу в памяти без обращения к БД."""
+        return Response(ingredient_index.search(
+            request.query_params.get('name', '')))
 
+    def get_object_validators(self, request, pk=None):
+        return Ingredient.objects.filter(pk=pk).values_list(
+            'updated_at', flat=True).first(), ''
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(AnonymousResponseCacheMixin, ConditionalGetMixin,
+                    ViewerStateMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     pagination_class = PageToOffsetPagination
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, RecipeSearchFilter,
+                       PopularityOrderingFilter)
     filterset_class = RecipeFilter
     permission_classes = (IsAuthorOrReadOnly,)
+    cache_generations = (RECIPES,)
+    lookup_value_regex = '[0-9]+'
+
+    @classmethod
+    def get_cache_generations(cls, query_params):
+        if popularity_period(query_params) is not None:
+            return cls.cache_generations + (POPULARITY,)
+        return cls.cache_generations
+
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user)
+
+    def get_list_validators(self, request):
+        """Флаги избранного и корзины зависят от пользователя,
+        поэтому условные запросы поддерживаются только для анонимных.
+        Порядок по популярности меняется без изменения рецептов."""
+        if (request.user.is_authenticated
+                or popularity_period(request.query_params) is not None):
+            return None
+        return queryset_validators(self.filter_queryset(Recipe.objects.all()))
+
+    def get_object_validators(self, request, pk=None):
+        if request.user.is_authenticated:
+            return None
+        return Recipe.objects.filter(pk=pk).values_list(
+            'updated_at', flat=True).first(), ''
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
     def get_permissions(self):
-        if self.action == 'create':
+        if self.action in ('create', 'feed'):
             return [IsAuthenticated()]
+        if self.action == 'pantry':
+            return [AllowAny()]
         return [IsAuthorOrReadOnly(), IsAuthenticatedOrReadOnly()]
 
     @staticmethod
@@ -75,16 +134,73 @@ class RecipeViewSet(viewsets.ModelViewSet):
             obj.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    @transaction.atomic
+    def handle_batch_action(model, request, action_type):
+        """Пакетное добавление или удаление рецептов с итогом по каждому id.
+
+        Возвращает ответ и список id рецептов, которые действительно
+        были добавлены или удалены.
+        """
+        serializer = RecipeBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids).order_by().values_list('pk', flat=True))
+        if action_type == 'add':
+            changed = model.objects.add_recipes(
+                request.user, [pk for pk in recipe_ids if pk in found])
+            statuses = ('added', 'exists')
+        else:
+            changed = model.objects.remove_recipes(
+                request.user, [pk for pk in recipe_ids if pk in found])
+            statuses = ('removed', 'absent')
+        changed_ids = set(changed)
+        return Response({'results': [
+            {'id': pk, 'status': 'not_found' if pk not in found
+             else statuses[pk not in changed_ids]}
+            for pk in recipe_ids
+        ]}), changed
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart', url_name='shopping-cart-batch',
+            permission_classes=[IsAuthenticated])
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        action_type = 'add' if request.method == 'POST' else 'remove'
+        response, changed = self.handle_batch_action(
+            ShoppingCart, request, action_type)
+        ShoppingCartIngredient.objects.add_recipes(
+            [request.user.pk], changed,
+            sign=1 if action_type == 'add' else -1)
+        return response
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='favorite', url_name='favorite-batch',
+            permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        action_type = 'add' if request.method == 'POST' else 'remove'
+        return self.handle_batch_action(Favorite, request, action_type)[0]
+
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
-        return self.handle_recipe_action(ShoppingCart, request.user, recipe, 'add')
+        response = self.handle_recipe_action(
+            ShoppingCart, request.user, recipe, 'add')
+        ShoppingCartIngredient.objects.add_recipe([request.user.pk], recipe)
+        return response
 
     @shopping_cart.mapping.delete
+    @transaction.atomic
     def remove_from_shopping_cart(self, request, pk=None):
         recipe = get_object_or_404(Recipe, pk=pk)
-        return self.handle_recipe_action(ShoppingCart, request.user, recipe, 'remove')
+        response = self.handle_recipe_action(
+            ShoppingCart, request.user, recipe, 'remove')
+        ShoppingCartIngredient.objects.add_recipe(
+            [request.user.pk], recipe, sign=-1)
+        return response
 
     @action(detail=True, methods=['post'],
             permission_classes=[IsAuthenticated])
@@ -101,42 +217,167 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def get_link(self, request, pk=None):
         recipe = self.get_object()
         return Response({'short-link': request.build_absolute_uri(
-            reverse('recipe_redirect', args=[recipe.pk])
+            reverse('recipe_redirect', args=[short_links.encode(recipe.pk)])
         )}, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Рецепты с наибольшим коэффициентом Жаккара по ингредиентам."""
+        pk = int(pk)
+        try:
+            limit = int(request.query_params.get('limit', SIMILAR_LIMIT))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается целое число.'})
+        limit = min(max(limit, 1), SIMILAR_LIMIT_MAX)
+        # Запас на рецепты, удаленные в других процессах и еще не
+        # исключенные из индекса этого процесса.
+        scores = dict(recipe_index.similar(pk, limit + 5))
+        recipes = Recipe.objects.in_bulk([pk, *scores])
+        if pk not in recipes:
+            raise Http404
+        similar = [recipes[other] for other in scores if other in recipes]
+        for recipe in similar[:limit]:
+            recipe.similarity = round(scores[recipe.pk], 4)
+        return Response(SimilarRecipeSerializer(
+            similar[:limit], many=True,
+            context=self.get_serializer_context()).data)
+
+    @action(detail=False, methods=['post'])
+    def pantry(self, request):
+        """Рецепты, для которых больше всего продуктов уже есть,
+        с недостающими ингредиентами."""
+        serializer = PantrySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        # Запас на рецепты, удаленные в других процессах.
+        found = recipe_index.pantry(data['ingredients'], data['limit'] + 5,
+                                    data.get('max_missing'))
+        recipes = Recipe.objects.in_bulk([item[0] for item in found])
+        ingredients = {
+            ingredient['id']: ingredient
+            for ingredient in Ingredient.objects.filter(pk__in={
+                pk for _, _, missing in found for pk in missing
+            }).values('id', 'name', 'measurement_unit')
+        }
+        result = []
+        for recipe_id, matched, missing in found:
+            if recipe_id in recipes and len(result) < data['limit']:
+                recipe = recipes[recipe_id]
+                recipe.matched = matched
+                recipe.missing_ingredients = [
+                    ingredients[pk] for pk in missing if pk in ingredients]
+                result.append(recipe)
+        return Response(PantryRecipeSerializer(
+            result, many=True, context=self.get_serializer_context()).data)
+
+    @action(detail=False, methods=['get'])
+    def feed(self, request):
+        """Новые рецепты авторов из подписок, от новых к старым.
+
+        Доступна только пагинация курсором: параметр ``cursor`` из
+        ссылки ``next`` и ``limit``.
+        """
+        paginator = FeedPagination()
+        ids = paginator.paginate_feed(
+            lambda before, limit: FeedEntry.objects.page(
+                request.user, before, limit),
+            request)
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=False, permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__in=user.shopping_carts.values('recipe')
-        ).values(
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in SHOPPING_CART_RENDERERS:
+            raise ValidationError(
+                'Доступные форматы: '
+                f'{", ".join(SHOPPING_CART_RENDERERS)}.')
+        ingredients = request.user.shopping_cart_ingredients.values(
+            'amount',
             name=F('ingredient__name'),
             measurement_unit=F('ingredient__measurement_unit'),
-            recipe_name=F('recipe__name')
-        ).annotate(amount=Sum('amount')).order_by('name')
+        ).order_by('name', 'measurement_unit').iterator()
+        recipes = request.user.shopping_carts.values_list(
+            'recipe__name', flat=True).order_by('recipe__name').iterator()
 
-        return FileResponse(
-            render_shopping_cart(ingredients), as_attachment=True,
-            filename='Shopping_cart.txt',
-            content_type='text/plain'
+        renderer = SHOPPING_CART_RENDERERS[file_format]
+        response = StreamingHttpResponse(
+            render_shopping_cart(ingredients, recipes, file_format),
+            content_type=renderer.content_type
         )
+        response['Content-Disposition'] = (
+            f'attachment; filename="Shopping_cart.{renderer.extension}"')
+        return response
 
 
 def recipe_redirect(request, short_id):
-    get_object_or_404(Recipe, id=short_id)
-    return redirect(f'/recipes/{short_id}')
+    pk = short_links.short_link_resolver.resolve(short_id)
+    if pk is None:
+        raise Http404
+    return redirect(f'/recipes/{pk}')
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def request_stats_view(request):
+    """Статистика запросов по маршрутам для персонала."""
+    return Response(request_stats.summary())
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(ViewerStateMixin, DjoserUserViewSet):
     queryset = User.objects.all()
     serializer_class = UsersSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    keyset_fields = ('username', 'id')
+
+    def get_instance(self):
+        """Пользователь запроса может быть взят из кэша токенов, поэтому
+        профиль изменяется на свежей копии из БД."""
+        if self.request.method in SAFE_METHODS:
+            return self.request.user
+        return User.objects.get(pk=self.request.user.pk)
 
     @action(detail=False, methods=['get'],
             permission_classes=[IsAuthenticated])
     def me(self, request, *args, **kwargs):
         return super().me(request, *args, **kwargs)
 
+    @action(['post'], detail=False)
+    def set_password(self, request, *args, **kwargs):
+        """Как в djoser, но сохраняется только пароль свежей копии
+        пользователя, а не весь объект из кэша токенов."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = self.get_instance()
+        user.set_password(serializer.data['new_password'])
+        user.save(update_fields=['password'])
+        request.user = user
+        if djoser_settings.PASSWORD_CHANGED_EMAIL_CONFIRMATION:
+            djoser_settings.EMAIL.password_changed_confirmation(
+                request, {'user': user}).send([get_user_email(user)])
+        if djoser_settings.LOGOUT_ON_PASSWORD_CHANGE:
+            djoser_utils.logout_user(request)
+        elif djoser_settings.CREATE_SESSION_ON_LOGIN:
+            update_session_auth_hash(request, user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(['post'], detail=False, url_path=f'set_{User.USERNAME_FIELD}')
+    def set_username(self, request, *args, **kwargs):
+        """Как в djoser, но сохраняется только логин свежей копии
+        пользователя."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = self.get_instance()
+        setattr(user, User.USERNAME_FIELD,
+                serializer.data[f'new_{User.USERNAME_FIELD}'])
+        user.save(update_fields=[User.USERNAME_FIELD])
+        if djoser_settings.USERNAME_CHANGED_EMAIL_CONFIRMATION:
+            djoser_settings.EMAIL.username_changed_confirmation(
+                request, {'user': user}).send([get_user_email(user)])
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, id=None):
@@ -158,50 +399,69 @@ class UserViewSet(DjoserUserViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             serializer = UserWithRecipesSerializer(
-                author, context={'request': request}
+                author, context={**self.get_serializer_context(),
+                                 'recipes_limit': self.get_recipes_limit()}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         get_object_or_404(user.followers, author=author).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            pagination_class=PageToOffsetPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(authors__user=request.user)
-        recipes_limit = request.query_params.get('recipes_limit')
+        queryset = User.objects.filter(authors__user=request.user).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
+        recipes_limit = self.get_recipes_limit()
+        context = {**self.get_serializer_context(),
+                   'recipes_limit': recipes_limit}
         page = self.paginate_queryset(queryset)
+        authors = queryset if page is None else page
+        self.prefetch_recipes(authors, recipes_limit)
+        serializer = UserWithRecipesSerializer(
+            authors, many=True, context=context)
         if page is not None:
-            serializer = UserWithRecipesSerializer(
-                page, many=True, context={'request': request,
-                                          'recipes_limit': recipes_limit}
-            )
             return self.get_paginated_response(serializer.data)
-        serializer = UserWithRecipesSerializer(
-            queryset, many=True, context={'request': request,
-                                          'recipes_limit': recipes_limit})
         return Response(serializer.data)
 
+    def get_recipes_limit(self):
+        try:
+            recipes_limit = int(self.request.query_params['recipes_limit'])
+        except (KeyError, ValueError):
+            return None
+        return max(recipes_limit, 0)
+
+    @staticmethod
+    def prefetch_recipes(authors, recipes_limit):
+        """Загрузка рецептов всех авторов страницы одним запросом."""
+        authors = list(authors)
+        recipes = Recipe.objects.filter(author__in=authors)
+        if recipes_limit is not None:
+            recipes = recipes.limit_per_author(recipes_limit)
+        prefetch_related_objects(authors, Prefetch(
+            'recipes', queryset=recipes.only(
+                'id', 'name', 'image', 'image_variants', 'cooking_time',
+                'author_id'),
+            to_attr='limited_recipes'
+        ))
+
     @action(detail=False, methods=['put', 'delete'], url_path='me/avatar',
             permission_classes=[IsAuthenticated])
     def avatar(self, request):
-        user = request.user
+        user = self.get_instance()
         if request.method == 'PUT':
             avatar_data = request.data.get('avatar')
             if not avatar_data:
                 raise ValidationError('Требуются данные для аватара.')
-            try:
-                format, imgstr = avatar_data.split(';base64,')
-            except ValueError:
-                raise ValidationError(
-                    'Недопустимый формат аватара. Ожидаемое - base64.')
-            ext = format.split('/')[-1]
-            avatar_file = ContentFile(base64.b64decode(imgstr),
-                                      name=f'avatar.{ext}')
+            avatar_file = LimitedBase64ImageField().to_internal_value(
+                avatar_data)
             if user.avatar:
                 user.avatar.delete(save=False)
             user.avatar = avatar_file
-            user.save()
+            user.save(update_fields=['avatar'])
             return Response({'avatar': user.avatar.url})
         if user.avatar:
-            user.avatar.delete(save=True)
+            user.avatar.delete(save=False)
+            user.save(update_fields=['avatar'])
         return Response(status=status.HTTP_204_NO_CONTENT)
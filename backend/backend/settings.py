@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.request_stats.RequestStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,6 +95,21 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    }
+}
+
+RESPONSE_CACHE_ALIAS = os.getenv('RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 300))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -144,7 +160,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -170,3 +186,77 @@ AUTH_USER_MODEL = 'recipe.User'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Per-route request statistics: timing for every request, SQL count,
+# time and duplicates for a sampled share of them.
+REQUEST_STATS_SAMPLE_RATE = float(os.getenv('REQUEST_STATS_SAMPLE_RATE', 0.05))
+REQUEST_STATS_N_PLUS_ONE_THRESHOLD = 5
+REQUEST_STATS_FLUSH_INTERVAL = 10
+REQUEST_STATS_SERVER_TIMING = True
+# The request_stats command reads the counters from another process, so it
+# needs a shared backend here; /api/request-stats/ works with any.
+REQUEST_STATS_CACHE_ALIAS = os.getenv('REQUEST_STATS_CACHE_ALIAS', 'default')
+
+# Token -> user resolution cache: per-process LRU with a TTL and an optional
+# shared tier that also propagates invalidation to other processes.
+TOKEN_AUTH_CACHE_SIZE = int(os.getenv('TOKEN_AUTH_CACHE_SIZE', 10000))
+TOKEN_AUTH_SHARED_CACHE_ALIAS = os.getenv('TOKEN_AUTH_SHARED_CACHE_ALIAS')
+# Without the shared tier, logout and deactivation reach other processes
+# only when their local entries expire, so the default TTL is kept short.
+TOKEN_AUTH_CACHE_TTL = int(os.getenv(
+    'TOKEN_AUTH_CACHE_TTL', 60 if TOKEN_AUTH_SHARED_CACHE_ALIAS else 5))
+TOKEN_AUTH_SHARED_CACHE_TTL = int(os.getenv('TOKEN_AUTH_SHARED_CACHE_TTL', 300))
+
+# In-process ingredient index: compared with the catalog in the database at
+# most once per INGREDIENT_INDEX_CHECK_INTERVAL seconds, so changes made by
+# other processes show up even without a shared cache backend.
+INGREDIENT_INDEX_CHECK_INTERVAL = int(
+    os.getenv('INGREDIENT_INDEX_CHECK_INTERVAL', 10))
+
+# Short links: known recipes stay in the per-process LRU until deleted,
+# unknown ids are cached for SHORT_LINK_NEGATIVE_TTL seconds.
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 100000))
+SHORT_LINK_NEGATIVE_TTL = 60
+
+# Recipe x ingredient index for similar recipes and pantry matching: kept
+# in process memory, loaded from a snapshot file and synced with the
+# database by Recipe.updated_at and RecipeDeletion rows, which are kept for
+# RECIPE_INDEX_DELETIONS_TTL seconds and pruned by build_recipe_index.
+RECIPE_INDEX_PATH = os.getenv(
+    'RECIPE_INDEX_PATH',
+    os.path.join(BASE_DIR, 'var', 'recipe_index.pickle'))
+RECIPE_INDEX_SYNC_INTERVAL = 5
+RECIPE_INDEX_SYNC_LAG = 60
+RECIPE_INDEX_DELETIONS_TTL = 7 * 24 * 60 * 60
+RECIPE_INDEX_RESULTS_SIZE = 10000
+
+# Subscription feed: new recipes are pushed to followers in batches, authors
+# with more followers than FEED_FANOUT_LIMIT are read on request instead.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 10000))
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 50
+
+# TrueType font with Cyrillic glyphs for the PDF shopping list; embedded
+# into each file as a subset.
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Async read path for recipes, ingredients and short links; enable when
+# serving backend.asgi:application.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 32))
+
+# Image pipeline: uploads are limited before decoding, resized copies are
+# generated after the request on a thread pool.
+IMAGE_MAX_UPLOAD_SIZE = int(os.getenv('IMAGE_MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+IMAGE_PIPELINE_WORKERS = int(os.getenv('IMAGE_PIPELINE_WORKERS', 2))
+IMAGE_PIPELINE_SYNC = False
+IMAGE_QUALITY = 80
+IMAGE_FORMATS = ('webp', 'jpeg')
+IMAGE_VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
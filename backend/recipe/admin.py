@@ -2,8 +2,9 @@ from django.contrib import admin
 from django.utils.safestring import mark_safe
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
-from .models import (Ingredient, Recipe, RecipeIngredient,
-                     Favorite, ShoppingCart, User, Subscription)
+from .models import (Ingredient, Recipe, RecipeIngredient, Favorite,
+                     ShoppingCart, ShoppingCartIngredient, User,
+                     Subscription)
 
 
 @admin.register(User)
@@ -35,9 +36,10 @@ class UsersAdmin(BaseUserAdmin):
                     '50px;width: 50px; border-radius: 50%;">')
         return "—"
 
-    @admin.display(description='Число рецептов')
+    @admin.display(description='Число рецептов',
+                   ordering='recipes_count')
     def recipe_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 @admin.register(Subscription)
@@ -65,12 +67,22 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('name', 'author__username',)
     search_fields = ('name', 'author__username',)
 
+    def save_related(self, request, form, formsets, change):
+        recipe = form.instance
+        old_amounts = dict(recipe.recipe_ingredients.values_list(
+            'ingredient_id', 'amount'))
+        super().save_related(request, form, formsets, change)
+        ShoppingCartIngredient.objects.change_recipe(
+            recipe, old_amounts, dict(recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'amount')))
+
     def author_username(self, recipe):
         return recipe.author.username
 
     def get_favorite_count(self, recipe):
-        return recipe.favorites.count()
+        return recipe.favorites_count
     get_favorite_count.short_description = 'В избранном'
+    get_favorite_count.admin_order_field = 'favorites_count'
 
     @mark_safe
     @admin.display(description='Ингредиенты')
@@ -104,4 +116,4 @@ class IngredientAdmin(admin.ModelAdmin):
 class FavoriteShoppingCartAdmin(admin.ModelAdmin):
     """Настройки отображения избранных у пользователей и списка покупок."""
 
-    list_display = ('user', 'recipe')
+    list_display = ('user', 'recipe', 'created_at')
@@ -0,0 +1,321 @@
+import json
+import logging
+import os
+import re
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+
+from api.request_stats import QueryRecorder, route_name
+
+from .bench_read_path import Command as ReadPathCommand
+from .bench_read_path import percentile
+
+DEFAULT_COLLECTION = os.path.join(
+    settings.BASE_DIR.parent, 'postman_collection',
+    'foodgram.postman_collection.json')
+
+VARIABLE = re.compile(r'{{(\w+)}}')
+SET_VARIABLE = re.compile(
+    r'pm\.collectionVariables\.set\(\s*["\'](\w+)["\']\s*,\s*(.+?)\)\s*;?$',
+    re.MULTILINE)
+DECLARATION = r'(?:const|let|var)\s+{}\s*=\s*(.+?);?$'
+LODASH_GET = re.compile(r'_\.get\(\s*responseData\s*,\s*["\']([\w.]+)["\']')
+PATH = re.compile(r'^responseData((?:\.\w+|\[\d+\])*)'
+                  r'(?:\.slice\((\d+),\s*(\d+)\))?$')
+
+
+class Extraction:
+    """Сохранение переменных из ответа, как в тестах коллекции:
+    ``pm.collectionVariables.set("name", ...)`` с путем в ответе
+    (``responseData[0].id``, ``_.get(responseData, "id")``) и ``slice``."""
+
+    def __init__(self, script):
+        self.rules = []
+        for name, expression in SET_VARIABLE.findall(script):
+            expression = expression.strip()
+            declaration = re.search(
+                DECLARATION.format(re.escape(expression)), script,
+                re.MULTILINE)
+            if declaration:
+                expression = declaration.group(1).strip()
+            lodash = LODASH_GET.match(expression)
+            if lodash:
+                expression = f'responseData.{lodash.group(1)}'
+            path = PATH.match(expression)
+            if path:
+                self.rules.append((name, path.groups()))
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def apply(self, data, variables):
+        for name, (path, start, end) in self.rules:
+            value = data
+            try:
+                for key in re.findall(r'\w+', path):
+                    value = value[int(key) if key.isdigit() else key]
+            except (KeyError, IndexError, TypeError):
+                continue
+            if start is not None:
+                value = str(value)[int(start):int(end)]
+            variables[name] = value
+
+
+class Step:
+    """Запрос коллекции с унаследованной от папок авторизацией."""
+
+    def __init__(self, item, auth, scenario):
+        request = item['request']
+        self.name = item['name']
+        self.scenario = scenario
+        self.method = request['method']
+        url = request['url']
+        self.url = url['raw'] if isinstance(url, dict) else url
+        self.auth = request.get('auth') or auth
+        if self.auth and self.auth.get('type') == 'inherit':
+            self.auth = auth
+        body = request.get('body') or {}
+        self.body = body.get('raw', '') if body.get('mode') == 'raw' else ''
+        self.headers = {
+            header['key']: header['value']
+            for header in request.get('header', [])
+            if not header.get('disabled')
+        }
+        self.extraction = Extraction('\n'.join(
+            line
+            for event in item.get('event', []) if event['listen'] == 'test'
+            for line in event['script'].get('exec', [])
+        ))
+
+    def build(self, variables):
+        def substitute(text):
+            return VARIABLE.sub(
+                lambda match: str(variables.get(match[1], match[0])), text)
+
+        headers = {key: substitute(value)
+                   for key, value in self.headers.items()}
+        if self.auth and self.auth.get('type') == 'apikey':
+            options = {option['key']: option['value']
+                       for option in self.auth['apikey']}
+            if options.get('in', 'header') == 'header':
+                headers[options['key']] = substitute(options['value'])
+        elif self.auth and self.auth.get('type') == 'bearer':
+            options = {option['key']: option['value']
+                       for option in self.auth['bearer']}
+            headers['Authorization'] = (
+                f'Bearer {substitute(options["token"])}')
+        extra = {
+            'HTTP_' + key.upper().replace('-', '_'): value
+            for key, value in headers.items()
+            if key.lower() != 'content-type'
+        }
+        content_type = headers.get('Content-Type', 'application/json')
+        path = quote(substitute(self.url), safe="/?&=%:+,;@")
+        return path, substitute(self.body), content_type, extra
+
+
+@contextmanager
+def quiet_request_log():
+    """Без предупреждений о 4xx: коллекция намеренно шлет неверные
+    запросы."""
+    logger = logging.getLogger('django.request')
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+def load_steps(items, auth=None, scenario=None):
+    for item in items:
+        item_auth = item.get('auth') or auth
+        if item_auth and item_auth.get('type') == 'inherit':
+            item_auth = auth
+        if 'item' in item:
+            yield from load_steps(item['item'], item_auth,
+                                  scenario or item['name'])
+        else:
+            yield Step(item, auth, scenario or item['name'])
+
+
+class Command(BaseCommand):
+    help = ('Воспроизведение сценариев postman-коллекции тестовым клиентом '
+            'Django: задержки p50/p95/p99, пропускная способность и число '
+            'SQL-запросов по маршрутам. Каждый проход откатывается, база '
+            'не меняется.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection', nargs='?',
+                            default=DEFAULT_COLLECTION)
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--warmup', type=int, default=1,
+                            help='Проходы без учета в результатах')
+        parser.add_argument('--scenario', action='append', default=[],
+                            help='Учитывать только указанные папки '
+                                 'коллекции; остальные выполняются для '
+                                 'подготовки переменных')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Отключить кэш ответов')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--compare',
+                            help='JSON предыдущего запуска для сравнения')
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['collection'], encoding='utf-8') as file:
+                collection = json.load(file)
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        steps = list(load_steps(collection['item'], collection.get('auth')))
+        scenarios = set(options['scenario']) or {
+            step.scenario for step in steps}
+        if not any(step.scenario in scenarios for step in steps):
+            raise CommandError('В коллекции нет подходящих запросов.')
+        variables = {variable['key']: variable.get('value', '')
+                     for variable in collection.get('variable', [])}
+        variables['baseUrl'] = ''
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root,
+            CACHES={**settings.CACHES, 'bench': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            RESPONSE_CACHE_ALIAS=(
+                'bench' if options['no_cache']
+                else settings.RESPONSE_CACHE_ALIAS),
+        ), quiet_request_log():
+            client = Client(raise_request_exception=False,
+                            SERVER_NAME=ReadPathCommand.host())
+            for _ in range(options['warmup']):
+                self.replay(client, steps, dict(variables))
+            samples = defaultdict(list)
+            elapsed = 0
+            for _ in range(options['iterations']):
+                for step, route, sample in self.replay(client, steps,
+                                                       dict(variables)):
+                    if step.scenario in scenarios:
+                        samples[route].append(sample)
+                        elapsed += sample[0]
+        result = self.summarize(collection, samples, elapsed, options)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(result, file, ensure_ascii=False, indent=2,
+                          sort_keys=True)
+        if options['json']:
+            self.stdout.write(json.dumps(result, ensure_ascii=False,
+                                         sort_keys=True))
+        else:
+            self.report(result)
+        if options['compare']:
+            try:
+                with open(options['compare'], encoding='utf-8') as file:
+                    self.compare(json.load(file), result)
+            except (OSError, ValueError) as error:
+                raise CommandError(error)
+
+    def replay(self, client, steps, variables):
+        """Один проход коллекции в транзакции, которая откатывается.
+
+        Каждый запрос выполняется в точке сохранения, чтобы ошибка БД
+        в одном запросе не прерывала проход; SQL точек сохранения
+        в число запросов не входит.
+        """
+        results = []
+        with transaction.atomic():
+            for step in steps:
+                path, body, content_type, extra = step.build(variables)
+                with transaction.atomic():
+                    with QueryRecorder() as recorder:
+                        started = time.perf_counter()
+                        response = client.generic(
+                            step.method, path, body, content_type, **extra)
+                        content = (b''.join(response.streaming_content)
+                                   if response.streaming
+                                   else response.content)
+                        latency = time.perf_counter() - started
+                    if response.status_code >= 500:
+                        transaction.set_rollback(True)
+                results.append((step, route_name(response.wsgi_request), (
+                    latency, response.status_code, recorder.count,
+                    recorder.duplicates)))
+                if step.extraction and response.status_code < 300:
+                    try:
+                        step.extraction.apply(json.loads(content), variables)
+                    except ValueError:
+                        pass
+            transaction.set_rollback(True)
+        return results
+
+    @staticmethod
+    def summarize(collection, samples, elapsed, options):
+        endpoints = {}
+        for route, route_samples in samples.items():
+            latencies = [sample[0] * 1000 for sample in route_samples]
+            queries = [sample[2] for sample in route_samples]
+            statuses = Counter(str(sample[1]) for sample in route_samples)
+            endpoints[route] = {
+                'requests': len(route_samples),
+                'statuses': dict(statuses),
+                'errors': sum(count for status, count in statuses.items()
+                              if int(status) >= 500),
+                'mean_ms': round(statistics.mean(latencies), 3),
+                'p50_ms': round(percentile(latencies, 0.50), 3),
+                'p95_ms': round(percentile(latencies, 0.95), 3),
+                'p99_ms': round(percentile(latencies, 0.99), 3),
+                'rps': round(len(latencies) * 1000 / sum(latencies), 1),
+                'queries_mean': round(statistics.mean(queries), 2),
+                'queries_max': max(queries),
+                'duplicate_queries_max': max(
+                    sample[3] for sample in route_samples),
+            }
+        total = sum(endpoint['requests'] for endpoint in endpoints.values())
+        return {
+            'collection': collection['info']['name'],
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'response_cache': not options['no_cache'],
+            'requests': total,
+            'elapsed_s': round(elapsed, 3),
+            'rps': round(total / elapsed, 1) if elapsed else None,
+            'endpoints': endpoints,
+        }
+
+    def report(self, result):
+        self.stdout.write(
+            f'{result["collection"]}: {result["requests"]} запросов, '
+            f'{result["elapsed_s"]:.1f} с в обработке, '
+            f'{result["rps"]:.0f} запр/с')
+        for route, stats in sorted(result['endpoints'].items()):
+            statuses = ', '.join(f'{status}×{count}' for status, count
+                                 in sorted(stats['statuses'].items()))
+            self.stdout.write(
+                f'{route}: p50 {stats["p50_ms"]:.1f} мс, '
+                f'p95 {stats["p95_ms"]:.1f} мс, '
+                f'p99 {stats["p99_ms"]:.1f} мс, '
+                f'SQL {stats["queries_mean"]:.1f} '
+                f'(макс. {stats["queries_max"]}), статусы: {statuses}')
+
+    def compare(self, baseline, result):
+        """Изменения p95 и числа запросов к БД относительно ``baseline``."""
+        self.stdout.write('Сравнение с предыдущим запуском:')
+        for route, stats in sorted(result['endpoints'].items()):
+            before = baseline.get('endpoints', {}).get(route)
+            if before is None:
+                self.stdout.write(f'{route}: новый маршрут')
+                continue
+            change = (stats['p95_ms'] / before['p95_ms'] - 1
+                      if before['p95_ms'] else 0)
+            queries = stats['queries_max'] - before['queries_max']
+            line = (f'{route}: p95 {change:+.0%}, '
+                    f'SQL {queries:+d} (макс. {stats["queries_max"]})')
+            self.stdout.write(self.style.WARNING(line) if queries > 0
+                              else line)
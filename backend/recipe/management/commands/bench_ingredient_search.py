@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Case, IntegerField, Value, When
+
+from api.ingredient_index import ingredient_index
+from recipe.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнение поиска ингредиентов: индекс в памяти против ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*',
+                            default=['а', 'мол', 'сах', 'соль', 'ко'])
+        parser.add_argument('--repeat', type=int, default=200)
+
+    @staticmethod
+    def orm_search(query):
+        return list(
+            Ingredient.objects.filter(name__icontains=query).annotate(
+                is_prefix=Case(
+                    When(name__istartswith=query, then=Value(0)),
+                    default=Value(1), output_field=IntegerField())
+            ).order_by('is_prefix', 'name').values(
+                'id', 'name', 'measurement_unit')
+        )
+
+    def measure(self, search, queries, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                search(query)
+        elapsed = time.perf_counter() - started
+        return elapsed / (repeat * len(queries)) * 1000
+
+    def handle(self, *args, **options):
+        queries, repeat = options['queries'], options['repeat']
+        ingredient_index.search()
+        for query in queries:
+            if (
+                {item['id'] for item in ingredient_index.search(query)}
+                != {item['id'] for item in self.orm_search(query)}
+            ):
+                self.stderr.write(f'Результаты расходятся для «{query}»')
+        orm = self.measure(self.orm_search, queries, repeat)
+        index = self.measure(ingredient_index.search, queries, repeat)
+        self.stdout.write(
+            f'Ингредиентов: {Ingredient.objects.count()}, '
+            f'запросов: {repeat * len(queries)}\n'
+            f'ORM: {orm:.3f} мс/запрос\n'
+            f'Индекс: {index:.3f} мс/запрос\n'
+            f'Ускорение: {orm / index:.1f}x'
+        )
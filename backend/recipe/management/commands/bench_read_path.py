@@ -0,0 +1,212 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+DEFAULT_PATHS = [
+    '/api/recipes/',
+    '/api/recipes/?limit=6&offset=6',
+    '/api/ingredients/?name=са',
+]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Пропускная способность анонимных GET-запросов при множестве '
+            'одновременных соединений: WSGI против ASGI')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+        parser.add_argument('--mode', choices=('wsgi', 'asgi', 'both'),
+                            default='both')
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Число одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Число синхронных обработчиков WSGI, '
+                                 'как воркеров gunicorn')
+        parser.add_argument('--db-latency', type=float, default=0,
+                            help='Задержка каждого запроса к БД в мс, '
+                                 'как при сетевой базе данных')
+        parser.add_argument('--no-cache', action='store_true',
+                            help='Отключить кэш ответов')
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['mode'] == 'both':
+            results = [self.run_subprocess(mode, options)
+                       for mode in ('wsgi', 'asgi')]
+        else:
+            results = [self.run(options)]
+        if options['json']:
+            self.stdout.write(json.dumps(results))
+            return
+        self.stdout.write(
+            f'Клиентов: {options["concurrency"]}, '
+            f'запросов: {options["requests"]}')
+        for result in results:
+            self.stdout.write(
+                f'{result["mode"].upper()}'
+                f'{" (async views)" if result["async_views"] else ""}: '
+                f'{result["rps"]:.0f} запр/с, '
+                f'p50 {result["p50"]:.1f} мс, p95 {result["p95"]:.1f} мс, '
+                f'p99 {result["p99"]:.1f} мс, ошибок: {result["errors"]}')
+
+    def run_subprocess(self, mode, options):
+        """Каждый режим в отдельном процессе: ASGI с асинхронными
+        маршрутами, WSGI с синхронным стеком DRF."""
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'),
+            'bench_read_path', *options['paths'], '--mode', mode, '--json',
+            '--concurrency', str(options['concurrency']),
+            '--requests', str(options['requests']),
+            '--workers', str(options['workers']),
+            '--db-latency', str(options['db_latency']),
+            *(['--no-cache'] if options['no_cache'] else []),
+        ]
+        env = {**os.environ,
+               'ASYNC_READ_VIEWS': 'True' if mode == 'asgi' else 'False'}
+        completed = subprocess.run(command, env=env, capture_output=True,
+                                   text=True)
+        if completed.returncode:
+            raise CommandError(completed.stderr)
+        return json.loads(completed.stdout)[0]
+
+    def run(self, options):
+        paths = [quote(path, safe='/?&=') for path in options['paths']]
+        total = options['requests']
+        latency = options['db_latency'] / 1000
+
+        def delay(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_delay(connection, **kwargs):
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        if latency:
+            connection_created.connect(add_delay)
+        with override_settings(
+            CACHES={**settings.CACHES, 'bench': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+            RESPONSE_CACHE_ALIAS=(
+                'bench' if options['no_cache']
+                else settings.RESPONSE_CACHE_ALIAS),
+        ):
+            if options['mode'] == 'wsgi':
+                timings, elapsed = self.run_wsgi(
+                    paths, total, options['concurrency'],
+                    options['workers'])
+            else:
+                timings, elapsed = asyncio.run(
+                    self.run_asgi(paths, total, options['concurrency']))
+        latencies = [latency * 1000 for latency, _ in timings]
+        return {
+            'mode': options['mode'],
+            'async_views': settings.ASYNC_READ_VIEWS,
+            'requests': total,
+            'rps': total / elapsed,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'errors': sum(not ok for _, ok in timings),
+        }
+
+    @staticmethod
+    def host():
+        hosts = [host for host in settings.ALLOWED_HOSTS
+                 if host and '*' not in host and not host.startswith('.')]
+        return hosts[0] if hosts else 'localhost'
+
+    def run_wsgi(self, paths, total, concurrency, workers):
+        """Клиенты в потоках ждут одного из ``workers`` обработчиков."""
+        application = get_wsgi_application()
+        slots = threading.BoundedSemaphore(workers)
+        host = self.host()
+
+        def call(path):
+            url = urlsplit(path)
+            environ = {
+                'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+                'PATH_INFO': url.path, 'QUERY_STRING': url.query,
+                'SERVER_NAME': host, 'SERVER_PORT': '80',
+                'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': host,
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+            }
+            statuses = []
+            started = time.perf_counter()
+            with slots:
+                body = application(
+                    environ,
+                    lambda status, headers, *args: statuses.append(status))
+                for _ in body:
+                    pass
+                body.close()
+            return (time.perf_counter() - started,
+                    statuses[0].startswith('200'))
+
+        for path in paths:
+            call(path)
+        with ThreadPoolExecutor(concurrency) as pool:
+            started = time.perf_counter()
+            timings = list(pool.map(
+                call, (paths[i % len(paths)] for i in range(total))))
+            return timings, time.perf_counter() - started
+
+    async def run_asgi(self, paths, total, concurrency):
+        """Клиенты — задачи одного цикла событий, как в воркере uvicorn."""
+        application = get_asgi_application()
+        clients = asyncio.Semaphore(concurrency)
+        host = self.host().encode()
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def call(path):
+            url = urlsplit(path)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'},
+                'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+                'path': url.path, 'raw_path': url.path.encode(),
+                'query_string': url.query.encode(), 'root_path': '',
+                'headers': [(b'host', host)],
+                'client': ('127.0.0.1', 0), 'server': (host.decode(), 80),
+            }
+            messages = []
+
+            async def send(message):
+                messages.append(message)
+
+            async with clients:
+                started = time.perf_counter()
+                await application(scope, receive, send)
+                return time.perf_counter() - started, (
+                    messages[0]['status'] == 200)
+
+        for path in paths:
+            await call(path)
+        started = time.perf_counter()
+        timings = await asyncio.gather(*(
+            call(paths[i % len(paths)]) for i in range(total)))
+        return timings, time.perf_counter() - started
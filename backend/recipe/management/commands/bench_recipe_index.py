@@ -0,0 +1,120 @@
+import json
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.recipe_index import RecipeIndex
+
+from .bench_read_path import percentile
+from .seed_data import Popularity
+
+
+class Command(BaseCommand):
+    help = ('Замер индекса рецептов: построение, сохранение и загрузка '
+            'снимка, задержки похожих рецептов и подбора по продуктам. '
+            'По умолчанию на синтетической матрице, без обращения к БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--vocabulary', type=int, default=2186,
+                            help='Число различных ингредиентов')
+        parser.add_argument('--ingredients', type=int, nargs=2,
+                            default=(3, 15), metavar=('MIN', 'MAX'),
+                            help='Число ингредиентов в рецепте')
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--limit', type=int, default=6)
+        parser.add_argument('--pantry', type=int, default=10,
+                            help='Число продуктов в запросе подбора')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--from-db', action='store_true',
+                            help='Строить индекс по таблице рецептов')
+        parser.add_argument('--json', action='store_true')
+
+    def handle(self, *args, **options):
+        low, high = options['ingredients']
+        if not 1 <= low <= high <= options['vocabulary']:
+            raise CommandError('Неверный диапазон числа ингредиентов.')
+        rng = random.Random(options['seed'])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'recipe_index.pickle')
+            index = RecipeIndex(path)
+            rows = None if options['from_db'] else list(
+                self.rows(options, rng))
+            started = time.perf_counter()
+            if rows is None:
+                index.build()
+            else:
+                index.load_rows(rows)
+            build = time.perf_counter() - started
+            started = time.perf_counter()
+            index.save()
+            save = time.perf_counter() - started
+            size = os.path.getsize(path)
+            started = time.perf_counter()
+            RecipeIndex(path).load()
+            load = time.perf_counter() - started
+        recipes = index.recipe_ids()
+        if not recipes:
+            raise CommandError('Нет рецептов с ингредиентами.')
+        queries = min(options['queries'], len(recipes))
+        similar = self.measure(
+            lambda recipe_id: index.rank(recipe_id, options['limit']),
+            rng.sample(recipes, queries))
+        products = Popularity(index.ingredient_ids(), rng)
+        pantry = self.measure(
+            lambda ingredients: index.match(ingredients, options['limit']),
+            [products.sample(options['pantry']) for _ in range(queries)])
+        result = {
+            'recipes': len(index),
+            'build_s': round(build, 3),
+            'save_s': round(save, 3),
+            'load_s': round(load, 3),
+            'snapshot_mb': round(size / 2 ** 20, 1),
+            'queries': queries,
+            'similar': similar,
+            'pantry': pantry,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(result, sort_keys=True))
+            return
+        self.stdout.write(
+            f'Рецептов: {result["recipes"]}, '
+            f'построение {result["build_s"]:.2f} с, '
+            f'сохранение {result["save_s"]:.2f} с, '
+            f'загрузка {result["load_s"]:.2f} с '
+            f'(снимок {result["snapshot_mb"]} МБ)')
+        for title, stats in (('Похожие рецепты', similar),
+                             ('Подбор по продуктам', pantry)):
+            self.stdout.write(
+                f'{title}: p50 {stats["p50_ms"]:.1f} мс, '
+                f'p95 {stats["p95_ms"]:.1f} мс, '
+                f'p99 {stats["p99_ms"]:.1f} мс')
+
+    @staticmethod
+    def measure(query, arguments):
+        """Перцентили задержки ``query`` по аргументам, без
+        обращения к БД (индекс уже загружен)."""
+        latencies = []
+        for argument in arguments:
+            started = time.perf_counter()
+            query(argument)
+            latencies.append((time.perf_counter() - started) * 1000)
+        return {
+            'p50_ms': round(percentile(latencies, 0.50), 3),
+            'p95_ms': round(percentile(latencies, 0.95), 3),
+            'p99_ms': round(percentile(latencies, 0.99), 3),
+        }
+
+    @staticmethod
+    def rows(options, rng):
+        """Пары (рецепт, ингредиент) с популярными ингредиентами, как
+        у ``seed_data``."""
+        low, high = options['ingredients']
+        popular = Popularity(range(1, options['vocabulary'] + 1), rng)
+        for recipe_id in range(1, options['recipes'] + 1):
+            size = round(rng.triangular(low, high, low))
+            for ingredient_id in popular.sample(size):
+                yield recipe_id, ingredient_id
@@ -0,0 +1,26 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from api.recipe_index import recipe_index
+from recipe.models import RecipeDeletion
+
+
+class Command(BaseCommand):
+    help = ('Построение снимка индекса рецептов по ингредиентам, чтобы '
+            'процессы приложения не строили его при старте')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        recipe_index.build()
+        recipe_index.save()
+        # Процессы со снимком старше срока хранения сверяют все id.
+        RecipeDeletion.objects.filter(deleted_at__lt=now() - timedelta(
+            seconds=settings.RECIPE_INDEX_DELETIONS_TTL)).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов: {len(recipe_index)}, '
+            f'{time.perf_counter() - started:.1f} с, '
+            f'снимок: {recipe_index.get_path()}'))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from recipe.models import ShoppingCartIngredient
+
+
+class Command(BaseCommand):
+    help = ('Проверка сумм ингредиентов в корзинах и пересчет '
+            'расходящихся')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Пересчитать суммы пользователей с расхождениями')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать суммы всех пользователей')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            ShoppingCartIngredient.objects.rebuild()
+            self.stdout.write(self.style.SUCCESS('Все суммы пересчитаны.'))
+            return
+        expected = {
+            (user_id, pk): total for user_id, pk, total
+            in ShoppingCartIngredient.objects.expected_totals().iterator()
+        }
+        actual = {
+            (user_id, pk): amount for user_id, pk, amount
+            in ShoppingCartIngredient.objects.values_list(
+                'user_id', 'ingredient_id', 'amount').iterator()
+        }
+        broken_users = {
+            user_id for user_id, pk in expected.keys() | actual.keys()
+            if expected.get((user_id, pk)) != actual.get((user_id, pk))
+        }
+        if not broken_users:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет.'))
+            return
+        self.stdout.write(self.style.WARNING(
+            f'Расхождения у пользователей: {len(broken_users)}'))
+        if options['rebuild']:
+            ShoppingCartIngredient.objects.rebuild(broken_users)
+            self.stdout.write(self.style.SUCCESS('Суммы пересчитаны.'))
@@ -0,0 +1,190 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F, Q
+
+from api.authentication import invalidate_user
+from api.cache import RECIPES, response_cache
+from api.images import schedule_image
+from api.recipe_index import recipe_index
+from api.short_links import short_link_resolver
+from recipe.models import (FeedEntry, Ingredient, Recipe, RecipeIngredient,
+                           Subscription, User)
+from recipe.readers import batched, iter_json_records
+
+
+class RecordError(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Массовый импорт рецептов из JSON или NDJSON. Каждая запись: '
+            '{"name", "text", "cooking_time", "author", "image", '
+            '"ingredients": [{"name", "measurement_unit"?, "amount"}]}, '
+            'author — имя пользователя или email.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с рецептами')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--author',
+                            help='Автор для записей без поля author')
+        parser.add_argument('--max-errors-shown', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.ingredients = {}
+        for pk, name, unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'):
+            self.ingredients.setdefault(name.casefold(), pk)
+            self.ingredients[(name.casefold(), unit.casefold())] = pk
+        self.default_author = options['author']
+        self.errors_shown = options['max_errors_shown']
+        self.imported = self.failed = 0
+        self.bulk_authors = set()
+        started = time.perf_counter()
+        try:
+            file = open(options['path'], encoding='utf-8')
+        except OSError as error:
+            raise CommandError(error)
+        try:
+            with file:
+                records = enumerate(iter_json_records(file), 1)
+                for batch in batched(records, options['batch_size']):
+                    self.import_batch(batch)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'Импортировано: {self.imported}, ошибок: '
+                        f'{self.failed}, {self.imported / elapsed:.0f} '
+                        'рецептов/с')
+        except ValueError as error:
+            raise CommandError(
+                f'{error} Импортировано до ошибки: {self.imported}.')
+        finally:
+            self.rebuild_feeds()
+            response_cache.bump(RECIPES)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f} с. Импортировано: {self.imported}, '
+            f'ошибок: {self.failed}.'))
+
+    def report(self, number, error):
+        self.failed += 1
+        if self.errors_shown > 0:
+            self.errors_shown -= 1
+            self.stderr.write(f'Запись {number}: {error}')
+
+    def get_authors(self, batch):
+        names = {
+            record.get('author', self.default_author)
+            for _, record in batch if isinstance(record, dict)
+        } - {None}
+        authors = {}
+        for pk, username, email in User.objects.filter(
+            Q(username__in=names) | Q(email__in=names)
+        ).values_list('id', 'username', 'email'):
+            authors[username] = authors[email] = pk
+        return authors
+
+    def build(self, record, authors):
+        if not isinstance(record, dict):
+            raise RecordError('запись должна быть объектом.')
+        try:
+            author = authors[record.get('author', self.default_author)]
+        except KeyError:
+            raise RecordError(f'автор {record.get("author")!r} не найден.')
+        try:
+            recipe = Recipe(
+                name=str(record['name'])[:256], text=str(record['text']),
+                cooking_time=int(record['cooking_time']),
+                image=record.get('image', ''), author_id=author)
+            amounts = {}
+            for item in record['ingredients']:
+                name = str(item['name']).casefold()
+                unit = item.get('measurement_unit')
+                key = (name, str(unit).casefold()) if unit else name
+                if key not in self.ingredients:
+                    raise RecordError(f'ингредиент {item["name"]!r} '
+                                      'не найден.')
+                pk = self.ingredients[key]
+                amount = int(item['amount'])
+                if amount < 1 or pk in amounts:
+                    raise RecordError(
+                        f'неверное количество или повтор {item["name"]!r}.')
+                amounts[pk] = amount
+        except KeyError as error:
+            raise RecordError(f'нет поля {error}.')
+        except (TypeError, ValueError) as error:
+            raise RecordError(error)
+        if recipe.cooking_time < 1 or not amounts:
+            raise RecordError('нет ингредиентов или неверное время.')
+        return recipe, amounts
+
+    def import_batch(self, batch):
+        authors = self.get_authors(batch)
+        recipes, amounts = [], []
+        for number, record in batch:
+            try:
+                recipe, recipe_amounts = self.build(record, authors)
+            except RecordError as error:
+                self.report(number, error)
+                continue
+            recipes.append(recipe)
+            amounts.append(recipe_amounts)
+        if not recipes:
+            return
+        try:
+            with transaction.atomic():
+                bulk = self.save(recipes, amounts)
+        except DatabaseError as error:
+            self.failed += len(recipes)
+            self.stderr.write(f'Записи {batch[0][0]}–{batch[-1][0]}: '
+                              f'пакет отклонен БД: {error}')
+            return
+        self.imported += len(recipes)
+        if bulk:
+            self.after_bulk_save(recipes)
+
+    @staticmethod
+    def save(recipes, amounts):
+        """Сохраняет пакет; возвращает ``True``, если рецепты вставлены
+        через ``bulk_create`` без сигналов."""
+        bulk = connection.features.can_return_rows_from_bulk_insert
+        if bulk:
+            Recipe.objects.bulk_create(recipes)
+            for author, count in Counter(
+                    recipe.author_id for recipe in recipes).items():
+                User.objects.filter(pk=author).update(
+                    recipes_count=F('recipes_count') + count)
+        else:
+            for recipe in recipes:
+                recipe.save()
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient_id=pk, amount=amount)
+            for recipe, recipe_amounts in zip(recipes, amounts)
+            for pk, amount in recipe_amounts.items()
+        )
+        return bulk
+
+    def after_bulk_save(self, recipes):
+        """То, что для сохраненного рецепта делают сигналы ``post_save``:
+        копии фото, индекс рецептов по ингредиентам, короткие ссылки и кэш
+        токенов авторов. Ленты перестраиваются в конце импорта."""
+        authors = {recipe.author_id for recipe in recipes}
+        self.bulk_authors |= authors
+        for author in authors:
+            invalidate_user(author)
+        for recipe in recipes:
+            recipe_index.mark_changed(recipe.pk)
+            short_link_resolver.forget(recipe.pk)
+            if recipe.image.name:
+                schedule_image(Recipe, recipe.pk, 'image', 'image_variants')
+
+    def rebuild_feeds(self):
+        """Ленты подписчиков авторов, рецепты которых вставлены пакетом."""
+        if self.bulk_authors:
+            FeedEntry.objects.rebuild(
+                settings.FEED_FANOUT_LIMIT,
+                Subscription.objects.filter(
+                    author__in=self.bulk_authors).values('user'))
@@ -1,20 +1,82 @@
-import json
-from django.core.management.base import BaseCommand
+import csv
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import INGREDIENTS, response_cache
+from api.ingredient_index import ingredient_index
 from recipe.models import Ingredient
+from recipe.readers import batched, iter_json_records
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield {'name': row[0], 'measurement_unit': row[1]}
+
+
+READERS = {'json': iter_json_records, 'csv': iter_csv}
 
 
 class Command(BaseCommand):
-    help = 'Загрузка ингредиентов из JSON-файла'
-
-    def handle(self, *args, **kwargs):
-        with open('ingredients.json', encoding='utf-8') as file:
-            new_ingredients = [
-                Ingredient(**item)
-                for item in json.load(file)
-            ]
-        created_ingredients = Ingredient.objects.bulk_create(
-            new_ingredients, ignore_conflicts=True)
+    help = 'Загрузка ингредиентов из JSON- или CSV-файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'ingredients.json'),
+            help='Путь к файлу, например data/ingredients.csv')
+        parser.add_argument('--format', choices=READERS,
+                            help='Формат файла, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(
+            path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        created = existing = 0
+        try:
+            file = open(path, encoding='utf-8', newline='')
+        except OSError as error:
+            raise CommandError(error)
+        with file:
+            for batch in batched(READERS[file_format](file),
+                                 options['batch_size']):
+                batch_created, batch_existing = self.upsert(batch)
+                created += batch_created
+                existing += batch_existing
+        if created:
+            ingredient_index.invalidate()
+            response_cache.bump(INGREDIENTS)
         self.stdout.write(self.style.SUCCESS(
             'Данные успешно загружены! '
-            f'Добавлено записей: {len(created_ingredients)}'
+            f'Добавлено записей: {created}, уже были: {existing}'
         ))
+
+    @staticmethod
+    def upsert(batch):
+        """Вставляет отсутствующие ингредиенты пакета.
+
+        Возвращает число добавленных и уже существовавших записей.
+        """
+        keys = {
+            (item['name'].strip(), item['measurement_unit'].strip())
+            for item in batch
+        }
+        with transaction.atomic():
+            existing = set(Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('name', 'measurement_unit')) & keys
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in keys - existing),
+                ignore_conflicts=True
+            )
+            stored = set(Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list('name', 'measurement_unit')) & keys
+        return len(stored - existing), len(existing)
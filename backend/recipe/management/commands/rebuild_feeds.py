@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recipe.models import FeedEntry
+
+
+class Command(BaseCommand):
+    help = ('Построение лент подписок заново, например после массового '
+            'импорта подписок без сигналов')
+
+    def handle(self, *args, **options):
+        FeedEntry.objects.rebuild(settings.FEED_FANOUT_LIMIT)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedEntry.objects.count()}.'))
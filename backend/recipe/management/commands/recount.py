@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipe.models import recount_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков избранного, корзин и рецептов'
+
+    def handle(self, *args, **kwargs):
+        recount_counters()
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны.'))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.cache import POPULARITY, response_cache
+from recipe.models import refresh_popularity
+
+
+class Command(BaseCommand):
+    help = ('Пересчет рейтингов популярности рецептов за сутки, неделю и '
+            'все время. Запускается периодически (cron) или с --interval '
+            'как фоновый процесс.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1000,
+                            help='Рецептов в рейтинге каждого периода')
+        parser.add_argument('--interval', type=int,
+                            help='Повторять каждые N секунд')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            changed = refresh_popularity(options['size'])
+            if any(changed.values()):
+                response_cache.bump(POPULARITY)
+            self.stdout.write(
+                'Изменено строк: ' + ', '.join(
+                    f'{period.label.lower()} {count}'
+                    for period, count in changed.items())
+                + f' ({time.perf_counter() - started:.2f} с)')
+            if not options['interval']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import is_process_local
+from api.request_stats import request_stats
+
+
+class Command(BaseCommand):
+    help = 'Статистика времени и SQL-запросов по маршрутам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--reset', action='store_true',
+                            help='Сбросить статистику')
+
+    def handle(self, *args, **options):
+        if is_process_local(request_stats.cache):
+            raise CommandError(
+                'Статистика хранится в памяти процессов сервера и этой '
+                'команде не видна: задайте REQUEST_STATS_CACHE_ALIAS с общим '
+                'бэкендом кэша или смотрите /api/request-stats/.')
+        summary = request_stats.summary()
+        if options['json']:
+            self.stdout.write(json.dumps(summary, ensure_ascii=False))
+        elif not summary:
+            self.stdout.write('Статистики пока нет')
+        for route, stats in sorted(
+                summary.items(), key=lambda item: -item[1]['requests']):
+            if options['json']:
+                break
+            sql = (f'SQL: {stats["avg_queries"]:.1f} запр., '
+                   f'{stats["avg_sql_ms"]:.1f} мс'
+                   if stats['sampled'] else 'SQL: нет выборки')
+            self.stdout.write(
+                f'{route}: {stats["requests"]} запр., '
+                f'среднее {stats["avg_ms"]:.1f} мс, '
+                f'p95 ≤ {stats["p95_ms"] or "∞"} мс; {sql}, '
+                f'повторов {stats["duplicate_queries"]}, '
+                f'N+1 {stats["n_plus_one_requests"]}')
+            sample = stats['n_plus_one_sample']
+            if sample:
+                self.stdout.write(
+                    f'    ×{sample["repeats"]}: {sample["sql"]}')
+        if options['reset']:
+            request_stats.reset()
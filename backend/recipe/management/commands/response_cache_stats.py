@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import is_process_local, response_cache
+
+
+class Command(BaseCommand):
+    help = 'Статистика кэша ответов анонимным пользователям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Сбросить статистику')
+
+    def handle(self, *args, **options):
+        if is_process_local(response_cache.cache):
+            raise CommandError(
+                'Счетчики хранятся в памяти процессов сервера и этой '
+                'команде не видны: задайте RESPONSE_CACHE_ALIAS с общим '
+                'бэкендом кэша.')
+        stats = response_cache.stats()
+        self.stdout.write(
+            f'Попаданий: {stats["hits"]}, промахов: {stats["misses"]}, '
+            f'доля попаданий: {stats["hit_ratio"]:.1%}'
+        )
+        if options['reset']:
+            response_cache.reset_stats()
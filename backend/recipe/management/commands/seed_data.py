@@ -0,0 +1,167 @@
+import itertools
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import RECIPES, response_cache
+from recipe.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                           ShoppingCart, ShoppingCartIngredient,
+                           Subscription, User, recount_counters)
+
+from .import_recipes import Command as ImportRecipesCommand
+
+DISHES = ('Салат', 'Суп', 'Рагу', 'Запеканка', 'Пирог', 'Омлет', 'Каша',
+          'Паста', 'Плов', 'Соус', 'Котлеты', 'Блины', 'Смузи', 'Жаркое')
+STEPS = ('Нарежьте', 'Обжарьте', 'Смешайте', 'Потушите', 'Запеките',
+         'Отварите', 'Взбейте', 'Добавьте')
+
+
+class Popularity:
+    """Выбор объектов по закону Ципфа: немногие популярны, большинство
+    встречается редко, как ингредиенты, авторы и рецепты в жизни."""
+
+    def __init__(self, items, rng, skew=1.0):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(
+            1 / (rank + 1) ** skew for rank in range(len(self.items))))
+
+    def sample(self, count, exclude=None):
+        """``count`` различных объектов, кроме ``exclude``."""
+        count = min(count, len(self.items) - (exclude is not None))
+        chosen = set()
+        while len(chosen) < count:
+            item, = self.rng.choices(self.items,
+                                     cum_weights=self.cum_weights)
+            if item != exclude:
+                chosen.add(item)
+        return chosen
+
+
+class Command(BaseCommand):
+    help = ('Синтетические данные для нагрузочного тестирования: '
+            'пользователи, рецепты, подписки, избранное и корзины')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000,
+                            help='Общее число рецептов')
+        parser.add_argument('--ingredients', type=int, nargs=2,
+                            default=(3, 15), metavar=('MIN', 'MAX'),
+                            help='Число ингредиентов в рецепте')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок у пользователя')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Рецептов в избранном у пользователя')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в корзине у пользователя')
+        parser.add_argument('--ingredients-file',
+                            help='Каталог ингредиентов, если таблица пуста')
+        parser.add_argument('--prefix', default='seed',
+                            help='Префикс имен создаваемых пользователей')
+        parser.add_argument('--password', default='seed-password')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора для воспроизводимости')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        low, high = options['ingredients']
+        if not 1 <= low <= high:
+            raise CommandError('Неверный диапазон числа ингредиентов.')
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.perf_counter()
+        if not Ingredient.objects.exists():
+            call_command('load_ingredients', *filter(
+                None, [options['ingredients_file']]), stdout=self.stdout)
+        ingredients = dict(Ingredient.objects.values_list('id', 'name'))
+        if len(ingredients) < low:
+            raise CommandError('Недостаточно ингредиентов в базе.')
+        with transaction.atomic():
+            users = self.create_users(
+                options['users'], options['prefix'], options['password'])
+            recipes = self.create_recipes(
+                users, options['recipes'], ingredients, low, high)
+            authors = Popularity(users, self.rng)
+            popular = Popularity(recipes, self.rng)
+            counts = {
+                Subscription: self.link(
+                    Subscription, 'author_id', users, authors,
+                    options['subscriptions']),
+                Favorite: self.link(Favorite, 'recipe_id', users, popular,
+                                    options['favorites']),
+                ShoppingCart: self.link(ShoppingCart, 'recipe_id', users,
+                                        popular, options['cart']),
+            }
+            recount_counters()
+            ShoppingCartIngredient.objects.rebuild(users)
+            FeedEntry.objects.rebuild(settings.FEED_FANOUT_LIMIT, users)
+        response_cache.bump(RECIPES)
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {time.perf_counter() - started:.1f} с. '
+            f'Пользователей: {len(users)}, рецептов: {len(recipes)}, '
+            f'подписок: {counts[Subscription]}, '
+            f'в избранном: {counts[Favorite]}, '
+            f'в корзинах: {counts[ShoppingCart]}.'))
+
+    def create_users(self, count, prefix, password):
+        """Пользователи ``<prefix>-<n>`` с номерами после уже созданных."""
+        start = User.objects.filter(username__startswith=f'{prefix}-').count()
+        password = make_password(password)
+        usernames = [f'{prefix}-{n}' for n in range(start, start + count)]
+        User.objects.bulk_create(
+            (
+                User(username=username, email=f'{username}@example.com',
+                     first_name='Тест', last_name=username, password=password)
+                for username in usernames
+            ),
+            batch_size=self.batch_size
+        )
+        return list(User.objects.filter(
+            username__in=usernames).values_list('id', flat=True))
+
+    def create_recipes(self, users, count, ingredients, low, high):
+        """Рецепты случайных авторов из популярных ингредиентов; число
+        ингредиентов ближе к нижней границе диапазона."""
+        authors = Popularity(users, self.rng, skew=0.5)
+        popular = Popularity(ingredients, self.rng)
+        created = []
+        for start in range(0, count, self.batch_size):
+            recipes, amounts = [], []
+            for _ in range(start, min(count, start + self.batch_size)):
+                size = round(self.rng.triangular(low, high, low))
+                chosen = popular.sample(size)
+                names = [ingredients[pk] for pk in chosen]
+                recipes.append(Recipe(
+                    name=f'{self.rng.choice(DISHES)}: {names[0]}'[:256],
+                    text=' '.join(
+                        f'{self.rng.choice(STEPS)} {name}.' for name in names),
+                    cooking_time=self.rng.randint(5, 180),
+                    author_id=authors.sample(1).pop(), image=''))
+                amounts.append({pk: self.rng.choice((1, 2, 5, 10, 50, 100,
+                                                     200, 500))
+                                for pk in chosen})
+            ImportRecipesCommand.save(recipes, amounts)
+            created.extend(recipe.pk for recipe in recipes)
+        return created
+
+    def link(self, model, field, users, popularity, per_user):
+        """Связи каждого пользователя с ``per_user`` популярными объектами."""
+        rows = (
+            model(user_id=user, **{field: target})
+            for user in users
+            for target in popularity.sample(
+                per_user, exclude=user if field == 'author_id' else None)
+        )
+        before = model.objects.count()
+        model.objects.bulk_create(rows, batch_size=self.batch_size,
+                                  ignore_conflicts=True)
+        return model.objects.count() - before
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.authentication import token_cache
+from api.cache import is_process_local
+
+
+class Command(BaseCommand):
+    help = 'Статистика кэша токенов авторизации'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Сбросить статистику')
+
+    def handle(self, *args, **options):
+        if is_process_local(token_cache.stats_cache):
+            raise CommandError(
+                'Счетчики хранятся в памяти процессов сервера и этой '
+                'команде не видны: задайте REQUEST_STATS_CACHE_ALIAS с общим '
+                'бэкендом кэша.')
+        stats = token_cache.stats()
+        self.stdout.write(
+            f'Попаданий в памяти процесса: {stats["local_hits"]}, '
+            f'в общем кэше: {stats["shared_hits"]}, '
+            f'промахов: {stats["misses"]}, '
+            f'доля попаданий: {stats["hit_ratio"]:.1%}, '
+            f'сбросов: {stats["invalidations"]}'
+        )
+        if options['reset']:
+            token_cache.reset_stats()
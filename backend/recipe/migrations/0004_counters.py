@@ -0,0 +1,50 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:01
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def related_count(model, field):
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('pk')).values('total'),
+        output_field=models.IntegerField()
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    User = apps.get_model('recipe', 'User')
+    Recipe.objects.update(
+        favorites_count=related_count(
+            apps.get_model('recipe', 'Favorite'), 'recipe'),
+        shopping_cart_count=related_count(
+            apps.get_model('recipe', 'ShoppingCart'), 'recipe'),
+    )
+    User.objects.update(recipes_count=related_count(Recipe, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0003_shoppingcartingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Сливает повторные загрузки каталога в одну запись ингредиента."""
+    Ingredient = apps.get_model('recipe', 'Ingredient')
+    RecipeIngredient = apps.get_model('recipe', 'RecipeIngredient')
+    ShoppingCartIngredient = apps.get_model(
+        'recipe', 'ShoppingCartIngredient')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keep=models.Min('id'), total=models.Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in duplicates.iterator():
+        extra = Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keep'])
+        for model, owner in ((RecipeIngredient, 'recipe'),
+                             (ShoppingCartIngredient, 'user')):
+            for row in model.objects.filter(ingredient__in=extra):
+                kept = model.objects.filter(
+                    **{owner: getattr(row, f'{owner}_id')},
+                    ingredient_id=group['keep']
+                ).first()
+                if kept is None:
+                    row.ingredient_id = group['keep']
+                    row.save(update_fields=['ingredient'])
+                else:
+                    kept.amount += row.amount
+                    kept.save(update_fields=['amount'])
+                    row.delete()
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0006_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+    ]
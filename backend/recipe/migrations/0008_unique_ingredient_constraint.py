@@ -0,0 +1,20 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """Ограничение добавляется отдельной транзакцией после слияния
+    дубликатов: в PostgreSQL таблицу нельзя изменить, пока в транзакции
+    есть отложенные проверки внешних ключей."""
+
+    dependencies = [
+        ('recipe', '0007_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
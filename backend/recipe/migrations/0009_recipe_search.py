@@ -0,0 +1,120 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:11
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipe_recipe_fts'
+
+POSTGRES_SQL = (
+    f"""
+    CREATE OR REPLACE FUNCTION recipe_search_vector_update()
+    RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}',
+                                  coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}',
+                                  coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    'DROP TRIGGER IF EXISTS recipe_search_vector_trigger ON recipe_recipe',
+    """
+    CREATE TRIGGER recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON recipe_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipe_search_vector_update()
+    """,
+    'UPDATE recipe_recipe SET name = name',
+    'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+    'ON recipe_recipe USING gin (search_vector)',
+)
+
+POSTGRES_DROP_SQL = (
+    'DROP INDEX IF EXISTS recipe_search_vector_idx',
+    'DROP TRIGGER IF EXISTS recipe_search_vector_trigger ON recipe_recipe',
+    'DROP FUNCTION IF EXISTS recipe_search_vector_update()',
+)
+
+SQLITE_TABLE_SQL = (
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, text, content='recipe_recipe', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+)
+
+SQLITE_TRIGGERS_SQL = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON recipe_recipe BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON recipe_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name, text ON recipe_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+)
+
+SQLITE_DROP_SQL = (
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_insert',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_delete',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_update',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+)
+
+
+def execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def install_search(apps, schema_editor):
+    """Индекс и триггеры поиска для текущей СУБД."""
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        execute(connection, POSTGRES_SQL)
+    elif connection.vendor == 'sqlite':
+        execute(connection, SQLITE_TABLE_SQL + SQLITE_TRIGGERS_SQL)
+
+
+def uninstall_search(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        execute(connection, POSTGRES_DROP_SQL)
+    elif connection.vendor == 'sqlite':
+        execute(connection, SQLITE_DROP_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_unique_ingredient_constraint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(install_search, uninstall_search),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.16 on 2026-10-18 04:02
+
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Время добавления существующих строк неизвестно: они не должны попасть
+# в рейтинги за сутки и неделю, поэтому получают дату в прошлом.
+UNKNOWN_CREATED_AT = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0009_recipe_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=UNKNOWN_CREATED_AT, verbose_name='Добавлен'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=UNKNOWN_CREATED_AT, verbose_name='Добавлен'),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='RecipePopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'За сутки'), ('week', 'За неделю'), ('all', 'За все время')], max_length=4, verbose_name='Период')),
+                ('score', models.PositiveIntegerField(verbose_name='Популярность')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='popularity_scores', to='recipe.recipe', verbose_name='Рецепт')),
+            ],
+            options={
+                'verbose_name': 'популярность рецепта',
+                'verbose_name_plural': 'Популярность рецептов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='recipepopularity',
+            constraint=models.UniqueConstraint(fields=('period', 'recipe'), name='unique_recipe_popularity'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0011_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipe_id', models.IntegerField(verbose_name='id рецепта')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Удален')),
+            ],
+            options={
+                'verbose_name': 'удаление рецепта',
+                'verbose_name_plural': 'Удаления рецептов',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.16 on 2026-10-18 12:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_feeds(apps, schema_editor):
+    """Заполняет ленты по существующим подпискам; авторы с числом
+    подписчиков больше ``FEED_FANOUT_LIMIT`` читаются в ленты при
+    запросе."""
+    User = apps.get_model('recipe', 'User')
+    Subscription = apps.get_model('recipe', 'Subscription')
+    FeedEntry = apps.get_model('recipe', 'FeedEntry')
+    User.objects.filter(pk__in=Subscription.objects.order_by().values(
+        'author').annotate(total=models.Count('pk')).filter(
+        total__gt=settings.FEED_FANOUT_LIMIT).values('author')
+    ).update(pull_feed=True)
+    FeedEntry.objects.bulk_create(
+        (
+            FeedEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id)
+            for user_id, author_id, recipe_id in Subscription.objects.filter(
+                author__pull_feed=False, author__recipes__isnull=False
+            ).values_list('user_id', 'author_id',
+                          'author__recipes').iterator()
+        ),
+        batch_size=1000, ignore_conflicts=True
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0012_recipedeletion'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,62 @@
+from collections import Counter
+from datetime import timedelta
+
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 from django.core.exceptions import ValidationError
 
+from .search import search_recipes
+
+
+def change_counters(model, pks, field, delta):
+    """Атомарно изменяет счетчики строк, не опуская их ниже нуля."""
+    if not pks:
+        return
+    rows = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: models.F(field) + delta})
+
+
+def change_counter(model, pk, field, delta):
+    change_counters(model, [pk], field, delta)
+
+
+class DenormalizedFieldsMixin:
+    """Поля ``denormalized_fields`` меняются только запросами ``update()``,
+    поэтому полное сохранение объекта их не перезаписывает: иначе значение
+    из памяти затерло бы изменения, сделанные после загрузки объекта.
+    Явно перечисленные в ``update_fields`` поля сохраняются как обычно."""
+
+    denormalized_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and not args
+                and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')):
+            skipped = {*self.denormalized_fields, *self.get_deferred_fields()}
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped
+                and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
+
+
+def related_count(model, field):
+    """Подзапрос числа связанных строк ``model`` для пересчета счетчиков."""
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(total=models.Count('pk')).values('total'),
+        output_field=models.IntegerField()
+    ), 0)
+
 
 def custom_username_validator(value):
     """Кастомная валидация имени пользователя."""
@@ -23,7 +76,7 @@ def custom_username_validator(value):
             f'Имя пользователя содержит недопустимые символы: {invalid_chars}')
 
 
-class User(AbstractUser):
+class User(DenormalizedFieldsMixin, AbstractUser):
 
     username = models.CharField(
         'Имя пользователя',
@@ -49,6 +102,16 @@ class User(AbstractUser):
     )
     avatar = models.ImageField('Аватар', upload_to='users/images/',
                                null=True, blank=True)
+    avatar_variants = models.JSONField(
+        'Копии аватара', default=dict, blank=True, editable=False)
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов', default=0, editable=False)
+    pull_feed = models.BooleanField(
+        'Лента без рассылки', default=False, editable=False,
+        help_text='Рецепты автора с большим числом подписчиков читаются '
+                  'в ленты при запросе, а не рассылаются при публикации')
+
+    denormalized_fields = ('recipes_count', 'avatar_variants', 'pull_feed')
 
     USERNAME_FIELD = 'email'
     USER_ID_FIELD = 'username'
@@ -97,17 +160,96 @@ class Ingredient(models.Model):
         verbose_name='Единица измерения',
         help_text='Введите единицу измерения ингредиента'
     )
+    updated_at = models.DateTimeField('Изменен', auto_now=True)
 
     class Meta:
         verbose_name = 'ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_related(self):
+        """Подгрузка автора и ингредиентов рецептов фиксированным
+        числом запросов."""
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            models.Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                ).only(
+                    'amount', 'recipe_id', 'ingredient__name',
+                    'ingredient__measurement_unit'
+                )
+            )
+        )
+
+    def limit_per_author(self, limit):
+        """Не более ``limit`` первых по названию рецептов каждого автора.
+
+        Ранжирование выполняется оконной функцией в одном запросе.
+        """
+        ranked = self.order_by().annotate(row_number=models.Window(
+            expression=RowNumber(),
+            partition_by=models.F('author_id'),
+            order_by=(models.F('name').asc(), models.F('id').asc()),
+        )).values('id', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.row_number <= %s',
+            (*params, limit)
+        ))
+
+    def order_by_popularity(self, period):
+        """Сортировка по предрассчитанной популярности за период, затем по
+        названию; рецепты вне рейтинга получают популярность 0."""
+        return self.annotate(
+            popularity_entry=models.FilteredRelation(
+                'popularity_scores',
+                condition=models.Q(popularity_scores__period=period)),
+        ).annotate(
+            popularity=Coalesce('popularity_entry__score', 0),
+        ).order_by('-popularity', 'name', 'id')
+
+    def search(self, query):
+        """Ранжированный полнотекстовый поиск по названию и описанию."""
+        return search_recipes(self, connections[self.db], query)
+
+    def with_user_flags(self, user):
+        """Аннотация флагов избранного, корзины и подписки на автора."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()),
+                author_is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk'))),
+            author_is_subscribed=models.Exists(Subscription.objects.filter(
+                user=user, author=models.OuterRef('author'))),
+        )
+
+
+class Recipe(DenormalizedFieldsMixin, models.Model):
     name = models.CharField(max_length=256, verbose_name='Название',
                             help_text='Введите название рецепта')
     text = models.TextField('Рецепт', help_text='Введите описание рецепта')
@@ -125,6 +267,8 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         verbose_name='Фото', help_text='Добавьте изображение рецепта'
     )
+    image_variants = models.JSONField(
+        'Копии фото', default=dict, blank=True, editable=False)
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
         help_text='Введите время приготовления в минутах',
@@ -132,11 +276,26 @@ class Recipe(models.Model):
             MinValueValidator(1)
         ]
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    shopping_cart_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False)
+    updated_at = models.DateTimeField('Изменен', auto_now=True,
+                                      db_index=True)
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False)
+
+    denormalized_fields = ('favorites_count', 'shopping_cart_count',
+                           'image_variants')
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='recipe_name_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -176,6 +335,72 @@ class RecipeIngredient(models.Model):
         )
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    """Пакетное добавление и удаление рецептов в избранном и корзине."""
+
+    def add_recipes(self, user, recipe_ids):
+        """Добавляет существующие рецепты, возвращает id добавленных.
+
+        Вставка с ``ON CONFLICT DO NOTHING RETURNING`` (PostgreSQL,
+        SQLite 3.35+) возвращает только действительно вставленные строки,
+        поэтому рецепт, параллельно добавленный другим запросом, не
+        учитывается в счетчике дважды. Сигналы при этом не отправляются,
+        и счетчик ``counter_field`` обновляется здесь одним запросом.
+        """
+        if not recipe_ids:
+            return []
+        connection = connections[self.db]
+        opts = self.model._meta
+        fields = [opts.get_field(name)
+                  for name in ('user', 'recipe', 'created_at')]
+        created_at = fields[2].get_db_prep_save(timezone.now(), connection)
+        quote = connection.ops.quote_name
+        sql = (
+            f'INSERT INTO {quote(opts.db_table)} '
+            f'({", ".join(quote(field.column) for field in fields)}) '
+            f'VALUES {", ".join(["(%s, %s, %s)"] * len(recipe_ids))} '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(fields[1].column)}'
+        )
+        params = [value for pk in recipe_ids
+                  for value in (user.pk, pk, created_at)]
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                inserted = {row[0] for row in cursor.fetchall()}
+            added = [pk for pk in recipe_ids if pk in inserted]
+            change_counters(Recipe, added, self.model.counter_field, 1)
+        return added
+
+    def remove_recipes(self, user, recipe_ids):
+        """Удаляет рецепты, возвращает id удаленных.
+
+        Удаление одним запросом ``DELETE ... RETURNING`` возвращает только
+        действительно удаленные строки, поэтому параллельный запрос не
+        уменьшит счетчик повторно. Как и при добавлении, сигналы не
+        отправляются, и счетчик уменьшается здесь одним запросом.
+        """
+        if not recipe_ids:
+            return []
+        connection = connections[self.db]
+        opts = self.model._meta
+        quote = connection.ops.quote_name
+        recipe_column = quote(opts.get_field('recipe').column)
+        sql = (
+            f'DELETE FROM {quote(opts.db_table)} '
+            f'WHERE {quote(opts.get_field("user").column)} = %s '
+            f'AND {recipe_column} IN '
+            f'({", ".join(["%s"] * len(recipe_ids))}) '
+            f'RETURNING {recipe_column}'
+        )
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [user.pk, *recipe_ids])
+                deleted = {row[0] for row in cursor.fetchall()}
+            removed = [pk for pk in recipe_ids if pk in deleted]
+            change_counters(Recipe, removed, self.model.counter_field, -1)
+        return removed
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -189,6 +414,11 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт'
     )
+    created_at = models.DateTimeField('Добавлен', auto_now_add=True,
+                                      db_index=True)
+
+    counter_field = 'favorites_count'
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'избранное'
@@ -218,6 +448,11 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         verbose_name='Рецепт'
     )
+    created_at = models.DateTimeField('Добавлен', auto_now_add=True,
+                                      db_index=True)
+
+    counter_field = 'shopping_cart_count'
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'корзина'
@@ -232,3 +467,391 @@ class ShoppingCart(models.Model):
 
     def __str__(self) -> str:
         return f'{self.user.username} добавил в корзину {self.recipe.name}'
+
+
+def recount_counters():
+    """Пересчитывает денормализованные счетчики по связанным таблицам."""
+    Recipe.objects.update(
+        favorites_count=related_count(Favorite, 'recipe'),
+        shopping_cart_count=related_count(ShoppingCart, 'recipe'),
+    )
+    User.objects.update(recipes_count=related_count(Recipe, 'author'))
+
+
+class ShoppingCartIngredientQuerySet(models.QuerySet):
+
+    def add_amounts(self, user_ids, amounts):
+        """Прибавляет к суммам пользователей количества ингредиентов.
+
+        ``amounts`` — словарь ``{id ингредиента: приращение}``, приращения
+        могут быть отрицательными. Строки с нулевой суммой удаляются.
+        """
+        amounts = {pk: amount for pk, amount in amounts.items() if amount}
+        if not amounts:
+            return
+        user_ids = list(user_ids)
+        if not user_ids:
+            return
+        with transaction.atomic():
+            self.bulk_create(
+                (
+                    self.model(user_id=user_id, ingredient_id=pk, amount=0)
+                    for user_id in user_ids
+                    for pk, amount in amounts.items() if amount > 0
+                ),
+                batch_size=1000, ignore_conflicts=True
+            )
+            rows = self.filter(user_id__in=user_ids,
+                               ingredient_id__in=amounts)
+            rows.update(amount=models.F('amount') + models.Case(
+                *(models.When(ingredient_id=pk, then=models.Value(amount))
+                  for pk, amount in amounts.items()),
+                output_field=models.IntegerField()
+            ))
+            rows.filter(amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe, sign=1):
+        """Добавляет (или при ``sign=-1`` вычитает) ингредиенты рецепта."""
+        self.add_amounts(user_ids, {
+            pk: sign * amount
+            for pk, amount in recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'amount')
+        })
+
+    def add_recipes(self, user_ids, recipe_ids, sign=1):
+        """То же для нескольких рецептов одним агрегирующим запросом."""
+        self.add_amounts(user_ids, {
+            pk: sign * amount
+            for pk, amount in RecipeIngredient.objects.filter(
+                recipe_id__in=recipe_ids
+            ).values('ingredient_id').annotate(
+                total=models.Sum('amount')
+            ).order_by().values_list('ingredient_id', 'total')
+        })
+
+    def change_recipe(self, recipe, old_amounts, new_amounts):
+        """Учитывает изменение состава рецепта в корзинах с ним."""
+        self.add_amounts(
+            recipe.shopping_carts.values_list('user_id', flat=True),
+            {
+                pk: new_amounts.get(pk, 0) - old_amounts.get(pk, 0)
+                for pk in old_amounts.keys() | new_amounts.keys()
+            }
+        )
+
+    @staticmethod
+    def expected_totals(user_ids=None):
+        """Суммы, посчитанные заново по корзинам и составу рецептов."""
+        carts = ShoppingCart.objects.all()
+        if user_ids is not None:
+            carts = carts.filter(user_id__in=user_ids)
+        return carts.values(
+            'user_id',
+            ingredient_id=models.F('recipe__recipe_ingredients__ingredient'),
+        ).exclude(ingredient_id=None).annotate(
+            total=models.Sum('recipe__recipe_ingredients__amount')
+        ).order_by().values_list('user_id', 'ingredient_id', 'total')
+
+    def rebuild(self, user_ids=None):
+        """Пересчитывает суммы заново."""
+        with transaction.atomic():
+            rows = self.all()
+            if user_ids is not None:
+                rows = rows.filter(user_id__in=user_ids)
+            rows.delete()
+            self.bulk_create(
+                (
+                    self.model(user_id=user_id, ingredient_id=pk,
+                               amount=total)
+                    for user_id, pk, total in self.expected_totals(user_ids)
+                ),
+                batch_size=1000
+            )
+
+
+class ShoppingCartIngredient(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя.
+
+    Поддерживается инкрементально при изменении корзины и состава
+    рецептов, чтобы список покупок читался одним запросом.
+    """
+
+    user = models.ForeignKey(
+        User,
+        related_name='shopping_cart_ingredients',
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        related_name='shopping_cart_ingredients',
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.IntegerField('Количество')
+
+    objects = ShoppingCartIngredientQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'ингредиент в корзине'
+        verbose_name_plural = 'Ингредиенты в корзине'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shoppingcart_ingredient',
+            ),
+        )
+
+    def __str__(self):
+        return (
+            f'{self.user.username}: {self.ingredient.name} - {self.amount} '
+            f'{self.ingredient.measurement_unit}'
+        )
+
+
+class RecipePopularityQuerySet(models.QuerySet):
+
+    def replace_scores(self, period, scores):
+        """Приводит рейтинг периода к ``scores`` (``{id рецепта: баллы}``),
+        записывая только изменившиеся строки. Возвращает их число."""
+        current = {entry.recipe_id: entry
+                   for entry in self.filter(period=period)}
+        changed = [entry for recipe_id, entry in current.items()
+                   if recipe_id in scores
+                   and entry.score != scores[recipe_id]]
+        for entry in changed:
+            entry.score = scores[entry.recipe_id]
+        removed = [entry.pk for recipe_id, entry in current.items()
+                   if recipe_id not in scores]
+        added = [recipe_id for recipe_id in scores
+                 if recipe_id not in current]
+        with transaction.atomic():
+            self.filter(pk__in=removed).delete()
+            self.bulk_update(changed, ['score'], batch_size=1000)
+            self.bulk_create(
+                (self.model(period=period, recipe_id=recipe_id,
+                            score=scores[recipe_id])
+                 for recipe_id in added),
+                batch_size=1000, ignore_conflicts=True)
+        return len(changed) + len(removed) + len(added)
+
+
+class RecipePopularity(models.Model):
+    """Популярность рецепта за период: сколько раз его добавили в
+    избранное и корзины. Пересчитывается периодически командой
+    ``refresh_popularity``, а не при каждом запросе."""
+
+    class Period(models.TextChoices):
+        DAY = 'day', 'За сутки'
+        WEEK = 'week', 'За неделю'
+        ALL = 'all', 'За все время'
+
+    period = models.CharField('Период', max_length=4, choices=Period.choices)
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='popularity_scores',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    score = models.PositiveIntegerField('Популярность')
+
+    objects = RecipePopularityQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'популярность рецепта'
+        verbose_name_plural = 'Популярность рецептов'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('period', 'recipe'),
+                name='unique_recipe_popularity',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.recipe_id} ({self.period}): {self.score}'
+
+
+POPULARITY_WINDOWS = {
+    RecipePopularity.Period.DAY: timedelta(days=1),
+    RecipePopularity.Period.WEEK: timedelta(days=7),
+}
+
+
+def popularity_scores(period, size, now=None):
+    """Не более ``size`` самых популярных рецептов периода.
+
+    Для окон считаются только добавления с ``created_at`` внутри окна
+    (по индексу), для всего времени берутся денормализованные счетчики.
+    """
+    if period == RecipePopularity.Period.ALL:
+        return dict(Recipe.objects.annotate(
+            score=models.F('favorites_count') + models.F(
+                'shopping_cart_count'),
+        ).filter(score__gt=0).order_by('-score', 'pk').values_list(
+            'pk', 'score')[:size])
+    since = (now or timezone.now()) - POPULARITY_WINDOWS[period]
+    scores = Counter()
+    for model in (Favorite, ShoppingCart):
+        scores.update(dict(model.objects.filter(
+            created_at__gte=since).order_by().values('recipe').annotate(
+            total=models.Count('pk')).values_list('recipe', 'total')))
+    return dict(sorted(scores.items(),
+                       key=lambda item: (-item[1], item[0]))[:size])
+
+
+def refresh_popularity(size, now=None):
+    """Пересчитывает рейтинги всех периодов; возвращает число
+    измененных строк по периодам."""
+    return {
+        period: RecipePopularity.objects.replace_scores(
+            period, popularity_scores(period, size, now))
+        for period in RecipePopularity.Period
+    }
+
+
+class FeedEntryQuerySet(models.QuerySet):
+    """Ленты подписчиков с рассылкой рецептов при публикации.
+
+    Рецепты авторов с числом подписчиков больше порога не рассылаются:
+    автор получает ``pull_feed``, и его рецепты добавляются в ленты при
+    чтении.
+    """
+
+    def publish(self, recipe, fanout_limit, batch_size):
+        """Рассылает новый рецепт подписчикам автора пачками по
+        ``batch_size``, каждая пачка — отдельный запрос."""
+        followers = Subscription.objects.filter(author_id=recipe.author_id)
+        if User.objects.filter(pk=recipe.author_id, pull_feed=True).exists():
+            return
+        if followers.count() > fanout_limit:
+            User.objects.filter(pk=recipe.author_id).update(pull_feed=True)
+            return
+        last = 0
+        while True:
+            user_ids = list(followers.filter(user_id__gt=last).order_by(
+                'user_id').values_list('user_id', flat=True)[:batch_size])
+            if not user_ids:
+                return
+            self.bulk_create(
+                (self.model(user_id=user_id, recipe_id=recipe.pk,
+                            author_id=recipe.author_id)
+                 for user_id in user_ids),
+                ignore_conflicts=True
+            )
+            last = user_ids[-1]
+
+    def follow(self, user_id, author_id, size):
+        """Добавляет в ленту последние ``size`` рецептов автора."""
+        self.bulk_create(
+            (
+                self.model(user_id=user_id, recipe_id=pk, author_id=author_id)
+                for pk in Recipe.objects.filter(
+                    author_id=author_id, author__pull_feed=False
+                ).order_by('-pk').values_list('pk', flat=True)[:size]
+            ),
+            ignore_conflicts=True
+        )
+
+    def unfollow(self, user_id, author_id):
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+    def rebuild(self, fanout_limit, user_ids=None):
+        """Строит ленты заново по подпискам, заодно переводя авторов
+        с большим числом подписчиков в режим чтения по запросу."""
+        with transaction.atomic():
+            User.objects.filter(pk__in=Subscription.objects.order_by().values(
+                'author').annotate(total=models.Count('pk')).filter(
+                total__gt=fanout_limit).values('author')
+            ).update(pull_feed=True)
+            rows = self.all()
+            subscriptions = Subscription.objects.filter(
+                author__pull_feed=False)
+            if user_ids is not None:
+                rows = rows.filter(user_id__in=user_ids)
+                subscriptions = subscriptions.filter(user_id__in=user_ids)
+            rows.delete()
+            self.bulk_create(
+                (
+                    self.model(user_id=user_id, recipe_id=recipe_id,
+                               author_id=author_id)
+                    for user_id, author_id, recipe_id
+                    in subscriptions.filter(
+                        author__recipes__isnull=False
+                    ).values_list('user_id', 'author_id',
+                                  'author__recipes').iterator()
+                ),
+                batch_size=1000
+            )
+
+    def page(self, user, before, limit):
+        """До ``limit`` id рецептов ленты меньше ``before`` по убыванию.
+
+        Один запрос: диапазон индекса ленты пользователя и рецепты
+        авторов с ``pull_feed`` из его подписок. Рецепт, разосланный до
+        перевода автора в этот режим, может встретиться дважды.
+        """
+        pushed = self.filter(user=user)
+        pulled = Recipe.objects.filter(
+            author__in=Subscription.objects.filter(
+                user=user, author__pull_feed=True).values('author'))
+        if before is not None:
+            pushed = pushed.filter(recipe_id__lt=before)
+            pulled = pulled.filter(pk__lt=before)
+        pushed = pushed.order_by().values_list('recipe_id', flat=True)
+        pulled = pulled.order_by().values_list('pk', flat=True)
+        return list(pushed.union(pulled, all=True).order_by(
+            '-recipe_id')[:limit])
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика."""
+
+    user = models.ForeignKey(
+        User,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        related_name='feed_entries',
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    author = models.ForeignKey(
+        User,
+        related_name='+',
+        on_delete=models.CASCADE,
+        verbose_name='Автор'
+    )
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'запись ленты'
+        verbose_name_plural = 'Ленты подписок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe'),
+                name='unique_feed_entry',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user_id}: {self.recipe_id}'
+
+
+class RecipeDeletion(models.Model):
+    """Отметка об удалении рецепта: по ним процессы убирают удаленные
+    рецепты из индекса в памяти, не сверяя все id с таблицей."""
+
+    recipe_id = models.IntegerField('id рецепта')
+    deleted_at = models.DateTimeField('Удален', auto_now_add=True,
+                                      db_index=True)
+
+    class Meta:
+        verbose_name = 'удаление рецепта'
+        verbose_name_plural = 'Удаления рецептов'
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.deleted_at}'
@@ -0,0 +1,75 @@
+import json
+from itertools import islice
+
+CHUNK_SIZE = 64 * 1024
+# Ошибка декодирования ближе к концу буфера может означать обрезанную
+# чтением запись (``tru``, ``"\u12``), а не ошибку в файле.
+INCOMPLETE_TAIL = 16
+
+
+def is_incomplete(error, buffer):
+    """Может ли ошибка исчезнуть после чтения следующего блока."""
+    return (error.pos >= len(buffer) - INCOMPLETE_TAIL
+            or error.msg.startswith('Unterminated string'))
+
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    """Потоковое чтение элементов JSON-массива без загрузки файла целиком.
+
+    Некорректная запись, за которой в буфере уже есть продолжение файла,
+    сразу вызывает ``ValueError``. Недочитанная запись догружается блоками
+    не меньше уже прочитанной части, поэтому длинная запись разбирается
+    заново лишь логарифмическое число раз.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, started = '', 0, False
+    while True:
+        while position < len(buffer) and (
+                buffer[position].isspace() or buffer[position] == ','
+                or (not started and buffer[position] == '[')):
+            started = started or buffer[position] == '['
+            position += 1
+        if started and buffer[position:position + 1] == ']':
+            return
+        if position < len(buffer):
+            if not started:
+                raise ValueError('Ожидался JSON-массив.')
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if not is_incomplete(error, buffer):
+                    raise ValueError(f'Некорректный JSON: {error}')
+            else:
+                yield item
+                continue
+        chunk = file.read(max(chunk_size, len(buffer) - position))
+        if not chunk:
+            if buffer[position:].strip():
+                raise ValueError('Некорректный JSON в конце файла.')
+            return
+        buffer = buffer[position:] + chunk
+        position = 0
+
+
+def iter_ndjson(file):
+    """Построчное чтение NDJSON: по одному JSON-объекту в строке."""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_json_records(file):
+    """JSON-массив или NDJSON, определяется по первому символу."""
+    first = ''
+    while not first.strip():
+        first = file.read(1)
+        if not first:
+            return iter(())
+    file.seek(0)
+    return iter_json_array(file) if first == '[' else iter_ndjson(file)
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
@@ -0,0 +1,101 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+
+На PostgreSQL поле ``Recipe.search_vector`` поддерживается триггером
+(русская морфология, название весомее описания) и индексируется GIN.
+На SQLite используется внешняя таблица FTS5 с триггерами синхронизации.
+Триггеры, индекс и таблица создаются миграцией ``0009_recipe_search``
+со своей копией SQL; здесь — запросы поиска и восстановление триггеров
+SQLite после миграций.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipe_recipe_fts'
+
+SQLITE_TRIGGERS_SQL = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert
+    AFTER INSERT ON recipe_recipe BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete
+    AFTER DELETE ON recipe_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update
+    AFTER UPDATE OF name, text ON recipe_recipe BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO {FTS_TABLE}(rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+)
+
+
+def execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def restore_sqlite_triggers(connection):
+    """SQLite пересоздает таблицу при изменении схемы и теряет триггеры,
+    поэтому после миграций они восстанавливаются."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+            [FTS_TABLE])
+        if cursor.fetchone() is None:
+            return
+    execute(connection, SQLITE_TRIGGERS_SQL)
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def search_recipes(queryset, connection, query):
+    """Рецепты, содержащие все слова запроса (с учетом префиксов),
+    с релевантностью в аннотации ``search_rank``."""
+    terms = search_terms(query)
+    if not terms:
+        return queryset
+    if connection.vendor == 'postgresql':
+        search_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            config=SEARCH_CONFIG, search_type='raw')
+        # ts_rank возвращает real; double precision без потерь проходит
+        # через курсор и точно сравнивается со значением из него.
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=Cast(SearchRank(models.F('search_vector'),
+                                        search_query), models.FloatField())
+        ).order_by('-search_rank', 'id')
+    if connection.vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [match]
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = recipe_recipe.id',
+            [match], output_field=models.FloatField()
+        )).order_by('-search_rank', 'id')
+    query_filter = models.Q()
+    for term in terms:
+        query_filter &= (models.Q(name__icontains=term)
+                         | models.Q(text__icontains=term))
+    return queryset.filter(query_filter)
@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from django.utils.timezone import now
+
+from . import search
+from .models import (Favorite, FeedEntry, Ingredient, Recipe,
+                     RecipeDeletion, ShoppingCart, ShoppingCartIngredient,
+                     Subscription, User, change_counter)
+
+AUTHOR_FIELDS = {'username', 'email', 'first_name', 'last_name', 'avatar'}
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_carts(sender, instance, **kwargs):
+    """Вычитает ингредиенты удаляемого рецепта из корзин с ним."""
+    ShoppingCartIngredient.objects.add_recipe(
+        instance.shopping_carts.values_list('user_id', flat=True),
+        instance, sign=-1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_delete, sender=Recipe)
+def record_recipe_deletion(sender, instance, **kwargs):
+    RecipeDeletion.objects.create(recipe_id=instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feeds(sender, instance, created, **kwargs):
+    """Рассылка нового рецепта подписчикам после фиксации транзакции."""
+    if created:
+        transaction.on_commit(lambda: FeedEntry.objects.publish(
+            instance, settings.FEED_FANOUT_LIMIT,
+            settings.FEED_FANOUT_BATCH_SIZE))
+
+
+@receiver(post_save, sender=Subscription)
+def fill_feed(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.follow(instance.user_id, instance.author_id,
+                                 settings.FEED_BACKFILL_SIZE)
+
+
+@receiver(post_delete, sender=Subscription)
+def clear_feed(sender, instance, **kwargs):
+    FeedEntry.objects.unfollow(instance.user_id, instance.author_id)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, sender.counter_field, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, sender.counter_field, -1)
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, update_fields=None,
+                         **kwargs):
+    """Обновляет время изменения рецептов при изменении автора."""
+    if created or (update_fields is not None
+                   and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=now())
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created=False, **kwargs):
+    """Обновляет время изменения рецептов с измененным ингредиентом."""
+    if not created:
+        Recipe.objects.filter(
+            recipe_ingredients__ingredient=instance
+        ).update(updated_at=now())
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == 'recipe':
+        search.restore_sqlite_triggers(connections[using])